@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_backends import FakeBackendServer
+from src.llm.backends import OllamaBackend, OpenAIBackend
+
+# Per-request overhead of the model clients against a local stub server, before
+# (new client per image, ollama keep_alive="1s") and after (shared pooled clients,
+# configurable keep_alive). --gap emulates the time spent on OCR between requests.
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark per-request client overhead against a stub HTTP server')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per scenario')
+    parser.add_argument('--latency', type=float, default=0.0, help='Stub server latency per request in seconds')
+    parser.add_argument('--load_latency', type=float, default=0.5, help='Stub ollama model load time in seconds')
+    parser.add_argument('--gap', type=float, default=1.2, help='Idle seconds between ollama requests (the old per-image wait)')
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON to this file')
+    return parser.parse_args()
+
+MESSAGES = [{'role': 'user', 'content': 'Bitte beschreibe das Bild.'}]
+
+def run_scenario(server, n, request_fn, gap=0.0):
+    server.reset_stats()
+    timings = []
+    for _ in range(n):
+        start = time.perf_counter()
+        request_fn()
+        timings.append(time.perf_counter() - start)
+        if gap:
+            time.sleep(gap)
+    stats = server.stats
+    return {
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p50_ms': statistics.median(timings) * 1000,
+        'connections': stats['connections'],
+        'model_loads': stats['model_loads'],
+    }
+
+def main():
+    args = parse_arguments()
+    import ollama
+    import openai
+
+    results = {}
+    with FakeBackendServer(latency=args.latency, load_latency=args.load_latency) as server:
+        # ollama requests are few and slow, so only a handful are timed with the idle gap
+        n_ollama = max(3, min(args.requests, 10))
+        results['ollama_before'] = run_scenario(
+            server, n_ollama,
+            lambda: ollama.Client(host=server.url).chat(model='llava-llama3', messages=MESSAGES, keep_alive='1s'),
+            gap=args.gap)
+        backend = OllamaBackend(host=server.url, keep_alive='5m')
+        results['ollama_after'] = run_scenario(
+            server, n_ollama,
+            lambda: backend.chat(model='llava-llama3', messages=MESSAGES),
+            gap=args.gap)
+
+        base_url = server.url + '/v1'
+        results['openai_before'] = run_scenario(
+            server, args.requests,
+            lambda: openai.OpenAI(api_key='benchmark', base_url=base_url).chat.completions.create(model='gpt-4o', messages=MESSAGES))
+        openai_backend = OpenAIBackend(api_key='benchmark', base_url=base_url)
+        results['openai_after'] = run_scenario(
+            server, args.requests,
+            lambda: openai_backend.chat_completion(model='gpt-4o', messages=MESSAGES))
+
+    print(f"{'scenario':<16}{'mean_ms':>10}{'p50_ms':>10}{'connections':>13}{'model_loads':>13}")
+    for name, row in results.items():
+        print(f"{name:<16}{row['mean_ms']:>10.2f}{row['p50_ms']:>10.2f}{row['connections']:>13}{row['model_loads']:>13}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
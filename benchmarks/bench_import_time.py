@@ -0,0 +1,60 @@
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+# Guards the cold start of the CLI: runs `python -X importtime src/main.py --help`
+# a few times and fails if it gets slower than the budget or pulls in a backend.
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MAIN = os.path.join(REPO_ROOT, 'src', 'main.py')
+BACKEND_MODULES = ['pandas', 'numpy', 'cv2', 'pytesseract', 'tesserocr', 'PIL', 'pillow_heif', 'exifread',
+                   'ollama', 'httpx', 'openai', 'genanki', 'pyarrow']
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the CLI')
+    parser.add_argument('--runs', type=int, default=5, help='Number of cold starts to measure')
+    parser.add_argument('--max_ms', type=float, default=150, help='Fail if the median total import time exceeds this many milliseconds')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to print')
+    parser.add_argument('--args', type=str, default='--help', help='Arguments passed to main.py')
+    return parser.parse_args()
+
+def measure(cli_args):
+    result = subprocess.run([sys.executable, '-X', 'importtime', MAIN] + cli_args.split(),
+                            capture_output=True, text=True, cwd=REPO_ROOT)
+    imports = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, module = match.groups()
+        imports[module] = int(cumulative)
+        if len(indent) == 1:
+            total_us += int(cumulative)
+    return total_us, imports
+
+def main():
+    args = parse_arguments()
+    runs = [measure(args.args) for _ in range(args.runs)]
+    totals = sorted(total for total, _ in runs)
+    median_ms = totals[len(totals) // 2] / 1000
+    imports = runs[-1][1]
+
+    print(f"Import time of `main.py {args.args}` over {args.runs} runs: median {median_ms:.1f} ms, min {totals[0] / 1000:.1f} ms")
+    for module, cumulative in sorted(imports.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    loaded_backends = sorted({m.split('.')[0] for m in imports} & set(BACKEND_MODULES))
+    failed = False
+    if loaded_backends and args.args == '--help':
+        print(f"FAIL: --help imported backend modules: {', '.join(loaded_backends)}")
+        failed = True
+    if median_ms > args.max_ms:
+        print(f"FAIL: median import time {median_ms:.1f} ms exceeds the {args.max_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import contextlib
+import statistics
+import subprocess
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_backends import FakeBackendServer
+from benchmarks.synthetic_images import WORDS, generate_images
+
+# Throughput of the pipeline stages on synthetic photo folders, without a model,
+# an API key or a real photo library: the model backends are the local stub server
+# and the photos come from synthetic_images.py. Every (stage, folder size) pair runs
+# in its own process, so the reported peak RSS belongs to that stage alone.
+# The run_pipeline stages run the whole pipeline (conversion, metadata, OCR, model
+# requests, parsing) as main.py does. They get the known text of every photo as
+# cached OCR output, so they run without tesseract.
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STAGES = ['convert_heic_to_jpg', 'extract_ocr_text', 'run_pipeline_llava', 'run_pipeline_openai',
+          'build_table_from_responses', 'build_vocab_table', 'build_anki_deck']
+LLM_STAGES = ['run_pipeline_llava', 'run_pipeline_openai']
+
+PROMPT = """
+    Please extract the German words from the following OCR output for a study guide at the {language_level} level.
+    OCR output:
+    {ocr_output}
+    Return the filled-in JSON object, preceded by the marker "JSON_START:".
+    """
+
+TRANSLATIONS = ['the street', 'the station', 'the bakery', 'the exit', 'the pharmacy', 'open', 'closed', 'the playground',
+                'the stop', 'the town hall', 'the entrance', 'the church', 'the museum', 'the bridge', 'caution',
+                'please do not smoke', 'the market', 'the post office', 'the hospital', 'the police', 'keep the exit clear',
+                'the cinema', 'the school', 'the park', 'smoking prohibited', 'the bookshop', 'the café', 'Monday to Friday']
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic photos against stub model backends')
+    parser.add_argument('--sizes', type=str, default='10,1000,10000', help='Comma separated numbers of photos')
+    parser.add_argument('--stages', type=str, default=','.join(STAGES), help='Comma separated stages to run')
+    parser.add_argument('--workdir', type=str, default=os.path.join(REPO_ROOT, 'benchmarks', '.bench_pipeline'), help='Directory of the synthetic photo folders, reused across runs')
+    parser.add_argument('--unique', type=int, default=100, help='Distinct photos per folder, the others are copies')
+    parser.add_argument('--output', type=str, default='bench_pipeline_results.json', help='Results file')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for HEIC conversion (default: all cores)')
+    parser.add_argument('--ocr_workers', type=int, default=None, help='Worker processes for OCR (default: all cores)')
+    parser.add_argument('--max_concurrency', type=int, default=4, help='Requests in flight in the LLM stages')
+    parser.add_argument('--ocr_sample', type=int, default=None, help='OCR at most this many photos per folder')
+    parser.add_argument('--llm_sample', type=int, default=None, help='Send at most this many photos per folder to the stub backends')
+    parser.add_argument('--latency', type=float, default=0.05, help='Stub server latency per request in seconds')
+    parser.add_argument('--rate_limit_every', type=int, default=0, help='Answer every n-th request to the stub server with a 429')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier results file to compare against')
+    parser.add_argument('--max_regression', type=float, default=0.2, help='Fail if a stage is this much slower (images/s) than in the baseline')
+    # internal: run one stage in a child process
+    parser.add_argument('--run_stage', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--images_dir', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--backend_url', type=str, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def latency_summary(latencies):
+    if not latencies:
+        return None
+    latencies = sorted(latencies)
+    return {
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+
+def load_texts(images_dir):
+    with open(os.path.join(images_dir, 'texts.json'), 'r') as f:
+        return json.load(f)
+
+def prepare_folder(images_dir, n, unique):
+    texts_path = os.path.join(images_dir, 'texts.json')
+    if os.path.exists(texts_path) and len(load_texts(images_dir)) == n:
+        return
+    shutil.rmtree(images_dir, ignore_errors=True)
+    print(f"Generating {n} synthetic photos in {images_dir}")
+    texts = generate_images(images_dir, n, unique=unique)
+    with open(texts_path, 'w') as f:
+        json.dump(texts, f)
+
+def jpg_paths(images_dir, workers):
+    # converted by an earlier convert_heic_to_jpg run, or now (not timed)
+    from src.image_utils import convert_heic_to_jpg
+    _, jpg_files = convert_heic_to_jpg(images_dir, workers=workers)
+    return jpg_files
+
+class SeededOCRCache:
+    # Serves the known text of every photo as its cached OCR output and caches
+    # nothing else, so every model request reaches the stub server.
+    def __init__(self, image_paths, texts):
+        from src.ocr.text_extraction import ocr_cache_key
+        self.entries = {}
+        for image_path, text in zip(image_paths, texts):
+            with open(image_path, 'rb') as f:
+                self.entries[ocr_cache_key(f.read())] = text
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, value):
+        pass
+
+def timed(fn, latencies):
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return call
+
+def synthetic_records(n, seed=0):
+    # responses and typed metadata as the pipeline journals them; the vocabulary
+    # grows with the number of photos like a real collection does
+    rng = random.Random(seed)
+    responses, metadata, paths = [], [], []
+    for i in range(n):
+        picks = [rng.randrange(len(WORDS)) for _ in range(6)]
+        variants = [rng.randrange(max(1, n // 4)) for _ in picks]
+        words = [f"{WORDS[p]} {v}" for p, v in zip(picks, variants)]
+        translations = [f"{TRANSLATIONS[p]} {v}" for p, v in zip(picks, variants)]
+        responses.append('JSON_START:' + json.dumps({
+            'extracted_words': words[:3], 'translated_extracted_words': translations[:3],
+            'suggested_words': words[3:], 'translated_suggested_words': translations[3:],
+            'image_quality': rng.choice(['high', 'medium', 'low']),
+            'relevance_explanation': 'Words from a sign.', 'quality_explanation': 'The text is clear.',
+        }, ensure_ascii=False))
+        taken_at = datetime(2024, 6, 1, 9, 0, 0).timestamp() + i * 20
+        metadata.append({
+            'image_datetime': datetime.fromtimestamp(taken_at).isoformat(), 'latitude_ref': 'N', 'latitude': 52.52 + i * 1e-5,
+            'longitude_ref': 'E', 'longitude': 13.405 + i * 1e-5, 'altitude_ref': 0, 'altitude': 34.0,
+            'timestamp': '09:00:00', 'date': '2024-06-01', 'gps_datetime': '2024-06-01T09:00:00+00:00', 'speed_ref': None, 'speed': None,
+        })
+        paths.append(f'synthetic_{i:05d}.jpg')
+    return responses, metadata, paths
+
+def photo_table(n):
+    import pandas as pd
+    from src.image_utils import build_table_from_responses
+    responses, metadata, paths = synthetic_records(n)
+    responses_df, metadata_df = build_table_from_responses(responses, [''] * n, metadata, paths)
+    return pd.merge(metadata_df, responses_df, on='photo_id')
+
+def bench_convert(args, n):
+    from src.image_utils import iter_heic_to_jpg
+    from src.image_utils.image_conversion import MANIFEST_NAME
+    manifest_path = os.path.join(args.images_dir, 'jpg', MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    latencies = []
+    start = time.perf_counter()
+    for _, _, stats in iter_heic_to_jpg(args.images_dir, workers=args.workers, with_stats=True):
+        latencies.append(stats['wall_s'])
+    return {'measured_images': len(latencies), 'wall_s': time.perf_counter() - start, 'latencies': latencies}
+
+def bench_ocr(args, n):
+    import pytesseract
+    from src.ocr import iter_ocr_text
+    from src.ocr import text_extraction
+    if text_extraction.tesserocr is None and shutil.which(pytesseract.pytesseract.tesseract_cmd) is None:
+        return {'skipped': 'tesseract is not installed'}
+    paths = jpg_paths(args.images_dir, args.workers)[:args.ocr_sample or n]
+    latencies = []
+    start = time.perf_counter()
+    for _, stats in iter_ocr_text(paths, workers=args.ocr_workers, with_stats=True):
+        latencies.append(stats['wall_s'])
+    return {'measured_images': len(latencies), 'wall_s': time.perf_counter() - start, 'latencies': latencies}
+
+def bench_pipeline(args, n):
+    from src.main import make_llava_query, make_openai_query
+    from src.llm import OllamaBackend, OpenAIBackend
+    from src.pipeline import RunJournal, run_pipeline
+    cache = SeededOCRCache(jpg_paths(args.images_dir, args.workers), load_texts(args.images_dir))
+    filenames = sorted(f for f in os.listdir(args.images_dir) if f.lower().endswith('.heic'))[:args.llm_sample or n]
+    # a new journal every run, an old one would make run_pipeline skip its photos
+    result_directory = os.path.join(args.images_dir, args.run_stage)
+    shutil.rmtree(result_directory, ignore_errors=True)
+    os.makedirs(result_directory)
+    journal = RunJournal(result_directory)
+    latencies = []
+    if args.run_stage == 'run_pipeline_llava':
+        backend = OllamaBackend(host=args.backend_url)
+        backend.chat = timed(backend.chat, latencies)
+        query_fn = make_llava_query(PROMPT, 'A1', backend=backend)
+    else:
+        # 429s are left to the shared backoff instead of the client's own retries
+        backend = OpenAIBackend(api_key='benchmark', base_url=args.backend_url + '/v1', max_retries=0)
+        backend.chat_completion = timed(backend.chat_completion, latencies)
+        query_fn = make_openai_query(PROMPT, 'A1', backend=backend)
+    start = time.perf_counter()
+    try:
+        run_pipeline(args.images_dir, journal, query_fn, convert_options={'workers': args.workers}, ocr_options={'workers': 1, 'cache': cache},
+                     max_workers=args.max_concurrency, filenames=filenames)
+    finally:
+        journal.close()
+    wall_s = time.perf_counter() - start
+    records = RunJournal(result_directory).records()
+    parse_errors = sum(r['parsed'].get('relevance_explanation') == 'Parsing error' for r in records)
+    return {'measured_images': len(filenames), 'wall_s': wall_s, 'latencies': latencies, 'parse_errors': parse_errors,
+            'failed': len(filenames) - len(records)}
+
+def bench_tables(args, n):
+    from src.image_utils import build_table_from_responses, build_vocab_table
+    if args.run_stage == 'build_table_from_responses':
+        responses, metadata, paths = synthetic_records(n)
+        start = time.perf_counter()
+        build_table_from_responses(responses, [''] * n, metadata, paths)
+        return {'measured_images': n, 'wall_s': time.perf_counter() - start}
+    photo_df = photo_table(n)
+    start = time.perf_counter()
+    vocab_df = build_vocab_table(photo_df, quality_cutoff='low')
+    wall_s = time.perf_counter() - start
+    if args.run_stage == 'build_vocab_table':
+        return {'measured_images': n, 'wall_s': wall_s, 'vocab_rows': len(vocab_df)}
+
+    from src.deck import build_anki_deck
+    out_dir = os.path.join(args.images_dir, 'deck')
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    build_anki_deck(vocab_df, out_dir)
+    return {'measured_images': n, 'wall_s': time.perf_counter() - start, 'vocab_rows': len(vocab_df)}
+
+BENCHMARKS = {
+    'convert_heic_to_jpg': bench_convert,
+    'extract_ocr_text': bench_ocr,
+    'run_pipeline_llava': bench_pipeline,
+    'run_pipeline_openai': bench_pipeline,
+    'build_table_from_responses': bench_tables,
+    'build_vocab_table': bench_tables,
+    'build_anki_deck': bench_tables,
+}
+
+def run_stage(args):
+    # stage output goes to stderr, stdout only carries the result line
+    n = len(load_texts(args.images_dir))
+    with contextlib.redirect_stdout(sys.stderr):
+        result = BENCHMARKS[args.run_stage](args, n)
+    if 'skipped' not in result:
+        latencies = result.pop('latencies', None)
+        result['images_per_s'] = result['measured_images'] / result['wall_s'] if result['wall_s'] else None
+        result['latency'] = latency_summary(latencies)
+        result['peak_rss_mb'] = peak_rss_mb()
+        result['peak_child_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    print(json.dumps(result))
+
+def run_stage_process(args, stage, images_dir, backend_url):
+    command = [sys.executable, os.path.abspath(__file__), '--run_stage', stage, '--images_dir', images_dir,
+               '--backend_url', backend_url, '--max_concurrency', str(args.max_concurrency)]
+    for option in ['workers', 'ocr_workers', 'ocr_sample', 'llm_sample']:
+        if getattr(args, option) is not None:
+            command += [f'--{option}', str(getattr(args, option))]
+    # tesseract finds its language data like it does for main.py
+    env = dict(os.environ, TESSDATA_PREFIX=os.environ.get('TESSDATA_PREFIX', 'tools/'))
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=REPO_ROOT, env=env)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f'exit code {completed.returncode}'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def git_commit():
+    completed = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=REPO_ROOT)
+    return completed.stdout.strip() or None
+
+def print_row(row):
+    if 'skipped' in row or 'error' in row:
+        print(f"{row['stage']:<32}{row['images']:>7}  {row.get('skipped') or 'FAILED: ' + row['error']}")
+        return
+    latency = row['latency']['p50_ms'] if row['latency'] else float('nan')
+    print(f"{row['stage']:<32}{row['images']:>7}{row['measured_images']:>9}{row['wall_s']:>10.2f}{row['images_per_s']:>12.1f}"
+          f"{latency:>10.1f}{row['peak_rss_mb']:>10.0f}")
+
+def compare(results, baseline_path, max_regression):
+    with open(baseline_path, 'r') as f:
+        baseline = {(r['stage'], r['images']): r for r in json.load(f)['results']}
+    regressions = []
+    for row in results:
+        before = baseline.get((row['stage'], row['images']))
+        if not before or not before.get('images_per_s') or not row.get('images_per_s'):
+            continue
+        change = row['images_per_s'] / before['images_per_s'] - 1
+        print(f"{row['stage']:<32}{row['images']:>7}  {before['images_per_s']:>10.1f} -> {row['images_per_s']:>10.1f} images/s ({change:+.0%})")
+        if change < -max_regression:
+            regressions.append(row)
+    for row in regressions:
+        print(f"FAIL: {row['stage']} with {row['images']} images is more than {max_regression:.0%} slower than the baseline")
+    return not regressions
+
+def main():
+    args = parse_arguments()
+    if args.run_stage:
+        run_stage(args)
+        return 0
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = [s for s in stages if s not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"Unknown stages: {', '.join(unknown)}")
+
+    results = []
+    with FakeBackendServer(latency=args.latency, rate_limit_every=args.rate_limit_every) as server:
+        for n in sizes:
+            images_dir = os.path.join(args.workdir, f'images_{n}')
+            prepare_folder(images_dir, n, args.unique)
+            print(f"{'stage':<32}{'images':>7}{'measured':>9}{'wall_s':>10}{'images/s':>12}{'p50_ms':>10}{'rss_mb':>10}")
+            for stage in stages:
+                server.reset_stats()
+                row = dict(stage=stage, images=n, **run_stage_process(args, stage, images_dir, server.url))
+                if stage in LLM_STAGES:
+                    row['backend'] = server.stats
+                results.append(row)
+                print_row(row)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': {k: v for k, v in vars(args).items() if k not in ('run_stage', 'images_dir', 'backend_url')},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.baseline and not compare(results, args.baseline, args.max_regression):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
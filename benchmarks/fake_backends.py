@@ -0,0 +1,232 @@
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the ollama and OpenAI HTTP APIs used by the benchmarks.
+# It answers /api/chat, /api/generate and /v1/chat/completions with a canned
+# completion after a configurable latency, and emulates ollama's model residency:
+# a request that arrives after the previous keep_alive expired pays load_latency.
+# Streaming requests get the completion in small chunks, token_latency apart; a
+# client that hangs up before the end is counted as a cancelled stream.
+# With rate_limit_every=n every n-th request is answered with a 429 instead, and a
+# batched prompt ("This request contains n images") gets a JSON array of n objects.
+
+CANNED_ANSWER = {
+    "extracted_words": ["der Spielplatz", "die Sanierung"],
+    "translated_extracted_words": ["the playground", "the renovation"],
+    "suggested_words": ["die Kinder", "spielen"],
+    "translated_suggested_words": ["the children", "to play"],
+    "image_quality": "high",
+    "relevance_explanation": "Words from a playground sign.",
+    "quality_explanation": "The text is clear.",
+}
+CANNED_RESPONSE = 'JSON_START:\n' + json.dumps(CANNED_ANSWER)
+BATCH_REQUEST = re.compile(r'This request contains (\d+) images')
+
+def canned_batch_response(n_images):
+    return 'JSON_START:\n' + json.dumps([dict(CANNED_ANSWER, image_index=i) for i in range(n_images)])
+
+def parse_duration(value, default=300.0):
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float('inf') if value < 0 else float(value)
+    match = re.fullmatch(r'(-?\d+(?:\.\d+)?)(ms|s|m|h)?', str(value).strip())
+    if not match:
+        return default
+    number = float(match.group(1))
+    if number < 0:
+        return float('inf')
+    return number * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, None: 1}[match.group(2)]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, content_type, events):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for event in events:
+                data = event.encode('utf-8')
+                self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+                time.sleep(self.server.token_latency)
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            with self.server.lock:
+                self.server.stats['cancelled_streams'] += 1
+            self.close_connection = True
+
+    def _response_text(self, request):
+        batch = BATCH_REQUEST.search(json.dumps(request.get('messages', request.get('prompt', ''))))
+        if batch and self.server.response_text == CANNED_RESPONSE:
+            return canned_batch_response(int(batch.group(1)))
+        return self.server.response_text
+
+    def _tokens(self, text):
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def _rate_limit(self):
+        self.send_response(429)
+        body = json.dumps({'error': {'message': 'Rate limit reached, please retry later', 'type': 'rate_limit_error',
+                                     'code': 'rate_limit_exceeded'}}).encode('utf-8')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Retry-After', str(self.server.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _model_residency(self, keep_alive):
+        with self.server.lock:
+            now = time.monotonic()
+            needs_load = now > self.server.model_loaded_until
+            if needs_load:
+                self.server.stats['model_loads'] += 1
+        if needs_load:
+            time.sleep(self.server.load_latency)
+        with self.server.lock:
+            self.server.model_loaded_until = time.monotonic() + parse_duration(keep_alive)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        with server.lock:
+            server.stats['requests'] += 1
+            rate_limited = server.rate_limit_every and server.stats['requests'] % server.rate_limit_every == 0
+            if rate_limited:
+                server.stats['rate_limited'] += 1
+        if rate_limited:
+            self._rate_limit()
+            return
+
+        if self.path.startswith('/api/'):
+            self._model_residency(request.get('keep_alive'))
+        time.sleep(server.latency)
+        prompt_tokens = len(json.dumps(request.get('messages', request.get('prompt', '')))) // 4
+        response_text = self._response_text(request)
+
+        if self.path == '/api/chat' and request.get('stream'):
+            def events():
+                tokens = self._tokens(response_text)
+                for token in tokens:
+                    with server.lock:
+                        server.stats['streamed_tokens'] += 1
+                    yield json.dumps({'model': request.get('model'), 'created_at': '2024-06-01T00:00:00Z',
+                                      'message': {'role': 'assistant', 'content': token}, 'done': False}) + '\n'
+                yield json.dumps({'model': request.get('model'), 'created_at': '2024-06-01T00:00:00Z',
+                                  'message': {'role': 'assistant', 'content': ''}, 'done': True,
+                                  'prompt_eval_count': prompt_tokens, 'eval_count': len(tokens)}) + '\n'
+            self._stream('application/x-ndjson', events())
+        elif self.path == '/api/chat':
+            self._send_json(200, {
+                'model': request.get('model'),
+                'created_at': '2024-06-01T00:00:00Z',
+                'message': {'role': 'assistant', 'content': response_text},
+                'done': True,
+                'total_duration': int(server.latency * 1e9),
+                'prompt_eval_count': prompt_tokens,
+                'eval_count': len(response_text) // 4,
+                'eval_duration': int(server.latency * 1e9),
+            })
+        elif self.path == '/api/generate':
+            self._send_json(200, {
+                'model': request.get('model'),
+                'created_at': '2024-06-01T00:00:00Z',
+                'response': response_text,
+                'done': True,
+                'prompt_eval_count': prompt_tokens,
+                'eval_count': len(response_text) // 4,
+            })
+        elif self.path.endswith('/chat/completions') and request.get('stream'):
+            def events():
+                tokens = self._tokens(response_text)
+                chunk = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': request.get('model')}
+                for token in tokens:
+                    with server.lock:
+                        server.stats['streamed_tokens'] += 1
+                    yield 'data: ' + json.dumps(dict(chunk, choices=[{'index': 0, 'delta': {'content': token}, 'finish_reason': None}])) + '\n\n'
+                yield 'data: ' + json.dumps(dict(chunk, choices=[], usage={'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                                                                         'total_tokens': prompt_tokens + len(tokens)})) + '\n\n'
+                yield 'data: [DONE]\n\n'
+            self._stream('text/event-stream', events())
+        elif self.path.endswith('/chat/completions'):
+            self._send_json(200, {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': response_text}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(response_text) // 4,
+                          'total_tokens': prompt_tokens + len(response_text) // 4},
+            })
+        else:
+            self._send_json(404, {'error': f'unknown endpoint {self.path}'})
+
+class FakeBackendServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, load_latency=0.0, response_text=CANNED_RESPONSE, token_latency=0.0,
+                 rate_limit_every=0, retry_after=0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.latency = latency
+        self.httpd.load_latency = load_latency
+        self.httpd.response_text = response_text
+        self.httpd.token_latency = token_latency
+        self.httpd.rate_limit_every = rate_limit_every
+        self.httpd.retry_after = retry_after
+        self.httpd.model_loaded_until = 0.0
+        self.httpd.stats = {'requests': 0, 'connections': 0, 'model_loads': 0, 'streamed_tokens': 0, 'cancelled_streams': 0,
+                             'rate_limited': 0}
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def stats(self):
+        with self.httpd.lock:
+            return dict(self.httpd.stats)
+
+    def reset_stats(self):
+        with self.httpd.lock:
+            self.httpd.stats = {k: 0 for k in self.httpd.stats}
+            self.httpd.model_loaded_until = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
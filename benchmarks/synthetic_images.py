@@ -0,0 +1,148 @@
+import io
+import os
+import sys
+import random
+import shutil
+import struct
+import argparse
+from datetime import datetime, timedelta
+
+# Synthetic photo folders for the benchmarks: HEIC (or JPG) photos of German signs
+# with the EXIF date and GPS position of a walk through Berlin. Only `unique`
+# photos are encoded, the rest of the folder is filled with copies of them, so a
+# 10k image folder is ready in seconds while every file still gets decoded, OCRed
+# and sent to the model on its own.
+
+WORDS = ['die Straße', 'der Bahnhof', 'die Bäckerei', 'der Ausgang', 'die Apotheke', 'geöffnet', 'geschlossen',
+         'der Spielplatz', 'die Haltestelle', 'das Rathaus', 'der Eingang', 'die Kirche', 'das Museum', 'die Brücke',
+         'Vorsicht', 'Bitte nicht rauchen', 'der Markt', 'die Post', 'das Krankenhaus', 'die Polizei', 'Ausfahrt freihalten',
+         'das Kino', 'die Schule', 'der Park', 'Rauchen verboten', 'die Buchhandlung', 'das Café', 'Montag bis Freitag']
+
+START_POSITION = (52.5200, 13.4050)
+START_TIME = datetime(2024, 6, 1, 9, 0, 0)
+
+def sign_text(rng, n_lines=3):
+    return [rng.choice(WORDS) for _ in range(n_lines)]
+
+def _dms(value):
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 2)
+    return (degrees, minutes, seconds)
+
+def make_exif(taken_at, latitude, longitude):
+    from PIL import Image
+    exif = Image.Exif()
+    exif[0x0132] = taken_at.strftime('%Y:%m:%d %H:%M:%S')  # DateTime
+    gps = exif.get_ifd(0x8825)
+    gps[1] = 'N' if latitude >= 0 else 'S'
+    gps[2] = _dms(latitude)
+    gps[3] = 'E' if longitude >= 0 else 'W'
+    gps[4] = _dms(longitude)
+    gps[5] = 0
+    gps[6] = 34.0
+    gps[7] = (taken_at.hour, taken_at.minute, taken_at.second)
+    gps[29] = taken_at.strftime('%Y:%m:%d')
+    return exif
+
+def render_photo(lines, size, rng):
+    from PIL import Image, ImageDraw, ImageFont
+    background = tuple(rng.randint(90, 200) for _ in range(3))
+    image = Image.new('RGB', size, background)
+    draw = ImageDraw.Draw(image)
+    # a white sign with black text in front of a noisy "scene"
+    for _ in range(20):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + size[0] // 8, y + size[1] // 8), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    font = ImageFont.load_default(size=max(12, size[1] // 14))
+    margin = size[0] // 10
+    draw.rectangle((margin, margin, size[0] - margin, size[1] - margin), fill=(245, 245, 240), outline=(20, 20, 20), width=4)
+    for i, line in enumerate(lines):
+        draw.text((margin * 1.5, margin * 1.5 + i * size[1] // 8), line, fill=(10, 10, 10), font=font)
+    return image
+
+def _fold_iloc_base_offsets(data):
+    # libheif locates items by base_offset + extent_offset, exifread only reads the
+    # extent offset. Folding the base offset into the extents makes the file look
+    # like an iPhone HEIC, whose EXIF block exifread finds.
+    start = data.find(b'iloc') + 4
+    version = data[start]
+    if start < 4 or version > 1 or data[start + 4] != 0x44 or data[start + 5] >> 4 not in (0, 4):
+        return data
+    base_size = data[start + 5] >> 4
+    data = bytearray(data)
+    pos = start + 6
+    (item_count,) = struct.unpack_from('>H', data, pos)
+    pos += 2
+    for _ in range(item_count):
+        pos += 6 if version == 1 else 4
+        base_offset = struct.unpack_from('>I', data, pos)[0] if base_size else 0
+        if base_size:
+            struct.pack_into('>I', data, pos, 0)
+        pos += base_size
+        (extent_count,) = struct.unpack_from('>H', data, pos)
+        pos += 2
+        for _ in range(extent_count):
+            struct.pack_into('>I', data, pos, struct.unpack_from('>I', data, pos)[0] + base_offset)
+            pos += 8
+    return bytes(data)
+
+def save_photo(image, path, exif):
+    if path.lower().endswith('.heic'):
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        buffer = io.BytesIO()
+        image.save(buffer, format='HEIF', quality=80, exif=exif.tobytes())
+        with open(path, 'wb') as f:
+            f.write(_fold_iloc_base_offsets(buffer.getvalue()))
+    else:
+        image.save(path, format='JPEG', quality=85, exif=exif.tobytes())
+
+# Writes n photos named synthetic_00000.heic, ... into directory and returns the
+# text on each of them, in file name order. Photos are taken every 20 seconds a few
+# metres apart, with a jump to a new place every 25 photos.
+def generate_images(directory, n, fmt='heic', size=(1024, 768), unique=100, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    latitude, longitude = START_POSITION
+    taken_at = START_TIME
+    texts = []
+    originals = []
+    for i in range(n):
+        if i % 25 == 0 and i:
+            latitude += rng.uniform(-0.01, 0.01)
+            longitude += rng.uniform(-0.01, 0.01)
+            taken_at += timedelta(hours=1)
+        latitude += rng.uniform(-0.00005, 0.00005)
+        longitude += rng.uniform(-0.00005, 0.00005)
+        taken_at += timedelta(seconds=20)
+        path = os.path.join(directory, f'synthetic_{i:05d}.{fmt}')
+        if i < unique:
+            lines = sign_text(rng)
+            save_photo(render_photo(lines, size, rng), path, make_exif(taken_at, latitude, longitude))
+            originals.append((path, lines))
+        else:
+            source, lines = originals[i % len(originals)]
+            shutil.copyfile(source, path)
+        texts.append('\n'.join(lines))
+    return texts
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Generate a folder of synthetic photos for the benchmarks')
+    parser.add_argument('directory', type=str, help='Output directory')
+    parser.add_argument('--images', type=int, default=100, help='Number of photos')
+    parser.add_argument('--format', type=str, choices=['heic', 'jpg'], default='heic', help='File format of the photos')
+    parser.add_argument('--width', type=int, default=1024, help='Photo width in pixels')
+    parser.add_argument('--height', type=int, default=768, help='Photo height in pixels')
+    parser.add_argument('--unique', type=int, default=100, help='Number of distinct photos, the others are copies')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    generate_images(args.directory, args.images, fmt=args.format, size=(args.width, args.height), unique=args.unique, seed=args.seed)
+    print(f"Wrote {args.images} photos to {args.directory}")
+
+if __name__ == '__main__':
+    sys.exit(main())
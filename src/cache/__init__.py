@@ -0,0 +1 @@
+from .disk_cache import *
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+def bytes_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def to_jsonable(obj):
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if isinstance(obj, dict):
+        return {k: to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v) for v in obj]
+    return obj
+
+class DiskCache:
+    # SQLite backed JSON cache shared by the pipeline stages. Entries older than
+    # max_age seconds are dropped and the least recently used entries are evicted
+    # above max_entries. enabled=False bypasses the cache without touching the file.
+    def __init__(self, path, max_entries=None, max_age=None, enabled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._conn.commit()
+            self.evict()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        payload = json.dumps(to_jsonable(value), default=str)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, payload, now, now),
+            )
+            self._conn.commit()
+
+    def evict(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.max_age is not None:
+                self._conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.max_age,))
+            if self.max_entries is not None:
+                self._conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def close(self):
+        if self._conn is not None:
+            self.evict()
+            self._conn.close()
+            self._conn = None
@@ -1 +1,23 @@
-from .deck_building import *
\ No newline at end of file
+import importlib
+
+# genanki is only imported when a deck is written
+_LAZY_ATTRS = {
+    'MODEL_ID': '.deck_building',
+    'DECK_ID': '.deck_building',
+    'DECK_NAME': '.deck_building',
+    'note_guids': '.deck_building',
+    'load_export_index': '.deck_building',
+    'save_export_index': '.deck_building',
+    'build_anki_deck': '.deck_building',
+    'build_vocab_table': '.deck_building',
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return __all__
@@ -1,52 +1,19 @@
 import os
+import json
+import hashlib
 import genanki
-import pandas as pd
 
-def build_vocab_table(photo_df, quality_cutoff='medium'):
-    qualities_allowed = ['medium', 'high'] if quality_cutoff == 'medium' else ['high'] if quality_cutoff == 'high' else ['low', 'medium', 'high']
+from ..image_utils.build_tables import vocab_keys
+# build_vocab_table used to live here and is still exported by src.deck
+from ..image_utils.build_tables import build_vocab_table  # noqa: F401
 
-    extracted_words, translated_words, ex_words_photo_ids = [], [], []
-    suggested_words, translated_suggested_words, sug_words_photo_ids = [], [], []
+MODEL_ID = 1234567890
+DECK_ID = 9876543210
+DECK_NAME = 'German Vocabulary'
 
-    for _, row in photo_df.iterrows():
-        if row['image_quality'] in qualities_allowed:
-            p_id = row['photo_id']
-            e_words = row['extracted_words'] if isinstance(row['extracted_words'], list) else []
-            te_words = row['translated_extracted_words'] if isinstance(row['translated_extracted_words'], list) else []
-            s_words = row['suggested_words'] if isinstance(row['suggested_words'], list) else []
-            ts_words = row['translated_suggested_words'] if isinstance(row['translated_suggested_words'], list) else []
-
-            extracted_words.extend(e_words)
-            translated_words.extend(te_words)
-            ex_words_photo_ids.extend([p_id] * len(e_words))
-
-            suggested_words.extend(s_words)
-            translated_suggested_words.extend(ts_words)
-            sug_words_photo_ids.extend([p_id] * len(s_words))
-
-    n_e_terms = min(len(extracted_words), len(translated_words))
-    n_s_terms = min(len(suggested_words), len(translated_suggested_words))
-    ex_df = pd.DataFrame({
-        'photo_id': ex_words_photo_ids[:n_e_terms], 
-        'vocab_word': extracted_words[:n_e_terms], 
-        'english_translation': translated_words[:n_e_terms], 
-        'source': 'extracted'
-    })
-    sug_df = pd.DataFrame({
-        'photo_id': sug_words_photo_ids[:n_s_terms], 
-        'vocab_word': suggested_words[:n_s_terms], 
-        'english_translation': translated_suggested_words[:n_s_terms], 
-        'source': 'suggested'
-    })
-    vocab_df = pd.concat([ex_df, sug_df])
-    return vocab_df
-
-def build_anki_deck(df, out_dir):
-    model_id = 1234567890
-    deck_id = 9876543210
-
-    model = genanki.Model(
-        model_id,
+def _build_model():
+    return genanki.Model(
+        MODEL_ID,
         'Simple Model',
         fields=[
             {'name': 'VocabWord'},
@@ -61,16 +28,61 @@ def build_anki_deck(df, out_dir):
         ]
     )
 
-    deck = genanki.Deck(
-        deck_id,
-        'German Vocabulary'
-    )
+def _deck_id(deck_name):
+    if deck_name == DECK_NAME:
+        return DECK_ID
+    # deterministic so re-exported sub-decks merge into the same deck on import
+    return int(hashlib.sha1(deck_name.encode('utf-8')).hexdigest()[:12], 16)
+
+def note_guids(vocab_words):
+    return [genanki.guid_for(key) for key in vocab_keys(vocab_words)]
+
+def load_export_index(index_path):
+    if not index_path or not os.path.exists(index_path):
+        return set()
+    with open(index_path, 'r') as f:
+        return set(json.load(f))
+
+def save_export_index(index_path, guids):
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(sorted(guids), f)
+    os.replace(tmp_path, index_path)
+
+# Notes get GUIDs derived from the normalised word, so re-importing a deck updates
+# cards instead of duplicating them. With index_path, notes exported by earlier runs
+# are skipped. shard_by names a column of df; each value becomes its own sub-deck
+# and .apkg file. Returns the paths of the written packages.
+def build_anki_deck(df, out_dir, index_path=None, shard_by=None, deck_name=DECK_NAME):
+    df = df.dropna(subset=['vocab_word', 'english_translation']).assign(guid=lambda d: note_guids(d['vocab_word']))
+    df = df.drop_duplicates('guid')
+    exported = load_export_index(index_path)
+    if exported:
+        df = df[~df['guid'].isin(exported)]
+    if df.empty:
+        print("No new notes to export")
+        return []
+
+    model = _build_model()
+    if shard_by is None:
+        shards = [(deck_name, "german_vocabulary.apkg", df)]
+    else:
+        shard_values = df[shard_by].fillna('unknown').astype(str)
+        shards = [
+            (f"{deck_name}::{value}", f"german_vocabulary_{value}.apkg", shard_df)
+            for value, shard_df in df.groupby(shard_values, sort=True)
+        ]
 
-    for _, row in df.iterrows():
-        note = genanki.Note(
-            model=model,
-            fields=[row['vocab_word'], row['english_translation']]
-        )
-        deck.add_note(note)
+    written = []
+    for shard_name, filename, shard_df in shards:
+        deck = genanki.Deck(_deck_id(shard_name), shard_name)
+        for vocab_word, translation, guid in zip(shard_df['vocab_word'].astype(str).tolist(), shard_df['english_translation'].astype(str).tolist(), shard_df['guid'].tolist()):
+            deck.add_note(genanki.Note(model=model, fields=[vocab_word, translation], guid=guid))
+        out_path = os.path.join(out_dir, filename)
+        genanki.Package(deck).write_to_file(out_path)
+        written.append(out_path)
 
-    genanki.Package(deck).write_to_file(os.path.join(out_dir, "german_vocabulary.apkg"))
\ No newline at end of file
+    if index_path:
+        save_export_index(index_path, exported | set(df['guid']))
+    return written
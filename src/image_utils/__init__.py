@@ -1,3 +1,50 @@
-from .build_tables import *
-from .image_conversion import *
-from .image_metadata import *
\ No newline at end of file
+import importlib
+
+# Submodules are imported on first attribute access, so the heavy image and
+# table dependencies are only loaded by the stages that use them.
+_LAZY_ATTRS = {
+    'MANIFEST_NAME': '.image_conversion',
+    'file_hash': '.image_conversion',
+    'load_manifest': '.image_conversion',
+    'save_manifest': '.image_conversion',
+    'iter_heic_to_jpg': '.image_conversion',
+    'convert_heic_to_jpg': '.image_conversion',
+    'get_img_metadata': '.image_metadata',
+    'metadata_from_tags': '.image_metadata',
+    'read_exif_tags': '.image_metadata',
+    'dms_to_degrees': '.image_metadata',
+    'METADATA_COLUMNS': '.image_metadata',
+    'HEADER_BYTES': '.image_metadata',
+    'parse_json_response_llava': '.build_tables',
+    'build_table_from_responses': '.build_tables',
+    'metadata_table': '.build_tables',
+    'build_vocab_table': '.build_tables',
+    'split_article': '.build_tables',
+    'vocab_keys': '.build_tables',
+    'VocabStore': '.build_tables',
+    'QUALITIES_ALLOWED': '.build_tables',
+    'ARTICLES': '.build_tables',
+    'VOCAB_COLUMNS': '.build_tables',
+    'PhotoClusterer': '.image_clustering',
+    'photo_timestamp': '.image_clustering',
+    'PreparedImage': '.image_preparation',
+    'prepare_image': '.image_preparation',
+    'INDEX_NAME': '.image_dedup',
+    'load_thumbnails': '.image_dedup',
+    'dhash': '.image_dedup',
+    'phash': '.image_dedup',
+    'hamming_distance': '.image_dedup',
+    'BKTree': '.image_dedup',
+    'PerceptualHashIndex': '.image_dedup',
+    'find_near_duplicates': '.image_dedup',
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return __all__
@@ -1,13 +1,14 @@
+import os
 import pandas as pd
-import json
 
+from ..llm.json_extraction import JSONExtractionError, extract_json
+
+# The JSON object after the marker is extracted by bracket matching, so code fences
+# and text around it do not matter. An unparseable response gets an empty record.
 def parse_json_response_llava(response, start="JSON_START:"):
-    start_loc = response.find(start)
-    json_response = response[start_loc + len(start):] if start_loc != -1 else response
-    json_response = json_response[:-4] if response[-4:] == "```\n" else json_response
     try:
-        return json.loads(json_response)
-    except json.JSONDecodeError:
+        return extract_json(response, marker=start)
+    except JSONExtractionError:
         return {
             "extracted_words": [],
             "translated_extracted_words": [],
@@ -19,21 +20,44 @@ def parse_json_response_llava(response, start="JSON_START:"):
             "json_response": response
         }
 
-def build_table_from_responses(llm_response, ocr_text, metadata, jpg_path=None):
-    responses_json = [parse_json_response_llava(res) for res in llm_response]
-    metadata_df = pd.DataFrame(metadata).rename(columns={
-        "Image DateTime": "image_datetime", 
-        " GPS GPSLatitudeRef": "latitude_ref", 
-        "GPS GPSLatitude": "latitude", 
-        "GPS GPSLongitudeRef": "longitude_ref", 
-        "GPS GPSLongitude": "longitude", 
-        "GPS GPSAltitudeRef": "altitude_ref", 
-        "GPS GPSAltitude": "altitude", 
-        "GPS GPSTimeStamp": "timestamp", 
-        "GPS GPSSpeedRef": "speed_ref", 
-        "GPS GPSSpeed": "speed", 
-        "GPS GPSDate": "date"
-    })
+# Column names of metadata recorded before get_img_metadata returned typed values
+LEGACY_METADATA_COLUMNS = {
+    "Image DateTime": "image_datetime",
+    " GPS GPSLatitudeRef": "latitude_ref",
+    "GPS GPSLatitudeRef": "latitude_ref",
+    "GPS GPSLatitude": "latitude",
+    "GPS GPSLongitudeRef": "longitude_ref",
+    "GPS GPSLongitude": "longitude",
+    "GPS GPSAltitudeRef": "altitude_ref",
+    "GPS GPSAltitude": "altitude",
+    "GPS GPSTimeStamp": "timestamp",
+    "GPS GPSSpeedRef": "speed_ref",
+    "GPS GPSSpeed": "speed",
+    "GPS GPSDate": "date",
+}
+NUMERIC_METADATA_COLUMNS = ['latitude', 'longitude', 'altitude', 'speed']
+DATETIME_METADATA_COLUMNS = ['image_datetime', 'gps_datetime']
+
+def metadata_table(metadata):
+    from .image_metadata import METADATA_COLUMNS
+    metadata_df = pd.DataFrame(metadata)
+    for legacy_column, column in LEGACY_METADATA_COLUMNS.items():
+        if legacy_column in metadata_df:
+            legacy_values = metadata_df.pop(legacy_column)
+            metadata_df[column] = metadata_df[column].combine_first(legacy_values) if column in metadata_df else legacy_values
+    metadata_df = metadata_df.reindex(columns=METADATA_COLUMNS)
+    # values that are not numbers (e.g. legacy "[52, 31, 123/10]") become NaN
+    for column in NUMERIC_METADATA_COLUMNS:
+        metadata_df[column] = pd.to_numeric(metadata_df[column], errors='coerce').astype('float64')
+    image_datetime = metadata_df['image_datetime']
+    metadata_df['image_datetime'] = pd.to_datetime(image_datetime, format='ISO8601', errors='coerce').fillna(
+        pd.to_datetime(image_datetime, format='%Y:%m:%d %H:%M:%S', errors='coerce'))
+    metadata_df['gps_datetime'] = pd.to_datetime(metadata_df['gps_datetime'], format='ISO8601', errors='coerce', utc=True)
+    return metadata_df
+
+def build_table_from_responses(llm_response, ocr_text, metadata, jpg_path=None, parsed_responses=None):
+    responses_json = parsed_responses if parsed_responses is not None else [parse_json_response_llava(res) for res in llm_response]
+    metadata_df = metadata_table(metadata)
     if len(metadata_df) == len(jpg_path):
         metadata_df['jpg_path'] = jpg_path
     else:
@@ -47,39 +71,93 @@ def build_table_from_responses(llm_response, ocr_text, metadata, jpg_path=None):
 
     return responses_df, metadata_df
 
+QUALITIES_ALLOWED = {
+    'low': ['low', 'medium', 'high'],
+    'medium': ['medium', 'high'],
+    'high': ['high'],
+}
+ARTICLES = ['der', 'die', 'das']
+VOCAB_COLUMNS = ['photo_id', 'vocab_word', 'english_translation', 'source']
+
+def _list_column(series):
+    return series.where(series.map(lambda v: isinstance(v, list)), None)
+
+def _explode_pairs(photo_df, words_col, translations_col, source):
+    # explode both list columns with the position inside each photo's list and join
+    # on (row, position), so words are paired with translations per photo
+    words = photo_df[['photo_id']].assign(vocab_word=_list_column(photo_df[words_col])).explode('vocab_word')
+    words['pos'] = words.groupby(level=0).cumcount()
+    translations = _list_column(photo_df[translations_col]).rename('english_translation').explode().to_frame()
+    translations['pos'] = translations.groupby(level=0).cumcount()
+
+    pairs = words.reset_index().merge(translations.reset_index(), on=['index', 'pos'], how='inner')
+    pairs = pairs.dropna(subset=['vocab_word', 'english_translation']).sort_values(['index', 'pos'], kind='stable')
+    pairs['source'] = source
+    return pairs[VOCAB_COLUMNS]
+
 def build_vocab_table(photo_df, quality_cutoff='medium'):
-    qualities_allowed = ['medium', 'high'] if quality_cutoff == 'medium' else ['high'] if quality_cutoff == 'high' else ['low', 'medium', 'high']
-
-    extracted_words, translated_words, ex_words_photo_ids = [], [], []
-    suggested_words, translated_suggested_words, sug_words_photo_ids = [], [], []
-
-    for _, row in photo_df.iterrows():
-        if row['image_quality'] in qualities_allowed:
-            p_id = row['photo_id']
-            e_words = row['extracted_words'] if isinstance(row['extracted_words'], list) else []
-            te_words = row['translated_extracted_words'] if isinstance(row['translated_extracted_words'], list) else []
-            s_words = row['suggested_words'] if isinstance(row['suggested_words'], list) else []
-            ts_words = row['translated_suggested_words'] if isinstance(row['translated_suggested_words'], list) else []
-
-            extracted_words.extend(e_words)
-            translated_words.extend(te_words)
-            ex_words_photo_ids.extend([p_id] * len(e_words))
-            suggested_words.extend(s_words)
-            translated_suggested_words.extend(ts_words)
-            sug_words_photo_ids.extend([p_id] * len(s_words))
-    n_e_terms = min(len(extracted_words), len(translated_words))
-    n_s_terms = min(len(suggested_words), len(translated_suggested_words))
-    ex_df = pd.DataFrame({
-        'photo_id': ex_words_photo_ids[:n_e_terms], 
-        'vocab_word': extracted_words[:n_e_terms], 
-        'english_translation': translated_words[:n_e_terms], 
-        'source': 'extracted'
-    })
-    sug_df = pd.DataFrame({
-        'photo_id': sug_words_photo_ids[:n_s_terms], 
-        'vocab_word': suggested_words[:n_s_terms], 
-        'english_translation': translated_suggested_words[:n_s_terms], 
-        'source': 'suggested'
-    })
-    vocab_df = pd.concat([ex_df, sug_df])
-    return vocab_df
\ No newline at end of file
+    qualities_allowed = QUALITIES_ALLOWED.get(quality_cutoff, QUALITIES_ALLOWED['low'])
+    photo_df = photo_df[photo_df['image_quality'].isin(qualities_allowed)].reset_index(drop=True)
+
+    ex_df = _explode_pairs(photo_df, 'extracted_words', 'translated_extracted_words', 'extracted')
+    sug_df = _explode_pairs(photo_df, 'suggested_words', 'translated_suggested_words', 'suggested')
+    vocab_df = pd.concat([ex_df, sug_df], ignore_index=True)
+    if 'cluster_id' in photo_df:
+        # photos of one scene repeat the same words, keep each word once per cluster
+        clusters = vocab_df['photo_id'].map(photo_df.drop_duplicates('photo_id').set_index('photo_id')['cluster_id'])
+        words = vocab_df['vocab_word'].astype(str).str.strip().str.lower()
+        vocab_df = vocab_df[~pd.DataFrame({'cluster': clusters, 'word': words}).duplicated()].reset_index(drop=True)
+    return vocab_df
+
+def split_article(vocab_words):
+    normalized = vocab_words.astype(str).str.lower().str.strip().str.replace(r'\s+', ' ', regex=True).str.strip(' .,;:!?"\'')
+    # object columns even for an empty series, where expand=True gives float64 columns
+    parts = normalized.str.split(' ', n=1, expand=True).reindex(columns=[0, 1]).astype(object)
+    has_article = parts[0].isin(ARTICLES) & parts[1].notna()
+    article = parts[0].where(has_article, '')
+    word = parts[1].where(has_article, normalized)
+    return word, article
+
+def vocab_keys(vocab_words):
+    word, article = split_article(vocab_words)
+    return word + '|' + article
+
+class VocabStore:
+    # Columnar vocabulary accumulated across runs, stored as one Parquet file per
+    # append in a directory. Only the key column is read to deduplicate new words.
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        parts = self._parts()
+        if parts:
+            self._keys = set(pd.concat([pd.read_parquet(p, columns=['word_key']) for p in parts])['word_key'])
+        else:
+            self._keys = set()
+
+    def _parts(self):
+        return sorted(os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith('.parquet'))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, vocab_word):
+        return vocab_keys(pd.Series([vocab_word])).iloc[0] in self._keys
+
+    def append(self, vocab_df, run_id=None):
+        vocab_df = vocab_df.copy()
+        vocab_df['word'], vocab_df['article'] = split_article(vocab_df['vocab_word'])
+        vocab_df['word_key'] = vocab_df['word'] + '|' + vocab_df['article']
+        new_df = vocab_df[~vocab_df['word_key'].isin(self._keys)].drop_duplicates('word_key')
+        if new_df.empty:
+            return new_df
+        new_df = new_df.assign(run_id=run_id, added_at=pd.Timestamp.now())
+        part_path = os.path.join(self.path, f"part-{len(self._parts()):06d}.parquet")
+        new_df.to_parquet(part_path, index=False)
+        self._keys.update(new_df['word_key'])
+        return new_df
+
+    def load(self, columns=None):
+        parts = self._parts()
+        if not parts:
+            return pd.DataFrame(columns=VOCAB_COLUMNS + ['word', 'article', 'word_key', 'run_id', 'added_at'])
+        return pd.concat([pd.read_parquet(p, columns=columns) for p in parts], ignore_index=True)
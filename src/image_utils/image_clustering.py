@@ -0,0 +1,85 @@
+import math
+from datetime import datetime
+
+# Photos taken within max_distance_m metres and max_gap_s seconds of another photo
+# share its cluster. Photos are hashed into grid cells of max_distance_m metres by
+# max_gap_s seconds, so a new photo only compares against the 27 neighbouring cells
+# and clustering a session stays linear in the number of photos. A photo matching
+# several clusters merges them (union-find), so the clusters do not depend on the
+# order the photos are added in.
+
+METRES_PER_DEGREE = 111320.0
+
+def photo_timestamp(metadata):
+    value = (metadata or {}).get('image_datetime')
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+def _to_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+class PhotoClusterer:
+    def __init__(self, max_distance_m=50.0, max_gap_s=900.0):
+        self.max_distance_m = max_distance_m
+        self.max_gap_s = max_gap_s
+        self.cells = {}
+        self.parent = {}
+        self._first = {}
+
+    def _project(self, latitude, longitude):
+        # equirectangular projection, accurate enough over a few hundred metres
+        return longitude * METRES_PER_DEGREE * math.cos(math.radians(latitude)), latitude * METRES_PER_DEGREE
+
+    def _cell(self, x, y, t):
+        return (math.floor(x / self.max_distance_m), math.floor(y / self.max_distance_m), math.floor(t / self.max_gap_s))
+
+    # The cluster id of a photo is the key of the earliest photo of its cluster.
+    def cluster_of(self, key):
+        root = key
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[key] != root:
+            self.parent[key], key = root, self.parent[key]
+        return root
+
+    def _union(self, key, other_key):
+        root, other_root = self.cluster_of(key), self.cluster_of(other_key)
+        if root != other_root:
+            if self._first[other_root] < self._first[root]:
+                root, other_root = other_root, root
+            self.parent[other_root] = root
+
+    # Returns the cluster id of the photo so far, or its own key when it starts a new
+    # cluster or has no position or time. Photos added later can merge its cluster
+    # into another one, cluster_of gives the final id.
+    def add(self, key, latitude, longitude, timestamp):
+        if key in self.parent:
+            return self.cluster_of(key)
+        latitude, longitude, timestamp = _to_float(latitude), _to_float(longitude), _to_float(timestamp)
+        self.parent[key] = key
+        # ties in time go to the photo added first
+        self._first[key] = (timestamp if timestamp is not None else math.inf, len(self._first))
+        if latitude is None or longitude is None or timestamp is None:
+            return key
+        x, y = self._project(latitude, longitude)
+        cx, cy, ct = self._cell(x, y, timestamp)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dt in (-1, 0, 1):
+                    for other_key, ox, oy, ot in self.cells.get((cx + dx, cy + dy, ct + dt), ()):
+                        if abs(timestamp - ot) <= self.max_gap_s and math.hypot(x - ox, y - oy) <= self.max_distance_m:
+                            self._union(key, other_key)
+        self.cells.setdefault((cx, cy, ct), []).append((key, x, y, timestamp))
+        return self.cluster_of(key)
+
+    def add_metadata(self, key, metadata):
+        metadata = metadata or {}
+        return self.add(key, metadata.get('latitude'), metadata.get('longitude'), photo_timestamp(metadata))
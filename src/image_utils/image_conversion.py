@@ -1,28 +1,142 @@
 import os
-from PIL import Image
-import pillow_heif
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
-def convert_heic_to_jpg(input_directory):
-    heic_files = []
-    jpg_files = []
+MANIFEST_NAME = ".conversion_manifest.json"
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(jpg_dir):
+    manifest_path = os.path.join(jpg_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(jpg_dir, manifest):
+    manifest_path = os.path.join(jpg_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def _convert_one(heic_file_path, jpg_img_path, quality, max_size):
+    from PIL import Image
+    import pillow_heif
+    start = time.perf_counter()
+    heif_file = pillow_heif.read_heif(heic_file_path)
+    image = Image.frombytes(
+        heif_file.mode,
+        heif_file.size,
+        heif_file.data,
+        "raw",
+    )
+    if max_size:
+        # reduce() is a cheap integer box filter, finish with a resize for the exact bound
+        factor = max(image.size) // max_size
+        if factor >= 2:
+            image = image.reduce(factor)
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    image.save(jpg_img_path, format="JPEG", quality=quality)
+    stat = os.stat(heic_file_path)
+    return file_hash(heic_file_path), stat.st_mtime, stat.st_size, time.perf_counter() - start
+
+def _convert_or_exception(heic_file_path, jpg_img_path, quality, max_size):
+    # an exception raised in a worker would end executor.map for every later file
+    try:
+        return _convert_one(heic_file_path, jpg_img_path, quality, max_size)
+    except Exception as e:
+        return e
+
+def _is_up_to_date(entry, heic_file_path, jpg_img_path, quality, max_size):
+    if not entry or not os.path.exists(jpg_img_path):
+        return False
+    if entry.get("quality") != quality or entry.get("max_size") != max_size:
+        return False
+    stat = os.stat(heic_file_path)
+    if entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+        return True
+    # mtime/size changed (e.g. copied folder), fall back to the content hash
+    if entry.get("size") == stat.st_size and entry.get("sha256") == file_hash(heic_file_path):
+        entry["mtime"] = stat.st_mtime
+        return True
+    return False
+
+# Yields (heic_path, jpg_path) sorted by name as each file becomes available. Unchanged
+# files (same hash/mtime/size and settings as recorded in the manifest) are skipped;
+# workers=None uses every core. with_stats adds a dict with the decode/encode time,
+# the bytes read and whether the file was skipped. filenames restricts the conversion
+# to these files of input_directory. With return_exceptions, a file that cannot be
+# converted yields its exception in place of the JPG path instead of stopping.
+def iter_heic_to_jpg(input_directory, workers=1, quality=75, max_size=None, use_manifest=True, with_stats=False, filenames=None, return_exceptions=False):
     jpg_dir = os.path.join(input_directory, "jpg")
+    filenames = sorted(f for f in (os.listdir(input_directory) if filenames is None else filenames) if os.path.splitext(f)[1].lower() == ".heic")
+    if not filenames:
+        return
+    os.makedirs(jpg_dir, exist_ok=True)
+
+    manifest = load_manifest(jpg_dir) if use_manifest else {}
+    entries = []
+    for filename in filenames:
+        heic_file_path = os.path.join(input_directory, filename)
+        jpg_img_path = os.path.join(jpg_dir, os.path.splitext(filename)[0] + ".jpg")
+        up_to_date = _is_up_to_date(manifest.get(filename), heic_file_path, jpg_img_path, quality, max_size)
+        entries.append((filename, heic_file_path, jpg_img_path, up_to_date))
+    pending = [e for e in entries if not e[3]]
+
+    executor = None
+    if len(pending) > 1 and workers != 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        args = ([e[1] for e in pending], [e[2] for e in pending], [quality] * len(pending), [max_size] * len(pending))
+        if executor is None:
+            converted = map(_convert_or_exception, *args)
+        else:
+            converted = executor.map(_convert_or_exception, *args, chunksize=max(1, len(pending) // 64))
+
+        n_failed = 0
+        for filename, heic_file_path, jpg_img_path, up_to_date in entries:
+            stats = {"skipped": True}
+            if not up_to_date:
+                result = next(converted)
+                if isinstance(result, Exception):
+                    if not return_exceptions:
+                        raise result
+                    n_failed += 1
+                    stats = {"skipped": False, "error": f"{type(result).__name__}: {result}"}
+                    yield (heic_file_path, result, stats) if with_stats else (heic_file_path, result)
+                    continue
+                digest, mtime, size, elapsed = result
+                stats = {"skipped": False, "wall_s": elapsed, "bytes_read": size}
+                manifest[filename] = {
+                    "sha256": digest,
+                    "mtime": mtime,
+                    "size": size,
+                    "jpg_path": jpg_img_path,
+                    "quality": quality,
+                    "max_size": max_size,
+                }
+            yield (heic_file_path, jpg_img_path, stats) if with_stats else (heic_file_path, jpg_img_path)
+        print(f"Converted {len(pending) - n_failed} HEIC files, skipped {len(entries) - len(pending)} unchanged, {n_failed} failed")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if use_manifest:
+            save_manifest(jpg_dir, manifest)
 
-    for filename in os.listdir(input_directory):
-        if filename.endswith(".HEIC"):
-            heic_file_path = os.path.join(input_directory, filename)
-            heif_file = pillow_heif.read_heif(heic_file_path)
-            # heif_file = pyheif.read(heic_file_path)
-            image = Image.frombytes(
-                heif_file.mode,
-                heif_file.size,
-                heif_file.data,
-                "raw",
-            )
-
-            os.makedirs(jpg_dir, exist_ok=True)
-            jpg_img_path = os.path.join(jpg_dir, filename.replace(".HEIC", ".jpg"))
-            image.save(jpg_img_path, format="JPEG")
-            heic_files.append(heic_file_path)
-            jpg_files.append(jpg_img_path)
-
-    return heic_files, jpg_files
\ No newline at end of file
+def convert_heic_to_jpg(input_directory, workers=1, quality=75, max_size=None, use_manifest=True):
+    heic_files, jpg_files = [], []
+    for heic_file_path, jpg_img_path in iter_heic_to_jpg(input_directory, workers=workers, quality=quality, max_size=max_size, use_manifest=use_manifest):
+        heic_files.append(heic_file_path)
+        jpg_files.append(jpg_img_path)
+    return heic_files, jpg_files
@@ -0,0 +1,128 @@
+import os
+import json
+import numpy as np
+from PIL import Image
+
+INDEX_NAME = "phash_index.json"
+
+# images are paths or already decoded RGB arrays
+def load_thumbnails(images, size):
+    thumbs = np.empty((len(images), size[1], size[0]), dtype=np.float32)
+    for i, image in enumerate(images):
+        if isinstance(image, np.ndarray):
+            img = Image.fromarray(np.ascontiguousarray(image))
+            thumbs[i] = np.asarray(img.convert('L').resize(size, Image.Resampling.BOX), dtype=np.float32)
+            continue
+        with Image.open(image) as img:
+            # let the JPEG decoder downscale while decoding
+            img.draft('L', (size[0] * 4, size[1] * 4))
+            thumbs[i] = np.asarray(img.convert('L').resize(size, Image.Resampling.BOX), dtype=np.float32)
+    return thumbs
+
+def _pack_bits(bits):
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+def dhash(images, hash_size=8):
+    thumbs = load_thumbnails(images, (hash_size + 1, hash_size))
+    return _pack_bits(thumbs[:, :, 1:] > thumbs[:, :, :-1])
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+def phash(images, hash_size=8, highfreq_factor=4):
+    n = hash_size * highfreq_factor
+    thumbs = load_thumbnails(images, (n, n))
+    dct = _dct_matrix(n)
+    # 2D DCT of every thumbnail at once, keep the low frequency block
+    low = (dct @ thumbs @ dct.T)[:, :hash_size, :hash_size].reshape(len(thumbs), -1)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack_bits(low > median)
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    # Burkhard-Keller tree over integer hashes with the Hamming metric.
+    def __init__(self):
+        self.root = None
+
+    def add(self, hash_value, item):
+        if self.root is None:
+            self.root = (hash_value, item, {})
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (hash_value, item, {})
+                return
+            node = child
+
+    def query(self, hash_value, max_distance):
+        if self.root is None:
+            return []
+        matches = []
+        stack = [self.root]
+        while stack:
+            node_hash, item, children = stack.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= max_distance:
+                matches.append((distance, item))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches, key=lambda m: m[0])
+
+class PerceptualHashIndex:
+    # Representative images of all runs, persisted as JSON next to the other caches.
+    def __init__(self, path=None, method='phash'):
+        self.path = path
+        self.method = method
+        self.tree = BKTree()
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                stored = json.load(f)
+            if stored.get('method') == method:
+                for hex_hash, image_path in stored['entries'].items():
+                    if os.path.exists(image_path):
+                        self.add(int(hex_hash, 16), image_path)
+
+    def add(self, hash_value, image_path):
+        self.entries[format(hash_value, 'x')] = image_path
+        self.tree.add(hash_value, image_path)
+
+    def find(self, hash_value, max_distance):
+        matches = self.tree.query(hash_value, max_distance)
+        return matches[0][1] if matches else None
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'method': self.method, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+# Returns, for every image, the path of its representative: itself for a new image,
+# or the closest (by Hamming distance) earlier new image from this batch or a previous
+# run. images can hold decoded arrays for the hashing, image_paths then names them.
+def find_near_duplicates(image_paths, index=None, max_distance=6, method='phash', images=None):
+    index = index if index is not None else PerceptualHashIndex(method=method)
+    images = images if images is not None else image_paths
+    hashes = phash(images) if method == 'phash' else dhash(images)
+    representatives = []
+    for image_path, hash_value in zip(image_paths, hashes):
+        representative = index.find(hash_value, max_distance)
+        if representative is None:
+            index.add(hash_value, image_path)
+            representative = image_path
+        representatives.append(representative)
+    return representatives
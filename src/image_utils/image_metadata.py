@@ -1,10 +1,109 @@
-import exifread
+import io
+import os
+from datetime import datetime
 
-def get_img_metadata(img_path):
+from ..cache import bytes_hash, make_key
+
+# Only the start of the file is read: the EXIF block of iPhone HEIC files sits in
+# the first few KB, and with details=False exifread skips maker notes and thumbnails.
+# Files with the EXIF block further in are parsed from the file itself.
+HEADER_BYTES = 128 * 1024
+
+METADATA_COLUMNS = ['image_datetime', 'latitude_ref', 'latitude', 'longitude_ref', 'longitude', 'altitude_ref', 'altitude',
+                    'timestamp', 'date', 'gps_datetime', 'speed_ref', 'speed']
+
+def _values(tag):
+    return tag.values if tag is not None else None
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+def dms_to_degrees(dms, ref=None):
+    # [degrees, minutes, seconds] as EXIF ratios, negative south of the equator and west of Greenwich
+    if not dms or len(dms) != 3:
+        return None
+    parts = [_to_float(v) for v in dms]
+    if None in parts:
+        return None
+    degrees = parts[0] + parts[1] / 60 + parts[2] / 3600
+    return -degrees if ref in ('S', 'W') else degrees
+
+def _exif_datetime(value):
+    try:
+        return datetime.strptime(str(value).strip(), '%Y:%m:%d %H:%M:%S').isoformat()
+    except ValueError:
+        return None
+
+def _gps_time(values):
+    parts = [_to_float(v) for v in values or []]
+    if len(parts) != 3 or None in parts:
+        return None
+    return f"{int(parts[0]):02d}:{int(parts[1]):02d}:{int(parts[2]):02d}"
+
+def _gps_date(value):
+    try:
+        return datetime.strptime(str(value).strip(), '%Y:%m:%d').date().isoformat()
+    except ValueError:
+        return None
+
+def metadata_from_tags(tags):
+    latitude_ref = _values(tags.get('GPS GPSLatitudeRef'))
+    longitude_ref = _values(tags.get('GPS GPSLongitudeRef'))
+    altitude_ref = _values(tags.get('GPS GPSAltitudeRef'))
+    altitude_ref = altitude_ref[0] if isinstance(altitude_ref, list) and altitude_ref else altitude_ref
+    altitude = _values(tags.get('GPS GPSAltitude'))
+    altitude = _to_float(altitude[0]) if altitude else None
+    if altitude is not None and altitude_ref == 1:
+        # altitude ref 1 means below sea level
+        altitude = -altitude
+    speed = _values(tags.get('GPS GPSSpeed'))
+    timestamp = _gps_time(_values(tags.get('GPS GPSTimeStamp')))
+    date = _gps_date(_values(tags.get('GPS GPSDate')))
+    return {
+        'image_datetime': _exif_datetime(_values(tags.get('Image DateTime'))),
+        'latitude_ref': latitude_ref,
+        'latitude': dms_to_degrees(_values(tags.get('GPS GPSLatitude')), latitude_ref),
+        'longitude_ref': longitude_ref,
+        'longitude': dms_to_degrees(_values(tags.get('GPS GPSLongitude')), longitude_ref),
+        'altitude_ref': altitude_ref,
+        'altitude': altitude,
+        'timestamp': timestamp,
+        'date': date,
+        'gps_datetime': f"{date}T{timestamp}+00:00" if date and timestamp else None,
+        'speed_ref': _values(tags.get('GPS GPSSpeedRef')),
+        'speed': _to_float(speed[0]) if speed else None,
+    }
+
+def read_exif_tags(img_path, header=None):
+    import exifread
+    header = header if header is not None else _read_header(img_path)
+    try:
+        tags = exifread.process_file(io.BytesIO(header), details=False)
+    except Exception:
+        # the EXIF block lies past the header
+        tags = {}
+    if not tags and len(header) >= HEADER_BYTES:
+        with open(img_path, 'rb') as f:
+            tags = exifread.process_file(f, details=False)
+    return tags
+
+def _read_header(img_path):
     with open(img_path, 'rb') as f:
-        tags = exifread.process_file(f)
-    desired_keys = ['Image DateTime', ' GPS GPSLatitudeRef', 'GPS GPSLatitude', 'GPS GPSLongitudeRef', 'GPS GPSLongitude', 
-                    'GPS GPSAltitudeRef', 'GPS GPSAltitude', 'GPS GPSTimeStamp', 'GPS GPSSpeedRef', 'GPS GPSSpeed', 'GPS GPSDate']
-    
-    metadata = {key: str(tags.get(key, None)) for key in desired_keys}
-    return metadata
\ No newline at end of file
+        return f.read(HEADER_BYTES)
+
+# Typed metadata of one photo: ISO datetimes, signed decimal degrees and metres.
+# With a cache, results are keyed by the hash of the header bytes and the file size.
+def get_img_metadata(img_path, cache=None):
+    header = _read_header(img_path)
+    key = make_key('exif', bytes_hash(header), os.path.getsize(img_path)) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    metadata = metadata_from_tags(read_exif_tags(img_path, header=header))
+    if cache is not None:
+        cache.put(key, metadata)
+    return metadata
@@ -0,0 +1,111 @@
+import io
+import os
+import base64
+import threading
+import numpy as np
+from PIL import Image
+
+from .image_conversion import file_hash
+
+class PreparedImage:
+    # One decoded photo shared by OCR and the LLM backends. The full resolution RGB
+    # array is decoded once; resized views and encoded payloads are derived from it
+    # on demand and memoised per target size. Records sharing the image (near
+    # duplicates) retain it; the buffers are freed when the last one releases it.
+    def __init__(self, array, source_path, content_hash=None):
+        self.array = array
+        self.source_path = source_path
+        self._content_hash = content_hash
+        self._resized = {}
+        self._jpeg = {}
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_heic(cls, heic_path):
+        import pillow_heif
+        heif_file = pillow_heif.open_heif(heic_path, convert_hdr_to_8bit=True)
+        # np.asarray goes through the array interface of the decoded buffer, no copy
+        array = np.asarray(heif_file)
+        return cls(array[..., :3] if array.shape[-1] == 4 else array, heic_path)
+
+    @classmethod
+    def from_file(cls, image_path):
+        with Image.open(image_path) as img:
+            return cls(np.asarray(img.convert('RGB')), image_path)
+
+    @classmethod
+    def load(cls, image_path):
+        if os.path.splitext(image_path)[1].lower() == '.heic':
+            return cls.from_heic(image_path)
+        return cls.from_file(image_path)
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = file_hash(self.source_path)
+        return self._content_hash
+
+    @property
+    def size(self):
+        return self.array.shape[1], self.array.shape[0]
+
+    def resized(self, max_side=None):
+        # at or below the target size the original array is returned as is
+        if not max_side or max(self.size) <= max_side:
+            return self.array
+        if max_side not in self._resized:
+            img = Image.fromarray(np.ascontiguousarray(self.array))
+            factor = max(img.size) // max_side
+            if factor >= 2:
+                img = img.reduce(factor)
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            self._resized[max_side] = np.asarray(img)
+        return self._resized[max_side]
+
+    def ocr_input(self, max_side=None):
+        # grayscale is all tesseract needs and a third of the pixels to hand over
+        rgb = self.resized(max_side)
+        return np.asarray(Image.fromarray(np.ascontiguousarray(rgb)).convert('L'))
+
+    def jpeg_bytes(self, max_side=None, quality=85):
+        key = (max_side, quality)
+        if key not in self._jpeg:
+            buffer = io.BytesIO()
+            Image.fromarray(np.ascontiguousarray(self.resized(max_side))).save(buffer, format='JPEG', quality=quality)
+            self._jpeg[key] = buffer.getvalue()
+        return self._jpeg[key]
+
+    def llava_payload(self, max_side=None, quality=85):
+        return self.jpeg_bytes(max_side, quality)
+
+    def openai_payload(self, max_side=128, quality=75):
+        return base64.b64encode(self.jpeg_bytes(max_side, quality)).decode('utf-8')
+
+    def save_jpg(self, jpg_path, max_side=None, quality=75):
+        os.makedirs(os.path.dirname(jpg_path), exist_ok=True)
+        with open(jpg_path, 'wb') as f:
+            f.write(self.jpeg_bytes(max_side, quality))
+
+    # Returns the image for one more record, or None once it has been released.
+    def retain(self):
+        with self._lock:
+            if self.array is None:
+                return None
+            self._refs += 1
+            return self
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            self.array = None
+            self._resized.clear()
+            self._jpeg.clear()
+
+def prepare_image(image_path, jpg_path=None, jpg_max_side=None, jpg_quality=75):
+    prepared = PreparedImage.load(image_path)
+    if jpg_path:
+        prepared.save_jpg(jpg_path, max_side=jpg_max_side, quality=jpg_quality)
+    return prepared
@@ -1,3 +1,44 @@
-from .llm_interaction import *
-from .open_ai_llm_interaction import *
-from .credentials import *
\ No newline at end of file
+import importlib
+
+from .dispatch import *
+from .batching import *
+from .json_extraction import *
+
+# Backends are imported on first use, so a LLaVA run never loads openai and an
+# OpenAI run never loads ollama.
+_LAZY_ATTRS = {
+    'DEFAULT_KEEP_ALIVE': '.backends',
+    'OllamaBackend': '.backends',
+    'OpenAIBackend': '.backends',
+    'OllamaPool': '.backends',
+    'get_ollama_backend': '.backends',
+    'get_openai_backend': '.backends',
+    'chat_debug': '.llm_interaction',
+    'ocr_llava': '.llm_interaction',
+    'chat': '.llm_interaction',
+    'ocr_llava_chat': '.llm_interaction',
+    'ocr_llava_chat_batch': '.llm_interaction',
+    'lookup_ocr_llava_chat': '.llm_interaction',
+    'lookup_ocr_llava_chat_batch': '.llm_interaction',
+    'repair_json_llava': '.llm_interaction',
+    'lookup_repair_json_llava': '.llm_interaction',
+    'query_chatGPT': '.open_ai_llm_interaction',
+    'query_chatGPT_batch': '.open_ai_llm_interaction',
+    'lookup_query_chatGPT': '.open_ai_llm_interaction',
+    'lookup_query_chatGPT_batch': '.open_ai_llm_interaction',
+    'repair_json_chatGPT': '.open_ai_llm_interaction',
+    'lookup_repair_json_chatGPT': '.open_ai_llm_interaction',
+}
+
+__all__ = ['ResponseError', 'estimate_tokens', 'is_rate_limit_error', 'RateLimiter', 'SharedBackoff',
+           'call_with_backoff', 'dispatch_iter', 'dispatch', 'BATCH_INSTRUCTIONS', 'BatchParseError',
+           'build_batch_prompt', 'split_batch_response', 'JSON_MARKER', 'RESPONSE_KEYS', 'JSONExtractionError',
+           'JSONExtractor', 'extract_json', 'consume_stream', 'build_repair_prompt'] + list(_LAZY_ATTRS)
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return __all__
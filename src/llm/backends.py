@@ -0,0 +1,173 @@
+import time
+import logging
+import threading
+
+# Long-lived clients shared by every image of a run. Each backend owns one pooled
+# HTTP client, so requests reuse open connections instead of paying for a new
+# client and connection setup per image.
+
+DEFAULT_KEEP_ALIVE = "5m"
+
+class OllamaBackend:
+    # keep_alive controls how long ollama keeps the model weights loaded after a
+    # request ("5m", "1h", -1 to keep them resident, 0 to unload immediately).
+    def __init__(self, host=None, keep_alive=DEFAULT_KEEP_ALIVE, timeout=None, max_connections=16):
+        import httpx
+        import ollama
+        self.host = host
+        self.keep_alive = keep_alive
+        self.client = ollama.Client(
+            host=host,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def chat(self, model, messages, stream=False, options=None, keep_alive=None):
+        return self.client.chat(
+            model=model,
+            messages=messages,
+            stream=stream,
+            options=options,
+            keep_alive=keep_alive if keep_alive is not None else self.keep_alive,
+        )
+
+    def generate(self, model, prompt, images=None, stream=False, options=None, keep_alive=None, **kwargs):
+        return self.client.generate(
+            model=model,
+            prompt=prompt,
+            images=images,
+            stream=stream,
+            options=options,
+            keep_alive=keep_alive if keep_alive is not None else self.keep_alive,
+            **kwargs
+        )
+
+class OpenAIBackend:
+    # The SDK's own retries are off: a 429 has to reach call_with_backoff, which pauses
+    # every worker (SharedBackoff) instead of each worker retrying on its own.
+    def __init__(self, api_key=None, base_url=None, timeout=600, max_connections=32, max_retries=0):
+        import httpx
+        import openai
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=max_retries,
+            http_client=httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            ),
+        )
+
+    def chat_completion(self, **kwargs):
+        return self.client.chat.completions.create(**kwargs)
+
+def _is_unavailable(e):
+    # the server cannot be reached or is overloaded (ollama answers 503 when its queue is full)
+    import httpx
+    return isinstance(e, (ConnectionError, httpx.TransportError)) or getattr(e, 'status_code', None) == 503
+
+_EMPTY = object()
+
+class OllamaPool:
+    # Spreads the requests of a run over several ollama servers. Each request goes to
+    # the server with the fewest requests in flight, ties going to the one that has
+    # answered fastest lately. A server that cannot be reached or is overloaded is
+    # skipped for `cooldown` seconds and the request is retried on another one.
+    def __init__(self, hosts, keep_alive=DEFAULT_KEEP_ALIVE, cooldown=30.0, **kwargs):
+        self.backends = [get_ollama_backend(host=host, keep_alive=keep_alive, **kwargs) for host in hosts]
+        self.hosts = list(hosts)
+        self.keep_alive = keep_alive
+        self.cooldown = cooldown
+        self._in_flight = [0] * len(self.backends)
+        self._requests = [0] * len(self.backends)
+        self._latency = [0.0] * len(self.backends)
+        self._unavailable_until = [0.0] * len(self.backends)
+        self._lock = threading.Lock()
+
+    def _acquire(self, tried):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [i for i in range(len(self.backends)) if i not in tried]
+            # when every server is cooling down the request still goes to one of them
+            available = [i for i in candidates if self._unavailable_until[i] <= now] or candidates
+            i = min(available, key=lambda i: (self._in_flight[i], self._latency[i]))
+            self._in_flight[i] += 1
+            self._requests[i] += 1
+            return i
+
+    def _release(self, i, elapsed=None, unavailable=False):
+        with self._lock:
+            self._in_flight[i] -= 1
+            if unavailable:
+                self._unavailable_until[i] = time.monotonic() + self.cooldown
+            elif elapsed is not None:
+                # moving average of the response time
+                self._latency[i] = elapsed if not self._latency[i] else 0.8 * self._latency[i] + 0.2 * elapsed
+
+    def _stream(self, i, first, chunks, start):
+        unavailable = False
+        try:
+            if first is not _EMPTY:
+                yield first
+            yield from chunks
+        except Exception as e:
+            unavailable = _is_unavailable(e)
+            raise
+        finally:
+            # a consumer closing the stream early also closes the ollama response
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            self._release(i, time.perf_counter() - start, unavailable=unavailable)
+
+    def _call(self, method, *args, stream=False, **kwargs):
+        tried = set()
+        while True:
+            i = self._acquire(tried)
+            start = time.perf_counter()
+            try:
+                result = getattr(self.backends[i], method)(*args, stream=stream, **kwargs)
+                if stream:
+                    # ollama streams lazily, the connection is only made for the first chunk
+                    chunks = iter(result)
+                    first = next(chunks, _EMPTY)
+            except Exception as e:
+                unavailable = _is_unavailable(e)
+                self._release(i, unavailable=unavailable)
+                tried.add(i)
+                if unavailable and len(tried) < len(self.backends):
+                    logging.warning(f"ollama at {self.hosts[i]} is unavailable, retrying on another server: {e}")
+                    continue
+                raise
+            if stream:
+                # the request counts as in flight until the stream is consumed or closed
+                return self._stream(i, first, chunks, start)
+            self._release(i, time.perf_counter() - start)
+            return result
+
+    def chat(self, model, messages, stream=False, options=None, keep_alive=None):
+        return self._call('chat', model, messages, stream=stream, options=options, keep_alive=keep_alive)
+
+    def generate(self, model, prompt, images=None, stream=False, options=None, keep_alive=None, **kwargs):
+        return self._call('generate', model, prompt, images=images, stream=stream, options=options, keep_alive=keep_alive, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return [{'host': host, 'requests': requests, 'in_flight': in_flight, 'latency_s': latency}
+                    for host, requests, in_flight, latency in zip(self.hosts, self._requests, self._in_flight, self._latency)]
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_ollama_backend(host=None, keep_alive=DEFAULT_KEEP_ALIVE, **kwargs):
+    key = ('ollama', host, keep_alive)
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = OllamaBackend(host=host, keep_alive=keep_alive, **kwargs)
+        return _backends[key]
+
+def get_openai_backend(api_key=None, base_url=None, **kwargs):
+    key = ('openai', api_key, base_url)
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = OpenAIBackend(api_key=api_key, base_url=base_url, **kwargs)
+        return _backends[key]
@@ -0,0 +1,55 @@
+import json
+
+from .dispatch import ResponseError
+
+# Several photos can share one request: the per-image prompt is sent once as the
+# instruction block and the OCR output of every image is listed below it.
+
+BATCH_OCR_PLACEHOLDER = "(listed separately for each image below)"
+
+BATCH_INSTRUCTIONS = """
+    This request contains {n_images} images, numbered 0 to {last_index} in the order they are attached.
+    Apply the steps above to every image separately, using only its own OCR output:
+{ocr_blocks}
+    Instead of a single JSON object, return a JSON array with one filled-in JSON object per image.
+    Every object must have an additional "image_index" field with the number of its image.
+    Precede the array immediately with the marker "JSON_START:" and do not add any text after it.
+    """
+
+class BatchParseError(ResponseError):
+    pass
+
+def build_batch_prompt(prompt, ocr_texts, language_level):
+    ocr_blocks = "\n".join(f"    Image {i} OCR output:\n    {text}" for i, text in enumerate(ocr_texts))
+    instructions = prompt.format(ocr_output=BATCH_OCR_PLACEHOLDER, language_level=language_level)
+    return instructions + BATCH_INSTRUCTIONS.format(n_images=len(ocr_texts), last_index=len(ocr_texts) - 1, ocr_blocks=ocr_blocks)
+
+# Splits a batched answer into one "JSON_START:"-prefixed response per image, in the
+# format parse_json_response_llava expects for a single image.
+def split_batch_response(content, n_images, start="JSON_START:"):
+    start_loc = content.find(start)
+    body = content[start_loc + len(start):] if start_loc != -1 else content
+    first, last = body.find("["), body.rfind("]")
+    if first == -1 or last < first:
+        raise BatchParseError("Batched response contains no JSON array")
+    try:
+        items = json.loads(body[first:last + 1])
+    except json.JSONDecodeError as e:
+        raise BatchParseError(f"Batched response is not valid JSON: {e}") from None
+
+    by_index = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise BatchParseError("Batched response contains a non-object entry")
+        item = dict(item)
+        try:
+            index = int(item.pop("image_index"))
+        except (KeyError, TypeError, ValueError):
+            raise BatchParseError("Batched response entry without a valid image_index") from None
+        if index in by_index:
+            raise BatchParseError(f"Batched response contains image {index} twice")
+        by_index[index] = item
+    missing = [i for i in range(n_images) if i not in by_index]
+    if missing:
+        raise BatchParseError(f"Batched response is missing images {missing}")
+    return [start + json.dumps(by_index[i], ensure_ascii=False) for i in range(n_images)]
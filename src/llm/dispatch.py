@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class ResponseError(Exception):
+    pass
+
+def estimate_tokens(text):
+    # rough rule of thumb for budgeting, ~4 characters per token
+    return len(text) // 4 + 1 if text else 0
+
+def is_rate_limit_error(e):
+    status_code = getattr(e, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(e, 'response', None), 'status_code', None)
+    return status_code == 429
+
+class RateLimiter:
+    # Sliding one minute window over requests and tokens, shared by all workers.
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._events = deque()
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def acquire(self, tokens=0):
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                requests_ok = not self.requests_per_minute or len(self._events) < self.requests_per_minute
+                tokens_ok = not self.tokens_per_minute or self._tokens_in_window + tokens <= self.tokens_per_minute
+                if requests_ok and tokens_ok:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                sleep_for = self.window - (now - self._events[0][0]) if self._events else 0.01
+            time.sleep(max(sleep_for, 0.01))
+
+class SharedBackoff:
+    # A 429 seen by any worker pauses every worker, the wait doubles on each
+    # consecutive 429 and decays again once requests succeed.
+    def __init__(self, initial_wait=1, max_wait=60):
+        self.initial_wait = initial_wait
+        self.max_wait = max_wait
+        self._wait = initial_wait
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def penalize(self):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + self._wait)
+            wait = self._wait
+            self._wait = min(self._wait * 2, self.max_wait)
+        return wait
+
+    def reset(self):
+        with self._lock:
+            self._wait = max(self.initial_wait, self._wait / 2)
+
+def call_with_backoff(fn, *args, backoff=None, rate_limiter=None, tokens=0, max_retries=10, **kwargs):
+    backoff = backoff if backoff is not None else SharedBackoff()
+    retries = 0
+    while retries < max_retries:
+        backoff.wait()
+        if rate_limiter is not None:
+            rate_limiter.acquire(tokens)
+        try:
+            result = fn(*args, **kwargs)
+            backoff.reset()
+            return result
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                raise
+            wait = backoff.penalize()
+            logging.info(f"Rate limit exceeded. Retrying in {wait}s...")
+            retries += 1
+
+    raise ResponseError("No slots available after maximum retries")
+
+def dispatch_iter(fn, items, max_workers=4):
+    # Yields fn(item) in input order while keeping at most max_workers calls in flight.
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for item in items:
+            in_flight.append(executor.submit(fn, item))
+            if len(in_flight) >= max_workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def dispatch(fn, items, max_workers=4):
+    return list(dispatch_iter(fn, items, max_workers=max_workers))
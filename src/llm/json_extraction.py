@@ -0,0 +1,143 @@
+import json
+
+# Incremental extraction of the JSON answer from a model response. Text is fed in
+# as it streams in; the first JSON object (or array) after the marker is tracked by
+# bracket depth, so code fences, leading chatter and trailing text are ignored and
+# the stream can be stopped as soon as the value is closed. A response without the
+# marker falls back to its first bracket, but only once the stream has ended, so a
+# brace in the text before a late marker cannot end the stream early.
+
+JSON_MARKER = "JSON_START:"
+
+RESPONSE_KEYS = ['extracted_words', 'translated_extracted_words', 'suggested_words', 'translated_suggested_words',
+                 'image_quality', 'relevance_explanation', 'quality_explanation']
+
+REPAIR_PROMPT = """The text below should contain a single JSON {kind} with the keys {keys}, but it could not be parsed: {error}.
+Return only the corrected JSON {kind}, without any explanation or code fence. Keep all words and translations as they are.
+
+Text:
+{text}
+"""
+
+class JSONExtractionError(ValueError):
+    pass
+
+class JSONExtractor:
+    def __init__(self, marker=JSON_MARKER, opening="{"):
+        self.marker = marker
+        self.opening = opening
+        self.text = ""
+        self._scan = 0
+        self._marker_from = 0
+        self._start = None
+        self._end = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def complete(self):
+        return self._end is not None
+
+    def _find_start(self):
+        if not self.marker:
+            start = self.text.find(self.opening)
+            return start if start != -1 else None
+        # the marker can be split over two chunks
+        marker_loc = self.text.find(self.marker, self._marker_from)
+        if marker_loc == -1:
+            self._marker_from = max(0, len(self.text) - len(self.marker) + 1)
+            return None
+        self._marker_from = marker_loc
+        start = self.text.find(self.opening, marker_loc + len(self.marker))
+        return start if start != -1 else None
+
+    # Returns True once the JSON value is closed, later text is ignored.
+    def feed(self, chunk):
+        if self.complete:
+            return True
+        self.text += chunk
+        if self._start is None:
+            self._start = self._find_start()
+            if self._start is None:
+                return False
+            self._scan = self._start
+        return self._advance()
+
+    # Called at the end of the text: without the marker the first opening bracket is taken.
+    def finish(self):
+        if self._start is None:
+            start = self.text.find(self.opening)
+            if start != -1:
+                self._start = self._scan = start
+                self._advance()
+        return self.complete
+
+    def _advance(self):
+        for i in range(self._scan, len(self.text)):
+            c = self.text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end = i + 1
+                    return True
+        self._scan = len(self.text)
+        return False
+
+    @property
+    def json_text(self):
+        if self._start is None:
+            return None
+        return self.text[self._start:self._end]
+
+    def result(self):
+        self.finish()
+        if self._start is None:
+            raise JSONExtractionError(f"no JSON {'object' if self.opening == '{' else 'array'} found in the response")
+        if not self.complete:
+            raise JSONExtractionError("the JSON value is not closed")
+        try:
+            return json.loads(self.json_text)
+        except json.JSONDecodeError as e:
+            raise JSONExtractionError(f"invalid JSON: {e}") from None
+
+def extract_json(text, marker=JSON_MARKER, opening="{"):
+    extractor = JSONExtractor(marker=marker, opening=opening)
+    extractor.feed(text)
+    extractor.finish()
+    return extractor.result()
+
+# Consumes a streamed response, text_of(chunk) giving the text of each chunk. With
+# stop_early the stream is closed as soon as the extractor saw the JSON value end,
+# which cancels the rest of the generation. Returns (text, last chunk, chunk count).
+def consume_stream(chunks, text_of, extractor=None, stop_early=True):
+    extractor = extractor if extractor is not None else JSONExtractor()
+    last, n_chunks = None, 0
+    try:
+        for chunk in chunks:
+            last = chunk
+            n_chunks += 1
+            if extractor.feed(text_of(chunk) or "") and stop_early:
+                break
+        else:
+            extractor.finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    return extractor.text, last, n_chunks
+
+def build_repair_prompt(text, error, keys=RESPONSE_KEYS, opening="{"):
+    kind = "object" if opening == "{" else "array of objects"
+    return REPAIR_PROMPT.format(kind=kind, keys=", ".join(keys), error=error, text=text)
@@ -1,56 +1,57 @@
-import json
 import logging
-import time
-import ollama
 import httpx
-import pandas as pd
+from ..cache import bytes_hash, make_key, to_jsonable
+from .backends import get_ollama_backend
+from .dispatch import ResponseError, SharedBackoff, call_with_backoff, estimate_tokens
+from .json_extraction import JSONExtractor, build_repair_prompt, consume_stream
 # from src.ocr.text_extraction import extract_ocr_text
 
-class ResponseError(Exception):
-    pass
-
-def chat_debug(model, messages, stream=False, max_retries=10, wait_time=1):
-    retries = 0
-    while retries < max_retries:
-        try:
-            response = ollama.chat(
-                model=model,
-                messages=messages,
-                stream=stream,
-                keep_alive="1s"
-            )
-            return response
-        except httpx.HTTPStatusError as e:
-            logging.error(f"HTTPStatusError: {e.response.status_code} - {e.response.text}")
-            if e.response.status_code == 429:
-                logging.info("Rate limit exceeded. Retrying...")
-                time.sleep(wait_time)
-                retries += 1
-                wait_time *= 2  # Exponential backoff
-            else:
-                raise ResponseError(e.response.text, e.response.status_code) from None
-        except Exception as e:
-            logging.error(f"Unexpected error: {str(e)}")
-            raise
-
-    raise ResponseError("No slots available after maximum retries")
-
-def ocr_llava(prompt, path, model='llava-llama3', temperature=0.2):
-    with open(path, "rb") as image_file:
-        image_bytes = image_file.read()
-        result = ollama.generate(
+def chat_debug(model, messages, stream=False, max_retries=10, wait_time=1, backoff=None, rate_limiter=None, backend=None):
+    backoff = backoff if backoff is not None else SharedBackoff(initial_wait=wait_time)
+    backend = backend if backend is not None else get_ollama_backend()
+    try:
+        return call_with_backoff(
+            backend.chat,
+            backoff=backoff,
+            rate_limiter=rate_limiter,
+            tokens=sum(estimate_tokens(m.get('content', '')) for m in messages),
+            max_retries=max_retries,
             model=model,
-            prompt=prompt,
-            images=[image_bytes],
-            stream=False,
-            options={"temperature": temperature},
-            keep_alive="1s",
-            context="",
-        )['response']
-        return result
-
-def chat(model, messages, stream=False, temperature=0.2):
-    response = ollama.chat(
+            messages=messages,
+            stream=stream,
+        )
+    except httpx.HTTPStatusError as e:
+        logging.error(f"HTTPStatusError: {e.response.status_code} - {e.response.text}")
+        raise ResponseError(e.response.text, e.response.status_code) from None
+
+# image_bytes (e.g. PreparedImage.llava_payload()) is sent instead of reading path
+def ocr_llava(prompt, path, model='llava-llama3', temperature=0.2, cache=None, backend=None, image_bytes=None):
+    if image_bytes is None:
+        with open(path, "rb") as image_file:
+            image_bytes = image_file.read()
+
+    cache_key = make_key(model, bytes_hash(prompt.encode("utf-8")), bytes_hash(image_bytes), {"temperature": temperature, "mode": "generate"})
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    backend = backend if backend is not None else get_ollama_backend()
+    result = backend.generate(
+        model=model,
+        prompt=prompt,
+        images=[image_bytes],
+        stream=False,
+        options={"temperature": temperature},
+        context="",
+    )['response']
+    if cache is not None:
+        cache.put(cache_key, result)
+    return result
+
+def chat(model, messages, stream=False, temperature=0.2, backend=None):
+    backend = backend if backend is not None else get_ollama_backend()
+    response = backend.chat(
         model=model,
         messages=messages,
         stream=stream,
@@ -58,10 +59,49 @@ def chat(model, messages, stream=False, temperature=0.2):
     )
     return response
 
-def ocr_llava_chat(prompt, path, model='llava-llama3', temperature=0.2):
-    with open(path, "rb") as image_file:
-        image_bytes = image_file.read()
-    
+# Streams the chat answer into a JSON extractor and stops the generation once the
+# JSON value is closed. ollama only reports token counts on its final chunk, so an
+# answer cut short counts its chunks (one token each) as eval_count instead.
+def _stream_chat_json(model, messages, temperature=0.2, backend=None, opening="{"):
+    chunks = chat(model, messages, stream=True, temperature=temperature, backend=backend)
+    content, last, n_chunks = consume_stream(chunks, lambda chunk: chunk['message']['content'], JSONExtractor(opening=opening))
+    response = to_jsonable(last) if last is not None else {}
+    if not response.get('done'):
+        response = {'model': model, 'done': False, 'stopped_early': True, 'eval_count': n_chunks}
+    response['message'] = {'role': 'assistant', 'content': content}
+    return content, response
+
+def _cached_chat(cache, cache_key):
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is None:
+        return None
+    return cached['content'], dict(cached['response'], cached=True)
+
+def _chat_cache_key(prompt, image_bytes, model, temperature):
+    return make_key(model, bytes_hash(prompt.encode("utf-8")), bytes_hash(image_bytes), {"temperature": temperature, "mode": "chat"})
+
+def _chat_batch_cache_key(prompt, images_bytes, model, temperature):
+    return make_key(model, bytes_hash(prompt.encode("utf-8")), [bytes_hash(b) for b in images_bytes], {"temperature": temperature, "mode": "chat_batch"})
+
+# The cached answer of ocr_llava_chat (or ocr_llava_chat_batch) for these arguments,
+# or None. Callers look it up before waiting on the backoff and the rate limiter, so
+# a cache hit never waits for a request slot, and then call with check_cache=False.
+def lookup_ocr_llava_chat(prompt, image_bytes, model='llava-llama3', temperature=0.2, cache=None):
+    return _cached_chat(cache, _chat_cache_key(prompt, image_bytes, model, temperature))
+
+def lookup_ocr_llava_chat_batch(prompt, images_bytes, model='llava-llama3', temperature=0.2, cache=None):
+    return _cached_chat(cache, _chat_batch_cache_key(prompt, images_bytes, model, temperature))
+
+def ocr_llava_chat(prompt, path, model='llava-llama3', temperature=0.2, cache=None, backend=None, image_bytes=None, stream=False, check_cache=True):
+    if image_bytes is None:
+        with open(path, "rb") as image_file:
+            image_bytes = image_file.read()
+
+    cache_key = _chat_cache_key(prompt, image_bytes, model, temperature)
+    cached = _cached_chat(cache, cache_key) if check_cache else None
+    if cached is not None:
+        return cached
+
     messages = [
         {
             'role': 'user',
@@ -75,5 +115,68 @@ def ocr_llava_chat(prompt, path, model='llava-llama3', temperature=0.2):
         }
     ]
     
-    result = chat(model, messages, stream=False, temperature=temperature)
-    return result['message']['content'], result
\ No newline at end of file
+    if stream:
+        content, result = _stream_chat_json(model, messages, temperature=temperature, backend=backend)
+    else:
+        result = chat(model, messages, stream=False, temperature=temperature, backend=backend)
+        content = result['message']['content']
+    if cache is not None:
+        cache.put(cache_key, {'content': content, 'response': result})
+    return content, result
+
+# One chat request for several images, all attached to the first message in order.
+# images_bytes replaces reading paths, like image_bytes in ocr_llava_chat.
+def ocr_llava_chat_batch(prompt, paths, model='llava-llama3', temperature=0.2, cache=None, backend=None, images_bytes=None, stream=False, check_cache=True):
+    if images_bytes is None:
+        images_bytes = []
+        for path in paths:
+            with open(path, "rb") as image_file:
+                images_bytes.append(image_file.read())
+
+    cache_key = _chat_batch_cache_key(prompt, images_bytes, model, temperature)
+    cached = _cached_chat(cache, cache_key) if check_cache else None
+    if cached is not None:
+        return cached
+
+    messages = [
+        {
+            'role': 'user',
+            'images': list(images_bytes),
+            'content': ' '
+        },
+        {
+            'role': 'user',
+            'images': [],
+            'content': prompt
+        }
+    ]
+
+    if stream:
+        content, result = _stream_chat_json(model, messages, temperature=temperature, backend=backend, opening="[")
+    else:
+        result = chat(model, messages, stream=False, temperature=temperature, backend=backend)
+        content = result['message']['content']
+    if cache is not None:
+        cache.put(cache_key, {'content': content, 'response': result})
+    return content, result
+
+def _repair_cache_key(text, error, model, temperature, opening):
+    return make_key(model, bytes_hash(text.encode("utf-8")), error, {"temperature": temperature, "opening": opening, "mode": "repair"})
+
+def lookup_repair_json_llava(text, error, model='llava-llama3', temperature=0.0, cache=None, opening="{"):
+    return _cached_chat(cache, _repair_cache_key(text, error, model, temperature, opening))
+
+# Cheap text-only follow-up that asks the model to fix a response whose JSON could
+# not be parsed, instead of sending the image and the full prompt again. Repairs are
+# cached like the responses, so a rerun does not pay for them again.
+def repair_json_llava(text, error, model='llava-llama3', temperature=0.0, backend=None, opening="{", cache=None, check_cache=True):
+    cache_key = _repair_cache_key(text, error, model, temperature, opening)
+    cached = _cached_chat(cache, cache_key) if check_cache else None
+    if cached is not None:
+        return cached
+    messages = [{'role': 'user', 'content': build_repair_prompt(text, error, opening=opening)}]
+    result = chat(model, messages, stream=False, temperature=temperature, backend=backend)
+    content = result['message']['content']
+    if cache is not None:
+        cache.put(cache_key, {'content': content, 'response': result})
+    return content, result
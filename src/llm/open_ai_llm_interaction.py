@@ -2,32 +2,110 @@ import openai
 # from openai import OpenAI
 from PIL import Image
 import io
-import sys
+import os
 import base64
 
-from .credentials import openai_key
+from ..cache import bytes_hash, make_key, to_jsonable
+from .backends import get_openai_backend
+from .dispatch import ResponseError, estimate_tokens
+from .json_extraction import JSONExtractor, build_repair_prompt, consume_stream
+try:
+    from .credentials import openai_key
+except ImportError:
+    openai_key = os.environ.get("OPENAI_API_KEY")
 
-def query_chatGPT(user_prompt, img_path, system_prompt = None, temperature=1, max_tokens=256, top_p=1, frequency_penalty=0, presence_penalty=0):
-    if not openai_key:
-        print("Error: No OpenAI API key found. Please set the API key in the credentials file.")
-        sys.exit(1)
+def _encode_thumbnail(image_bytes, max_side=128):
+    # Load, resize, and encode the image
+    img = Image.open(io.BytesIO(image_bytes))
 
-    client = openai.OpenAI(api_key=openai_key)
-    system_prompt = system_prompt if system_prompt else "Please describe the image."
+    # Resize the image, maintaining aspect ratio and ensuring max dimensions of 128x128
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    # Save the resized image to a bytes buffer to avoid writing back to disk
+    img_byte_arr = io.BytesIO()
+    img.save(img_byte_arr, format='JPEG')
+    return base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
+
+def _delta_text(chunk):
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+# With stream, the answer is fed into a JSON extractor and the stream is closed once
+# the JSON value is complete. Usage only arrives with the last chunk, so an answer
+# cut short gets estimated token counts.
+def _stream_completion(backend, model, messages, opening="{", **params):
+    chunks = backend.chat_completion(model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **params)
+    content, last, n_chunks = consume_stream(chunks, _delta_text, JSONExtractor(opening=opening))
+    usage = getattr(last, 'usage', None)
+    if usage is not None:
+        return content, {'model': model, 'usage': to_jsonable(usage)}
+    prompt_tokens = sum(estimate_tokens(m['content']) for m in messages)
+    return content, {'model': model, 'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': n_chunks}, 'stopped_early': True}
+
+def _chat_completion(backend, model, messages, stream=False, opening="{", **params):
+    # Call the OpenAI API through the shared, pooled client
+    backend = backend if backend is not None else get_openai_backend(api_key=openai_key)
+    try:
+        if stream:
+            return _stream_completion(backend, model, messages, opening=opening, **params)
+        response = backend.chat_completion(model=model, messages=messages, **params)
+        return response.choices[0].message.content, response
+    except openai.RateLimitError:
+        # let the dispatcher back off and retry instead of exiting
+        raise
+    except Exception as e:
+        raise ResponseError(f"An exception occurred while querying ChatGPT: {str(e)}") from e
+
+def _cached_completion(cache, cache_key):
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is None:
+        return None
+    return cached['content'], dict(cached['response'], cached=True)
 
-    # Open, resize, and encode the image
+def _image_bytes(img_path, encoded_image=None):
+    # encoded_image (e.g. PreparedImage.openai_payload()) replaces reading and resizing img_path
+    if encoded_image is not None:
+        return encoded_image.encode('utf-8')
     with open(img_path, 'rb') as image_file:
-        # Load the image
-        img = Image.open(image_file)
-        
-        # Resize the image, maintaining aspect ratio and ensuring max dimensions of 512x512
-        img.thumbnail((128, 128), Image.Resampling.LANCZOS)
-        
-        # Save the resized image to a bytes buffer to avoid writing back to disk
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='JPEG')
-        encoded_string = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-    
+        return image_file.read()
+
+def _completion_cache_key(user_prompt, images_hash, system_prompt, model, params):
+    system_prompt = system_prompt if system_prompt else "Please describe the image."
+    return make_key(model, bytes_hash((system_prompt + "\n" + user_prompt).encode("utf-8")), images_hash, params)
+
+def _params(temperature, max_tokens, top_p, frequency_penalty, presence_penalty):
+    return {"temperature": temperature, "max_tokens": max_tokens, "top_p": top_p, "frequency_penalty": frequency_penalty, "presence_penalty": presence_penalty}
+
+# The cached answer of query_chatGPT (or query_chatGPT_batch) for these arguments, or
+# None. Callers look it up before waiting on the backoff and the rate limiter, so a
+# cache hit never waits for a request slot, and then call with check_cache=False.
+def lookup_query_chatGPT(user_prompt, img_path, system_prompt=None, temperature=1, max_tokens=256, top_p=1, frequency_penalty=0, presence_penalty=0, model="gpt-4o", cache=None, encoded_image=None):
+    if cache is None:
+        return None
+    params = _params(temperature, max_tokens, top_p, frequency_penalty, presence_penalty)
+    return _cached_completion(cache, _completion_cache_key(user_prompt, bytes_hash(_image_bytes(img_path, encoded_image)), system_prompt, model, params))
+
+def lookup_query_chatGPT_batch(user_prompt, img_paths, system_prompt=None, temperature=1, max_tokens=256, top_p=1, frequency_penalty=0, presence_penalty=0, model="gpt-4o", cache=None, encoded_images=None):
+    if cache is None:
+        return None
+    params = _params(temperature, max_tokens, top_p, frequency_penalty, presence_penalty)
+    images_bytes = [_image_bytes(p, e) for p, e in zip(img_paths, encoded_images if encoded_images is not None else [None] * len(img_paths))]
+    return _cached_completion(cache, _completion_cache_key(user_prompt, [bytes_hash(b) for b in images_bytes], system_prompt, model, params))
+
+def query_chatGPT(user_prompt, img_path, system_prompt = None, temperature=1, max_tokens=256, top_p=1, frequency_penalty=0, presence_penalty=0, model="gpt-4o", cache=None, backend=None, encoded_image=None, stream=False, check_cache=True):
+    if backend is None and not openai_key:
+        raise ResponseError("No OpenAI API key found. Please set the API key in the credentials file or the OPENAI_API_KEY environment variable.")
+
+    system_prompt = system_prompt if system_prompt else "Please describe the image."
+    image_bytes = _image_bytes(img_path, encoded_image)
+
+    params = _params(temperature, max_tokens, top_p, frequency_penalty, presence_penalty)
+    cache_key = _completion_cache_key(user_prompt, bytes_hash(image_bytes), system_prompt, model, params)
+    cached = _cached_completion(cache, cache_key) if check_cache else None
+    if cached is not None:
+        return cached
+
+    encoded_string = encoded_image if encoded_image is not None else _encode_thumbnail(image_bytes)
+
     # Prepare the messages for the API call
     messages = [
         {
@@ -44,18 +122,73 @@ def query_chatGPT(user_prompt, img_path, system_prompt = None, temperature=1, ma
         }
     ]
     
-    # Call the OpenAI API
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=top_p,
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty
-        )
-        return response.choices[0].message.content, response
-    except Exception as e:
-        print(f"Error: An exception occurred while querying ChatGPT: {str(e)}")
-        sys.exit(1)
\ No newline at end of file
+    content, response = _chat_completion(backend, model, messages, stream=stream, **params)
+    if cache is not None:
+        cache.put(cache_key, {'content': content, 'response': response})
+    return content, response
+
+# One request for several images, each sent as its own numbered message after the
+# shared prompt. encoded_images replaces reading and resizing img_paths.
+def query_chatGPT_batch(user_prompt, img_paths, system_prompt=None, temperature=1, max_tokens=256, top_p=1, frequency_penalty=0, presence_penalty=0, model="gpt-4o", cache=None, backend=None, encoded_images=None, stream=False, check_cache=True):
+    if backend is None and not openai_key:
+        raise ResponseError("No OpenAI API key found. Please set the API key in the credentials file or the OPENAI_API_KEY environment variable.")
+
+    system_prompt = system_prompt if system_prompt else "Please describe the image."
+    if encoded_images is None:
+        images_bytes = []
+        for img_path in img_paths:
+            with open(img_path, 'rb') as image_file:
+                images_bytes.append(image_file.read())
+    else:
+        images_bytes = [encoded.encode('utf-8') for encoded in encoded_images]
+
+    params = _params(temperature, max_tokens, top_p, frequency_penalty, presence_penalty)
+    cache_key = _completion_cache_key(user_prompt, [bytes_hash(b) for b in images_bytes], system_prompt, model, params)
+    cached = _cached_completion(cache, cache_key) if check_cache else None
+    if cached is not None:
+        return cached
+
+    encoded_strings = encoded_images if encoded_images is not None else [_encode_thumbnail(b) for b in images_bytes]
+    messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": user_prompt
+        }
+    ] + [
+        {
+            "role": "user",
+            "content": f"Image {i}: data:image/jpeg;base64," + encoded_string
+        }
+        for i, encoded_string in enumerate(encoded_strings)
+    ]
+
+    content, response = _chat_completion(backend, model, messages, stream=stream, opening="[", **params)
+    if cache is not None:
+        cache.put(cache_key, {'content': content, 'response': response})
+    return content, response
+
+def _repair_cache_key(text, error, model, max_tokens, opening):
+    return make_key(model, bytes_hash(text.encode("utf-8")), error, {"max_tokens": max_tokens, "opening": opening, "mode": "repair"})
+
+def lookup_repair_json_chatGPT(text, error, model="gpt-4o-mini", max_tokens=1024, cache=None, opening="{"):
+    return _cached_completion(cache, _repair_cache_key(text, error, model, max_tokens, opening))
+
+# Cheap text-only follow-up that asks a small model to fix a response whose JSON could
+# not be parsed, instead of sending the image and the full prompt again. Repairs are
+# cached like the responses, so a rerun does not pay for them again.
+def repair_json_chatGPT(text, error, model="gpt-4o-mini", max_tokens=1024, backend=None, opening="{", cache=None, check_cache=True):
+    cache_key = _repair_cache_key(text, error, model, max_tokens, opening)
+    cached = _cached_completion(cache, cache_key) if check_cache else None
+    if cached is not None:
+        return cached
+    if backend is None and not openai_key:
+        raise ResponseError("No OpenAI API key found. Please set the API key in the credentials file or the OPENAI_API_KEY environment variable.")
+    messages = [{"role": "user", "content": build_repair_prompt(text, error, opening=opening)}]
+    content, response = _chat_completion(backend, model, messages, temperature=0, max_tokens=max_tokens)
+    if cache is not None:
+        cache.put(cache_key, {'content': content, 'response': response})
+    return content, response
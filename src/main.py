@@ -1,74 +1,294 @@
 import os
 import argparse
-import time
-import pandas as pd
+from datetime import datetime
 
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.image_utils import *
-from src.ocr import *
-from src.llm import *
-from src.deck import *
+# Only lightweight modules are imported here. Backends (openai, ollama, pillow_heif,
+# tesseract, genanki, pandas) are imported by the stages that use them.
+from src.cache import DiskCache
+from src.metrics import MetricsRecorder
+from src.llm import RateLimiter, SharedBackoff, build_batch_prompt, call_with_backoff, estimate_tokens, split_batch_response
+from src.pipeline import QUEUE_NAME, RunJournal, WorkQueue, default_worker_id, load_run_config, merge_journals, run_pipeline, run_worker, save_run_config
 
 os.environ['TESSDATA_PREFIX'] = 'tools/'
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Process images and generate Anki decks')
-    parser.add_argument('--input_directory', type=str, help='Input directory containing images')
+    parser.add_argument('--input_directory', type=str, help='Input directory containing images (required unless --resume is given)')
+    parser.add_argument('--resume', type=str, default=None, help='Result directory of a previous run to continue from its last completed image')
     parser.add_argument('--use_openai', action='store_true', default=False, help='Use OpenAI GPT instead of LLaVA')
-    return parser.parse_args()
-
-def batch_ocr_llava_response(prompt, language_level, img_paths, temperature=0.2, chat=True, wait=1):
-    content_responses = []
-    model_responses = []
-    ocr_text_list = []
-    for i, img_path in enumerate(img_paths):
-        print(f"Processing image: {i+1} of {len(img_paths)} - {img_path}")
-        ocr_text = extract_ocr_text(img_path)
-        ocr_text_list.append(ocr_text)
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for HEIC conversion (default: all cores)')
+    parser.add_argument('--jpg_quality', type=int, default=75, help='JPEG quality of the converted images')
+    parser.add_argument('--max_concurrency', type=int, default=None, help='Maximum number of images sent to the model at the same time')
+    parser.add_argument('--requests_per_minute', type=int, default=None, help='Request budget per minute for the model backend')
+    parser.add_argument('--tokens_per_minute', type=int, default=None, help='Token budget per minute for the model backend')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Directory of the model response cache (default: <input_directory>/.cache)')
+    parser.add_argument('--no_cache', action='store_true', default=False, help='Bypass the model response cache')
+    parser.add_argument('--cache_max_entries', type=int, default=None, help='Evict the least recently used cache entries above this count')
+    parser.add_argument('--cache_max_age_days', type=float, default=None, help='Evict cache entries older than this many days')
+    parser.add_argument('--metadata_workers', type=int, default=4, help='Threads reading EXIF metadata while the photos are being converted')
+    parser.add_argument('--ocr_workers', type=int, default=None, help='Worker processes for OCR (default: all cores)')
+    parser.add_argument('--ocr_max_side', type=int, default=None, help='Convert to grayscale and downscale images to this longest side before OCR')
+    parser.add_argument('--ocr_binarize', action='store_true', default=False, help='Convert to grayscale and binarise images before OCR')
+    parser.add_argument('--vocab_store', type=str, default=None, help='Directory of the Parquet vocabulary store accumulated across runs (default: <input_directory>/vocab_store)')
+    parser.add_argument('--incremental_deck', action='store_true', default=False, help='Only export notes that were not exported by a previous run')
+    parser.add_argument('--deck_shard_by', type=str, choices=['month'], default=None, help='Split the deck into one sub-deck and .apkg per photo month')
+    parser.add_argument('--dedup', action='store_true', default=False, help='Reuse the results of near-duplicate photos instead of sending them to the model')
+    parser.add_argument('--dedup_distance', type=int, default=6, help='Maximum Hamming distance between perceptual hashes of near-duplicate photos')
+    parser.add_argument('--ollama_host', type=str, default=None, help='ollama server URL, or a comma separated list of servers to spread the requests over (default: OLLAMA_HOST or http://localhost:11434)')
+    parser.add_argument('--keep_alive', type=str, default='5m', help='How long ollama keeps the model loaded between requests, e.g. 5m, 1h or -1 to keep it resident')
+    parser.add_argument('--max_image_size', type=int, default=None, help='Downscale converted images so their longest side is at most this many pixels')
+    parser.add_argument('--prepare_in_memory', action='store_true', default=False, help='Decode every photo once and share it between OCR and the model instead of re-reading the JPG in each stage')
+    parser.add_argument('--no_jpg', action='store_true', default=False, help='Do not write JPG copies of the photos (implies --prepare_in_memory)')
+    parser.add_argument('--llava_max_side', type=int, default=None, help='Longest side of the image sent to LLaVA with --prepare_in_memory (default: full size)')
+    parser.add_argument('--openai_max_side', type=int, default=128, help='Longest side of the image sent to OpenAI with --prepare_in_memory')
+    parser.add_argument('--no_stream', action='store_true', default=False, help='Wait for complete model responses instead of streaming them and stopping once the JSON object is closed')
+    parser.add_argument('--no_repair', action='store_true', default=False, help='Do not send a short repair request for responses whose JSON cannot be parsed')
+    parser.add_argument('--cluster', action='store_true', default=False, help='Group photos taken close together and generate suggested words once per group')
+    parser.add_argument('--cluster_distance', type=float, default=50.0, help='Maximum distance in metres between photos of one group')
+    parser.add_argument('--cluster_gap', type=float, default=15.0, help='Maximum time in minutes between photos of one group')
+    parser.add_argument('--batch_size', type=int, default=1, help='Send up to this many images with their OCR text in one model request (default: one request per image)')
+    parser.add_argument('--queue', type=str, default=None, help='Directory of a work queue shared by several worker processes or hosts, used with --enqueue, --worker or --reduce')
+    parser.add_argument('--enqueue', action='store_true', default=False, help='Add the photos of --input_directory to the --queue and exit')
+    parser.add_argument('--worker', action='store_true', default=False, help='Process photos from the --queue until it is empty')
+    parser.add_argument('--reduce', action='store_true', default=False, help='Merge the results of all workers of the --queue into the tables and the deck')
+    parser.add_argument('--worker_id', type=str, default=None, help='Name of this worker (default: <hostname>-<pid>)')
+    parser.add_argument('--lease_size', type=int, default=8, help='Photos a worker takes from the queue at a time')
+    parser.add_argument('--lease_seconds', type=float, default=600, help='Photos of a worker that stopped renewing its lease for this long go to another worker')
+    args = parser.parse_args()
+    modes = [mode for mode in ('enqueue', 'worker', 'reduce') if getattr(args, mode)]
+    if bool(modes) != bool(args.queue):
+        parser.error('--queue is used with one of --enqueue, --worker or --reduce')
+    if len(modes) > 1:
+        parser.error('only one of --enqueue, --worker or --reduce can be given')
+    if args.worker and (args.dedup or args.cluster):
+        parser.error('--dedup and --cluster are not supported with --worker, as each worker only sees its own photos')
+    if not args.input_directory and not args.resume and not (args.worker or args.reduce):
+        parser.error('--input_directory is required unless a run is continued with --resume')
+    return args
+
+def parse_keep_alive(value):
+    # plain numbers are seconds for ollama (-1 keeps the model loaded), anything else is a duration like "5m"
+    return int(value) if value.lstrip('-').isdigit() else value
+
+# The query functions send the prepared image's encoded payload when they get one,
+# otherwise they read img_path. The response cache is checked before a request waits
+# on the backoff and the rate limiter, so cached images never wait for a slot.
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def make_llava_query(prompt, language_level, temperature=0.2, wait=1, requests_per_minute=None, tokens_per_minute=None, cache=None, backend=None, max_side=None, backoff=None, rate_limiter=None, stream=False):
+    from src.llm import lookup_ocr_llava_chat, ocr_llava_chat
+    backoff = backoff if backoff is not None else SharedBackoff(initial_wait=wait)
+    rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def query(ocr_text, img_path, prepared=None):
         ocr_prompt = prompt.format(ocr_output=ocr_text, language_level=language_level)
-        if chat:
-            c_response, m_response = ocr_llava_chat(ocr_prompt, img_path, temperature=temperature)
-            print(json.dumps(m_response, indent=4))
-            model_responses.append(m_response)
-        else:
-            c_response = ocr_llava(ocr_prompt, img_path, temperature=temperature)
-        time.sleep(wait)
-        content_responses.append(c_response)
+        image_bytes = prepared.llava_payload(max_side) if prepared is not None else _read_file(img_path)
+        cached = lookup_ocr_llava_chat(ocr_prompt, image_bytes, temperature=temperature, cache=cache)
+        if cached is not None:
+            return cached
+        return call_with_backoff(ocr_llava_chat, ocr_prompt, img_path, temperature=temperature, cache=cache, backend=backend, image_bytes=image_bytes, stream=stream, check_cache=False,
+                                 backoff=backoff, rate_limiter=rate_limiter, tokens=estimate_tokens(ocr_prompt))
+    return query
+
+# Batched variants: one request carries several images under the shared instructions
+# and the answer is split back into one response per image.
+def make_llava_batch_query(prompt, language_level, temperature=0.2, cache=None, backend=None, max_side=None, backoff=None, rate_limiter=None, stream=False):
+    from src.llm import lookup_ocr_llava_chat_batch, ocr_llava_chat_batch
 
-    return content_responses, model_responses, ocr_text_list
+    def query(ocr_texts, img_paths, prepared=None):
+        batch_prompt = build_batch_prompt(prompt, ocr_texts, language_level)
+        images_bytes = [p.llava_payload(max_side) for p in prepared] if prepared is not None else [_read_file(path) for path in img_paths]
+        cached = lookup_ocr_llava_chat_batch(batch_prompt, images_bytes, temperature=temperature, cache=cache)
+        if cached is None:
+            cached = call_with_backoff(ocr_llava_chat_batch, batch_prompt, img_paths, temperature=temperature, cache=cache, backend=backend, images_bytes=images_bytes, stream=stream, check_cache=False,
+                                       backoff=backoff, rate_limiter=rate_limiter, tokens=estimate_tokens(batch_prompt))
+        content, response = cached
+        return split_batch_response(content, len(img_paths)), response
+    return query
 
-def batch_openai_chatGPT_response(user_prompt, language_level, img_paths, system_prompt = None, max_tokens=4096, presence_penalty=0):
-    content_responses = []
-    ocr_text_list = []
-    model_responses = []
+def make_openai_query(user_prompt, language_level, system_prompt=None, max_tokens=4096, presence_penalty=0, requests_per_minute=None, tokens_per_minute=None, cache=None, backend=None, max_side=128, backoff=None, rate_limiter=None, stream=False):
+    from src.llm import lookup_query_chatGPT, query_chatGPT
     system_prompt = system_prompt if system_prompt else "Please describe the image."
-    for i, img_path in enumerate(img_paths):
-        print(f"Processing image: {i+1} of {len(img_paths)} - {img_path}")
-        ocr_text = extract_ocr_text(img_path)
-        ocr_text_list.append(ocr_text)
+    backoff = backoff if backoff is not None else SharedBackoff()
+    rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def query(ocr_text, img_path, prepared=None):
         ocr_prompt = user_prompt.format(ocr_output=ocr_text, language_level=language_level)
-        c_response, m_response = query_chatGPT(ocr_prompt, img_path, system_prompt=system_prompt, max_tokens=max_tokens, presence_penalty=presence_penalty)
-        content_responses.append(c_response)
-        model_responses.append(m_response)
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(ocr_prompt) + max_tokens
+        encoded_image = prepared.openai_payload(max_side) if prepared is not None else None
+        cached = lookup_query_chatGPT(ocr_prompt, img_path, system_prompt=system_prompt, max_tokens=max_tokens, presence_penalty=presence_penalty, cache=cache, encoded_image=encoded_image)
+        if cached is not None:
+            return cached
+        return call_with_backoff(query_chatGPT, ocr_prompt, img_path, system_prompt=system_prompt, max_tokens=max_tokens, presence_penalty=presence_penalty, cache=cache, backend=backend, encoded_image=encoded_image, stream=stream,
+                                 check_cache=False, backoff=backoff, rate_limiter=rate_limiter, tokens=tokens)
+    return query
+
+def make_openai_batch_query(user_prompt, language_level, system_prompt=None, max_tokens=4096, presence_penalty=0, cache=None, backend=None, max_side=128, backoff=None, rate_limiter=None, stream=False):
+    from src.llm import lookup_query_chatGPT_batch, query_chatGPT_batch
+    system_prompt = system_prompt if system_prompt else "Please describe the image."
+
+    def query(ocr_texts, img_paths, prepared=None):
+        batch_prompt = build_batch_prompt(user_prompt, ocr_texts, language_level)
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(batch_prompt) + max_tokens
+        encoded_images = [p.openai_payload(max_side) for p in prepared] if prepared is not None else None
+        cached = lookup_query_chatGPT_batch(batch_prompt, img_paths, system_prompt=system_prompt, max_tokens=max_tokens, presence_penalty=presence_penalty, cache=cache, encoded_images=encoded_images)
+        if cached is None:
+            cached = call_with_backoff(query_chatGPT_batch, batch_prompt, img_paths, system_prompt=system_prompt, max_tokens=max_tokens, presence_penalty=presence_penalty, cache=cache, backend=backend, encoded_images=encoded_images,
+                                       stream=stream, check_cache=False, backoff=backoff, rate_limiter=rate_limiter, tokens=tokens)
+        content, response = cached
+        return split_batch_response(content, len(img_paths)), response
+    return query
+
+# Repair functions send the unparseable response back as a short text-only request.
+def make_llava_repair(model='llava-llama3', backend=None, backoff=None, rate_limiter=None, cache=None):
+    from src.llm import lookup_repair_json_llava, repair_json_llava
+
+    def repair(text, error):
+        cached = lookup_repair_json_llava(text, error, model=model, cache=cache)
+        if cached is not None:
+            return cached
+        return call_with_backoff(repair_json_llava, text, error, model=model, backend=backend, cache=cache, check_cache=False,
+                                 backoff=backoff, rate_limiter=rate_limiter, tokens=estimate_tokens(text))
+    return repair
+
+def make_openai_repair(model='gpt-4o-mini', backend=None, backoff=None, rate_limiter=None, cache=None):
+    from src.llm import lookup_repair_json_chatGPT, repair_json_chatGPT
+
+    def repair(text, error):
+        cached = lookup_repair_json_chatGPT(text, error, model=model, cache=cache)
+        if cached is not None:
+            return cached
+        return call_with_backoff(repair_json_chatGPT, text, error, model=model, backend=backend, cache=cache, check_cache=False,
+                                 backoff=backoff, rate_limiter=rate_limiter, tokens=estimate_tokens(text) + 1024)
+    return repair
 
-    return content_responses, model_responses, ocr_text_list
+def write_results(journal, result_directory, vocab_store=None, deck_index_path=None, deck_shard_by=None, metrics=None, clusterer=None):
+    import pandas as pd
+    from src.image_utils import build_table_from_responses, build_vocab_table
+    from src.deck import build_anki_deck
 
+    failed = journal.failed()
+    errors_path = os.path.join(result_directory, 'errors.csv')
+    if failed:
+        pd.DataFrame(failed)[['image_id', 'jpg_path', 'failed_stage', 'error']].to_csv(errors_path, index=False)
+        print(f"{len(failed)} images failed, see errors.csv. Rerun with --resume {result_directory} to retry them.")
+    elif os.path.exists(errors_path):
+        # a resumed run retried every failed image successfully
+        os.remove(errors_path)
+
+    records = journal.records()
+    if not records:
+        print("No images were processed successfully.")
+        return
+
+    responses_df, metadata_df = build_table_from_responses(
+        [r['response'] for r in records],
+        [r['ocr_text'] for r in records],
+        [r['metadata'] for r in records],
+        [r['jpg_path'] for r in records],
+        parsed_responses=[r['parsed'] for r in records],
+    )
+    photo_df_metadata_cols = ['photo_id', 'image_datetime', 'latitude_ref', 'latitude', 'longitude_ref', 'longitude', 'altitude_ref', 'altitude', 'timestamp', 'date', 'gps_datetime', 'jpg_path']
+    photo_df_response_cols = ['photo_id', 'json_response', 'ocr_text', 'extracted_words', 'translated_extracted_words', 'suggested_words', 'translated_suggested_words', 'image_quality', 'relevance_explanation', 'quality_explanation']
+    photo_df = pd.merge(metadata_df[photo_df_metadata_cols], responses_df[photo_df_response_cols], on='photo_id')
+    # clusters merged after a photo was journaled get their final id from the clusterer
+    photo_df['cluster_id'] = [clusterer.cluster_of(r['image_id']) if clusterer is not None and r['image_id'] in clusterer.parent
+                              else r.get('cluster_id', r['image_id']) for r in records]
+    vocab_df = build_vocab_table(photo_df, quality_cutoff='low')
+
+    vocab_df.to_csv(os.path.join(result_directory, 'vocab_table.csv'), index=False)
+    photo_df.to_csv(os.path.join(result_directory, 'photo_table.csv'), index=False)
+    deck_df = vocab_df
+    if deck_shard_by == 'month':
+        photo_months = photo_df.set_index('photo_id')['image_datetime'].dt.strftime('%Y-%m')
+        deck_df = vocab_df.assign(month=vocab_df['photo_id'].map(photo_months).fillna('unknown'))
+    if metrics is not None:
+        with metrics.stage('deck', rows=len(deck_df)):
+            build_anki_deck(deck_df, result_directory, index_path=deck_index_path, shard_by=deck_shard_by)
+    else:
+        build_anki_deck(deck_df, result_directory, index_path=deck_index_path, shard_by=deck_shard_by)
+
+    if vocab_store is not None:
+        new_vocab_df = vocab_store.append(vocab_df, run_id=os.path.basename(result_directory))
+        print(f"Added {len(new_vocab_df)} new words to the vocabulary store ({len(vocab_store)} words total)")
+
+def open_vocab_store(args, input_directory):
+    from src.image_utils import VocabStore
+    return VocabStore(args.vocab_store if args.vocab_store else os.path.join(input_directory, 'vocab_store'))
+
+def deck_index_file(args, cache_dir):
+    return os.path.join(cache_dir, 'anki_export_index.json') if args.incremental_deck else None
+
+# Merges the journals of all workers of the queue into one journal and writes the
+# tables and the deck from it like a single run does.
+def reduce_results(args, result_directory, input_directory, cache_dir):
+    queue = WorkQueue(os.path.join(result_directory, QUEUE_NAME))
+    counts = queue.counts()
+    queue.close()
+    if counts['pending'] or counts['leased']:
+        print(f"Warning: {counts['pending'] + counts['leased']} photos of the queue are not processed yet, they are missing from the results")
+    journal = merge_journals(result_directory)
+    try:
+        write_results(journal, result_directory, vocab_store=open_vocab_store(args, input_directory), deck_index_path=deck_index_file(args, cache_dir),
+                      deck_shard_by=args.deck_shard_by)
+    finally:
+        journal.close()
 
 def main():
     args = parse_arguments()
-    input_directory = args.input_directory if args.input_directory else "/Users/azeez/Downloads/language_test_imgs"
-    llm_model = "gpt-4o" if args.use_openai else "llava-llama3"
-    result_directory = os.path.join(input_directory, 'results')
-    result_directory = os.path.join(result_directory, llm_model + "_" + str(pd.Timestamp.now().replace(microsecond=0)).replace(" ", "_").replace(":", "-"))
-    os.makedirs(result_directory, exist_ok=True)
+    language_level = "A1"
+    if args.enqueue:
+        os.makedirs(args.queue, exist_ok=True)
+        llm_model = "gpt-4o" if args.use_openai else "llava-llama3"
+        save_run_config(args.queue, {'input_directory': args.input_directory, 'use_openai': args.use_openai, 'language_level': language_level})
+        queue = WorkQueue(os.path.join(args.queue, QUEUE_NAME))
+        print(f"Queued {queue.enqueue(args.input_directory)} new photos for {llm_model}: {queue.counts()}")
+        queue.close()
+        return
+    if args.queue:
+        # workers and the reduce step take the settings of the queue; --input_directory
+        # can point to where this host mounts the photos
+        result_directory = args.queue
+        run_config = load_run_config(result_directory)
+        input_directory = args.input_directory if args.input_directory else run_config['input_directory']
+        use_openai = run_config['use_openai']
+        language_level = run_config['language_level']
+        llm_model = "gpt-4o" if use_openai else "llava-llama3"
+    elif args.resume:
+        result_directory = args.resume
+        run_config = load_run_config(result_directory)
+        input_directory = args.input_directory if args.input_directory else run_config['input_directory']
+        use_openai = run_config['use_openai']
+        language_level = run_config['language_level']
+        llm_model = "gpt-4o" if use_openai else "llava-llama3"
+    else:
+        input_directory = args.input_directory
+        use_openai = args.use_openai
+        llm_model = "gpt-4o" if use_openai else "llava-llama3"
+        result_directory = os.path.join(input_directory, 'results')
+        result_directory = os.path.join(result_directory, llm_model + "_" + str(datetime.now().replace(microsecond=0)).replace(" ", "_").replace(":", "-"))
+        os.makedirs(result_directory, exist_ok=True)
+        save_run_config(result_directory, {'input_directory': input_directory, 'use_openai': use_openai, 'language_level': language_level})
 
-    heic_files, jpg_files = convert_heic_to_jpg(input_directory)
-    img_metadata = [get_img_metadata(img_path) for img_path in heic_files]
+    cache_dir = args.cache_dir if args.cache_dir else os.path.join(input_directory, '.cache')
+    max_age = args.cache_max_age_days * 24 * 3600 if args.cache_max_age_days is not None else None
+    response_cache = DiskCache(os.path.join(cache_dir, 'responses.sqlite'), max_entries=args.cache_max_entries, max_age=max_age, enabled=not args.no_cache)
 
-    language_level = "A1"
-    prompt = """
+    ocr_preprocess = {'max_side': args.ocr_max_side, 'binarize': args.ocr_binarize} if args.ocr_max_side or args.ocr_binarize else None
+
+    if args.reduce:
+        reduce_results(args, result_directory, input_directory, cache_dir)
+        response_cache.close()
+        return
+
+    # the full prompt and the extraction-only prompt of cluster members share the
+    # introduction, the cleaning steps and the JSON schema
+    prompt_intro = """
     Please help me clean up and extract German words from the following OCR output to build a study guide for German vocabulary at the {language_level} level.
     OCR output:
     {ocr_output}
@@ -76,7 +296,16 @@ def main():
     1. Clean the OCR output by removing any non-alphabetic characters, punctuation, numbers, non-unicode, and any text that clearly does not represent valid words in any language (e.g., "ae", "ee", "f").
     2. Identify and extract all valid German words from the cleaned-up text. Ensure that these words are found in the German dictionary.
     3. Exclude any English words or phrases and ensure only valid German words are included.
-    4. Convert the extracted German words to lowercase, remove any duplicates, and add the proper articles to all nouns (der, die, das).
+    4. Convert the extracted German words to lowercase, remove any duplicates, and add the proper articles to all nouns (der, die, das)."""
+    prompt_schema = """
+
+    JSON schema:
+    'extracted_words':[],'translated_extracted_words':[],'suggested_words':[],'translated_suggested_words':[],
+    'image_quality':"", "relevance_explanation":"", "quality_explanation":""
+    
+    End of response. Please do not add any text or characters after the JSON object to ensure it can be parsed correctly.
+    """
+    prompt = prompt_intro + """
     5. Use your visual understanding of the image to confirm the extracted German words and their relevance to the scene.
     6. Based on your understanding of the scene and your visual analysis, suggest additional German words and small phrases (nouns, weather conditions, verbs, relationships, adjectives) that are relevant to the image and appropriate for the {language_level} level.
     7. Validate the suggested words and phrases to ensure they are all valid German words.
@@ -87,30 +316,125 @@ def main():
     12. Ensure that if a word is a noun, it includes the proper article infront of it (der, die, das).
     13. Fill in the provided JSON template with the extracted words, suggested words and phrases, their translations, and the quality flag.
     14. **IMPORTANT**: The response must start with the marker "JSON_START:" followed by the JSON object.
-    Please return the filled-in JSON object as the last part of your response, and precede it immediately with the marker "JSON_START:" Then immediatly return the json
+    Please return the filled-in JSON object as the last part of your response, and precede it immediately with the marker "JSON_START:" Then immediatly return the json""" + prompt_schema
 
-    JSON schema:
-    'extracted_words':[],'translated_extracted_words':[],'suggested_words':[],'translated_suggested_words':[],
-    'image_quality':"", "relevance_explanation":"", "quality_explanation":""
-    
-    End of response. Please do not add any text or characters after the JSON object to ensure it can be parsed correctly.
-    """
+    # single and batched requests share one rate limit and backoff
+    rate_limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    ollama_pool = None
+    batch_query_fn = None
+    member_query_fn = None
+    repair_fn = None
+    stream = not args.no_stream
+    # photos after the first of a cluster only need their own words extracted, the
+    # suggested words of the scene come from the first photo
+    extraction_prompt = prompt_intro + """
+    5. Use your visual understanding of the image to confirm the extracted German words.
+    6. Assess the quality of the OCR text and assign a quality flag (high, medium, or low) based on the clarity and completeness of the extracted words, and explain the rating in one sentence.
+    7. Provide English translations for each extracted German word. Ensure that all translations are accurate and complete.
+    8. Do not suggest any additional words, leave "suggested_words" and "translated_suggested_words" empty.
+    9. **IMPORTANT**: The response must start with the marker "JSON_START:" followed by the JSON object.""" + prompt_schema
 
-    if args.use_openai:
+    if use_openai:
         system_prompt = "Please help me clean up and extract German words from the following OCR output to build a study guide for German vocabulary at the {language_level} level. OCR output: {ocr_output}"
-        content_responses, model_responses, ocr_texts = batch_openai_chatGPT_response(prompt, language_level, jpg_files, system_prompt=system_prompt, max_tokens=4096, presence_penalty=0)
+        backoff = SharedBackoff()
+        query_fn = make_openai_query(prompt, language_level, system_prompt=system_prompt, max_tokens=4096, presence_penalty=0,
+                                     cache=response_cache, max_side=args.openai_max_side, backoff=backoff, rate_limiter=rate_limiter, stream=stream)
+        if args.cluster:
+            member_query_fn = make_openai_query(extraction_prompt, language_level, system_prompt=system_prompt, max_tokens=1024, presence_penalty=0,
+                                                cache=response_cache, max_side=args.openai_max_side, backoff=backoff, rate_limiter=rate_limiter, stream=stream)
+        if args.batch_size > 1:
+            batch_query_fn = make_openai_batch_query(prompt, language_level, system_prompt=system_prompt, max_tokens=4096, presence_penalty=0,
+                                                     cache=response_cache, max_side=args.openai_max_side, backoff=backoff, rate_limiter=rate_limiter, stream=stream)
+        repair_model = "gpt-4o-mini"
+        if not args.no_repair:
+            repair_fn = make_openai_repair(model=repair_model, backoff=backoff, rate_limiter=rate_limiter, cache=response_cache)
+        max_workers = args.max_concurrency or 4
     else:
-        content_responses, model_responses, ocr_texts = batch_ocr_llava_response(prompt, language_level, jpg_files, wait=3, chat=True)
+        from src.llm import OllamaPool, get_ollama_backend
+        hosts = args.ollama_host.split(',') if args.ollama_host else [None]
+        if len(hosts) > 1:
+            backend = ollama_pool = OllamaPool(hosts, keep_alive=parse_keep_alive(args.keep_alive))
+        else:
+            backend = get_ollama_backend(host=hosts[0], keep_alive=parse_keep_alive(args.keep_alive))
+        backoff = SharedBackoff(initial_wait=3)
+        query_fn = make_llava_query(prompt, language_level, cache=response_cache, backend=backend, max_side=args.llava_max_side, backoff=backoff, rate_limiter=rate_limiter, stream=stream)
+        if args.cluster:
+            member_query_fn = make_llava_query(extraction_prompt, language_level, cache=response_cache, backend=backend, max_side=args.llava_max_side, backoff=backoff, rate_limiter=rate_limiter, stream=stream)
+        if args.batch_size > 1:
+            batch_query_fn = make_llava_batch_query(prompt, language_level, cache=response_cache, backend=backend, max_side=args.llava_max_side, backoff=backoff, rate_limiter=rate_limiter, stream=stream)
+        # the model that is already loaded repairs its own answers
+        repair_model = llm_model
+        if not args.no_repair:
+            repair_fn = make_llava_repair(model=repair_model, backend=backend, backoff=backoff, rate_limiter=rate_limiter, cache=response_cache)
+        max_workers = args.max_concurrency or 2
 
-    responses_df, metadata_df = build_table_from_responses(content_responses, ocr_texts, img_metadata, jpg_files)
-    photo_df_metadata_cols = ['photo_id', 'image_datetime', 'latitude_ref', 'latitude', 'longitude_ref', 'longitude', 'altitude_ref', 'altitude', 'timestamp', 'date', 'jpg_path']
-    photo_df_response_cols = ['photo_id', 'json_response', 'ocr_text', 'extracted_words', 'translated_extracted_words', 'suggested_words', 'translated_suggested_words', 'image_quality', 'relevance_explanation', 'quality_explanation']
-    photo_df = pd.merge(metadata_df[photo_df_metadata_cols], responses_df[photo_df_response_cols], on='photo_id')
-    vocab_df = build_vocab_table(photo_df, quality_cutoff='low')
+    dedup_index = None
+    if args.dedup:
+        from src.image_utils import PerceptualHashIndex
+        dedup_index = PerceptualHashIndex(os.path.join(cache_dir, 'phash_index.json'))
 
-    vocab_df.to_csv(os.path.join(result_directory, 'vocab_table.csv'), index=False)
-    photo_df.to_csv(os.path.join(result_directory, 'photo_table.csv'), index=False)
-    build_anki_deck(vocab_df, result_directory)
+    clusterer = None
+    if args.cluster:
+        from src.image_utils import PhotoClusterer
+        clusterer = PhotoClusterer(max_distance_m=args.cluster_distance, max_gap_s=args.cluster_gap * 60)
+
+    prepare_options = None
+    if args.prepare_in_memory or args.no_jpg:
+        prepare_options = {'workers': args.workers, 'quality': args.jpg_quality, 'max_size': args.max_image_size, 'write_jpg': not args.no_jpg}
+
+    # every finished image is appended to the journal, so an interrupted run can be resumed;
+    # workers of a queue write their own journal and metrics next to each other
+    worker_id = (args.worker_id or default_worker_id()).replace(os.sep, '_') if args.worker else None
+    suffix = f"_{worker_id}" if worker_id else ""
+    journal = RunJournal(result_directory, filename=f"journal{suffix}.jsonl")
+    metrics = MetricsRecorder(os.path.join(result_directory, f'metrics{suffix}.jsonl'))
+    convert_options = {'workers': args.workers, 'quality': args.jpg_quality, 'max_size': args.max_image_size}
+    if args.worker:
+        # the conversion manifest is not shared between processes
+        convert_options['use_manifest'] = False
+    pipeline_options = dict(
+        convert_options=convert_options,
+        ocr_options={'preprocess': ocr_preprocess, 'workers': args.ocr_workers, 'cache': response_cache},
+        max_workers=max_workers,
+        dedup_index=dedup_index,
+        dedup_options={'max_distance': args.dedup_distance},
+        model=llm_model,
+        metrics=metrics,
+        metadata_options={'workers': args.metadata_workers, 'cache': response_cache},
+        prepare_options=prepare_options,
+        batch_query_fn=batch_query_fn,
+        batch_size=args.batch_size,
+        repair_fn=repair_fn,
+        repair_model=repair_model,
+        clusterer=clusterer,
+        member_query_fn=member_query_fn,
+    )
+    try:
+        if args.worker:
+            # the tables and the deck are written by --reduce once every worker is done
+            queue = WorkQueue(os.path.join(result_directory, QUEUE_NAME), lease_seconds=args.lease_seconds)
+            try:
+                run_worker(queue, worker_id, input_directory, journal, query_fn, lease_size=args.lease_size, **pipeline_options)
+            finally:
+                queue.close()
+        else:
+            run_pipeline(input_directory, journal, query_fn, **pipeline_options)
+            write_results(journal, result_directory, vocab_store=open_vocab_store(args, input_directory), deck_index_path=deck_index_file(args, cache_dir),
+                          deck_shard_by=args.deck_shard_by, metrics=metrics, clusterer=clusterer)
+    finally:
+        journal.close()
+        metrics.close()
+
+    if ollama_pool is not None:
+        for server in ollama_pool.stats():
+            print(f"ollama {server['host']}: {server['requests']} requests, {server['latency_s']:.1f}s average response time")
+    metrics.write_summary(os.path.join(result_directory, f'metrics_summary{suffix}.csv'))
+    metrics.print_summary()
+
+    if response_cache.enabled:
+        cache_stats = response_cache.stats()
+        print(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    response_cache.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,139 @@
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# USD per 1M (prompt, completion) tokens, local models are free
+MODEL_PRICES = {
+    'gpt-4o': (5.00, 15.00),
+    'gpt-4o-mini': (0.15, 0.60),
+}
+
+def _get(obj, key):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+def usage_from_response(response):
+    # ollama reports prompt_eval_count/eval_count, OpenAI a usage object
+    usage = _get(response, 'usage')
+    if usage is not None:
+        return {
+            'prompt_tokens': _get(usage, 'prompt_tokens'),
+            'completion_tokens': _get(usage, 'completion_tokens'),
+        }
+    if _get(response, 'eval_count') is not None:
+        eval_duration = _get(response, 'eval_duration')
+        return {
+            'prompt_tokens': _get(response, 'prompt_eval_count'),
+            'completion_tokens': _get(response, 'eval_count'),
+            'eval_s': eval_duration / 1e9 if eval_duration else None,
+            'model_total_s': _get(response, 'total_duration') / 1e9 if _get(response, 'total_duration') else None,
+        }
+    return {}
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    return ((prompt_tokens or 0) * prices[0] + (completion_tokens or 0) * prices[1]) / 1e6
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * q
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+class MetricsRecorder:
+    # Collects one event per stage and image. Events are appended to metrics.jsonl
+    # as they happen and summarised per stage at the end of the run.
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8') if path else None
+
+    def record(self, stage, image_id=None, **fields):
+        event = {'stage': stage, 'image_id': image_id, 'timestamp': time.time()}
+        event.update({k: v for k, v in fields.items() if v is not None})
+        with self._lock:
+            self.events.append(event)
+            if self._file is not None:
+                self._file.write(json.dumps(event, default=str) + '\n')
+                self._file.flush()
+        return event
+
+    @contextmanager
+    def stage(self, stage, image_id=None, **fields):
+        # the yielded dict can be filled with extra fields (tokens, bytes) inside the block
+        start = time.perf_counter()
+        extra = dict(fields)
+        try:
+            yield extra
+        except Exception as e:
+            extra['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.record(stage, image_id, wall_s=time.perf_counter() - start, **extra)
+
+    def record_llm(self, stage, image_id, model, response, wall_s):
+        usage = usage_from_response(response)
+        cached = bool(_get(response, 'cached'))
+        if cached:
+            # a cached response costs nothing, the usage of the original request is kept apart
+            usage = {'cached_prompt_tokens': usage.get('prompt_tokens'), 'cached_completion_tokens': usage.get('completion_tokens')}
+            cost = 0.0
+        else:
+            cost = estimate_cost(model, usage.get('prompt_tokens'), usage.get('completion_tokens'))
+        return self.record(stage, image_id, model=model, wall_s=wall_s, cached=cached, cost_usd=cost, **usage)
+
+    def summary(self):
+        stages = {}
+        for event in self.events:
+            stages.setdefault(event['stage'], []).append(event)
+        rows = []
+        for stage, events in stages.items():
+            wall = [e['wall_s'] for e in events if 'wall_s' in e]
+            rows.append({
+                'stage': stage,
+                'count': len(events),
+                'errors': sum(1 for e in events if 'error' in e),
+                'total_s': round(sum(wall), 3),
+                'p50_s': round(percentile(wall, 0.5), 3) if wall else None,
+                'p95_s': round(percentile(wall, 0.95), 3) if wall else None,
+                'max_s': round(max(wall), 3) if wall else None,
+                'bytes_read': sum(e.get('bytes_read', 0) for e in events),
+                'prompt_tokens': sum(e.get('prompt_tokens') or 0 for e in events),
+                'completion_tokens': sum(e.get('completion_tokens') or 0 for e in events),
+                'cached_tokens': sum((e.get('cached_prompt_tokens') or 0) + (e.get('cached_completion_tokens') or 0) for e in events),
+                'cost_usd': round(sum(e.get('cost_usd', 0.0) for e in events), 4),
+            })
+        return rows
+
+    def write_summary(self, path):
+        rows = self.summary()
+        if not rows:
+            return rows
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        return rows
+
+    def print_summary(self):
+        rows = self.summary()
+        print(f"{'stage':<12}{'count':>7}{'errors':>8}{'total_s':>10}{'p50_s':>9}{'p95_s':>9}{'tokens':>10}{'cost_usd':>10}")
+        for row in rows:
+            tokens = row['prompt_tokens'] + row['completion_tokens']
+            print(f"{row['stage']:<12}{row['count']:>7}{row['errors']:>8}{row['total_s']:>10.2f}{row['p50_s'] or 0:>9.2f}{row['p95_s'] or 0:>9.2f}{tokens:>10}{row['cost_usd']:>10.4f}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1 +1,22 @@
-from .text_extraction import *
\ No newline at end of file
+import importlib
+
+# cv2/pytesseract are only imported once OCR actually runs
+_LAZY_ATTRS = {
+    'preprocess_for_ocr': '.text_extraction',
+    'run_tesseract': '.text_extraction',
+    'ocr_cache_key': '.text_extraction',
+    'extract_ocr_text': '.text_extraction',
+    'extract_ocr_text_from_array': '.text_extraction',
+    'iter_ocr_text': '.text_extraction',
+    'batch_extract_ocr_text': '.text_extraction',
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return __all__
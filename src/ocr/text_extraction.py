@@ -1,7 +1,151 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import cv2
+import numpy as np
 import pytesseract
 
-def extract_ocr_text(image_path):
-    image = cv2.imread(image_path)
-    text = pytesseract.image_to_string(image, lang='deu')
-    return text
\ No newline at end of file
+from ..cache import bytes_hash, make_key
+
+try:
+    # persistent in-process tesseract binding, avoids one subprocess per image
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+_local = threading.local()
+
+def preprocess_for_ocr(image, max_side=None, grayscale=True, binarize=False):
+    if max_side and max(image.shape[:2]) > max_side:
+        scale = max_side / max(image.shape[:2])
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if (grayscale or binarize) and image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if binarize:
+        _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return image
+
+def _tesserocr_api(lang):
+    apis = getattr(_local, 'apis', None)
+    if apis is None:
+        apis = _local.apis = {}
+    if lang not in apis:
+        kwargs = {'path': os.environ['TESSDATA_PREFIX']} if 'TESSDATA_PREFIX' in os.environ else {}
+        apis[lang] = tesserocr.PyTessBaseAPI(lang=lang, **kwargs)
+    return apis[lang]
+
+def run_tesseract(image, lang='deu'):
+    if tesserocr is None:
+        return pytesseract.image_to_string(image, lang=lang)
+    from PIL import Image
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    api = _tesserocr_api(lang)
+    api.SetImage(Image.fromarray(image))
+    return api.GetUTF8Text()
+
+def ocr_cache_key(image_bytes, lang='deu', preprocess=None):
+    return make_key('tesseract', lang, bytes_hash(image_bytes), preprocess or {})
+
+def _ocr_image_bytes(image_bytes, lang='deu', preprocess=None):
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if preprocess:
+        image = preprocess_for_ocr(image, **preprocess)
+    return run_tesseract(image, lang=lang)
+
+def _ocr_path(image_path, lang='deu', preprocess=None):
+    start = time.perf_counter()
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    text = _ocr_image_bytes(image_bytes, lang=lang, preprocess=preprocess)
+    return text, {'cached': False, 'wall_s': time.perf_counter() - start, 'bytes_read': len(image_bytes)}
+
+def _extract_with_stats(image_path, lang='deu', preprocess=None, cache=None):
+    start = time.perf_counter()
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    key = ocr_cache_key(image_bytes, lang, preprocess)
+    text = cache.get(key) if cache is not None else None
+    cached = text is not None
+    if not cached:
+        text = _ocr_image_bytes(image_bytes, lang=lang, preprocess=preprocess)
+        if cache is not None:
+            cache.put(key, text)
+    return text, {'cached': cached, 'wall_s': time.perf_counter() - start, 'bytes_read': len(image_bytes)}
+
+def _extract_or_exception(image_path, lang='deu', preprocess=None, cache=None):
+    try:
+        return _extract_with_stats(image_path, lang=lang, preprocess=preprocess, cache=cache)
+    except Exception as e:
+        return e, {'error': f"{type(e).__name__}: {e}"}
+
+# OCR of an already decoded array (e.g. PreparedImage.ocr_input()), memoised by the
+# content hash of the source image when one is given.
+def extract_ocr_text_from_array(image, content_hash=None, lang='deu', preprocess=None, cache=None, with_stats=False):
+    start = time.perf_counter()
+    key = make_key('tesseract', lang, content_hash, preprocess or {}, list(image.shape)) if content_hash else None
+    text = cache.get(key) if cache is not None and key is not None else None
+    cached = text is not None
+    if not cached:
+        if preprocess:
+            image = preprocess_for_ocr(image, **preprocess)
+        text = run_tesseract(image, lang=lang)
+        if cache is not None and key is not None:
+            cache.put(key, text)
+    if with_stats:
+        return text, {'cached': cached, 'wall_s': time.perf_counter() - start, 'bytes_read': 0}
+    return text
+
+def extract_ocr_text(image_path, lang='deu', preprocess=None, cache=None):
+    text, _ = _extract_with_stats(image_path, lang=lang, preprocess=preprocess, cache=cache)
+    return text
+
+# Yields OCR text in input order while up to `prefetch` images are being read ahead
+# in a process pool, so callers can overlap OCR of the next images with other work.
+# With return_exceptions, a failing image yields its exception instead of stopping.
+# with_stats yields (text, stats) with the OCR time, bytes read and cache hit flag.
+def iter_ocr_text(image_paths, lang='deu', preprocess=None, workers=None, cache=None, prefetch=None, return_exceptions=False, with_stats=False):
+    def output(text, stats):
+        return (text, stats) if with_stats else text
+
+    if workers == 1:
+        extract = _extract_or_exception if return_exceptions else _extract_with_stats
+        for image_path in image_paths:
+            yield output(*extract(image_path, lang=lang, preprocess=preprocess, cache=cache))
+        return
+
+    workers = workers or os.cpu_count()
+    prefetch = prefetch or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        def resolve(entry):
+            key, cached, future = entry
+            if future is None:
+                return output(cached, {'cached': True})
+            if return_exceptions and future.exception() is not None:
+                e = future.exception()
+                return output(e, {'error': f"{type(e).__name__}: {e}"})
+            text, stats = future.result()
+            if cache is not None and key is not None:
+                cache.put(key, text)
+            return output(text, stats)
+
+        for image_path in image_paths:
+            key, cached, future = None, None, None
+            if cache is not None and os.path.exists(image_path):
+                with open(image_path, 'rb') as f:
+                    key = ocr_cache_key(f.read(), lang, preprocess)
+                cached = cache.get(key)
+            if cached is None:
+                future = executor.submit(_ocr_path, image_path, lang, preprocess)
+            pending.append((key, cached, future))
+            if len(pending) >= prefetch:
+                yield resolve(pending.popleft())
+        while pending:
+            yield resolve(pending.popleft())
+
+def batch_extract_ocr_text(image_paths, lang='deu', preprocess=None, workers=None, cache=None):
+    return list(iter_ocr_text(image_paths, lang=lang, preprocess=preprocess, workers=workers, cache=cache))
@@ -0,0 +1,3 @@
+from .journal import *
+from .stages import *
+from .work_queue import *
@@ -0,0 +1,76 @@
+import os
+import glob
+import json
+
+RUN_CONFIG_NAME = "run.json"
+
+def save_run_config(result_directory, config):
+    with open(os.path.join(result_directory, RUN_CONFIG_NAME), "w") as f:
+        json.dump(config, f, indent=2)
+
+def load_run_config(result_directory):
+    with open(os.path.join(result_directory, RUN_CONFIG_NAME), "r") as f:
+        return json.load(f)
+
+class RunJournal:
+    # Append-only JSONL log with one record per finished (or failed) image. The
+    # latest record for an image wins, so failed images are retried on resume.
+    def __init__(self, result_directory, filename="journal.jsonl"):
+        self.path = os.path.join(result_directory, filename)
+        self._records = {}
+        if os.path.exists(self.path):
+            self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        # drop a partially written last line left behind by a crash
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        for line in data[:end].decode("utf-8").splitlines():
+            if line.strip():
+                record = json.loads(line)
+                self._records[record["image_id"]] = record
+
+    def get(self, image_id):
+        return self._records.get(image_id)
+
+    def is_done(self, image_id):
+        record = self._records.get(image_id)
+        return record is not None and "error" not in record
+
+    def append(self, record):
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._records[record["image_id"]] = record
+
+    def records(self):
+        return [self._records[k] for k in sorted(self._records) if "error" not in self._records[k]]
+
+    def failed(self):
+        return [self._records[k] for k in sorted(self._records) if "error" in self._records[k]]
+
+    def close(self):
+        self._file.close()
+
+WORKER_JOURNAL_PATTERN = "journal_*.jsonl"
+
+# Folds the journals written by the workers of a work queue into the journal of the
+# result directory. A finished record wins over a failed one, so an image that failed
+# on one worker and succeeded after its lease moved to another counts as finished.
+def merge_journals(result_directory, pattern=WORKER_JOURNAL_PATTERN):
+    journal = RunJournal(result_directory)
+    for path in sorted(glob.glob(os.path.join(result_directory, pattern))):
+        worker_journal = RunJournal(result_directory, filename=os.path.basename(path))
+        worker_journal.close()
+        for record in worker_journal.records():
+            if not journal.is_done(record["image_id"]):
+                journal.append(record)
+        for record in worker_journal.failed():
+            if journal.get(record["image_id"]) is None:
+                journal.append(record)
+    return journal
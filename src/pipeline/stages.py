@@ -0,0 +1,407 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from ..llm.batching import BatchParseError
+from ..llm.dispatch import dispatch_iter
+
+# Each stage takes and yields per-image record dicts. A failing image gets an
+# "error" entry, is passed through the remaining stages untouched and ends up in
+# the journal, so one bad image never stops the run.
+
+def _fail(record, stage, e):
+    record["error"] = f"{type(e).__name__}: {e}"
+    record["failed_stage"] = stage
+    logging.error(f"{record['image_id']} failed in {stage} stage: {record['error']}")
+
+# Stage dependencies are imported inside the stages, so only the stages that run
+# load their libraries.
+
+def convert_stage(input_directory, journal=None, workers=1, quality=75, max_size=None, metrics=None, filenames=None, use_manifest=True):
+    from ..image_utils.image_conversion import iter_heic_to_jpg
+    for heic_path, jpg_path, stats in iter_heic_to_jpg(input_directory, workers=workers, quality=quality, max_size=max_size, use_manifest=use_manifest,
+                                                       with_stats=True, filenames=filenames, return_exceptions=True):
+        image_id = os.path.basename(heic_path)
+        if journal is not None and journal.is_done(image_id):
+            continue
+        if metrics is not None:
+            metrics.record("convert", image_id, **stats)
+        if isinstance(jpg_path, Exception):
+            record = {"image_id": image_id, "heic_path": heic_path, "jpg_path": None}
+            _fail(record, "convert", jpg_path)
+            yield record
+            continue
+        yield {"image_id": image_id, "heic_path": heic_path, "jpg_path": jpg_path}
+
+# Decodes every photo once into a PreparedImage ("prepared") that the later stages
+# share instead of reading the JPG again. The JPG is still written unless write_jpg
+# is off, in which case jpg_path names the HEIC file.
+def prepare_stage(input_directory, journal=None, workers=4, quality=75, max_size=None, write_jpg=True, metrics=None, filenames=None):
+    from ..image_utils.image_preparation import prepare_image
+    jpg_dir = os.path.join(input_directory, "jpg")
+    filenames = sorted(f for f in (os.listdir(input_directory) if filenames is None else filenames) if os.path.splitext(f)[1].lower() == ".heic")
+    if write_jpg and filenames:
+        os.makedirs(jpg_dir, exist_ok=True)
+
+    def prepare(filename):
+        heic_path = os.path.join(input_directory, filename)
+        jpg_path = os.path.join(jpg_dir, os.path.splitext(filename)[0] + ".jpg") if write_jpg else heic_path
+        record = {"image_id": filename, "heic_path": heic_path, "jpg_path": jpg_path}
+        start = time.perf_counter()
+        try:
+            record["prepared"] = prepare_image(heic_path, jpg_path=jpg_path if write_jpg else None, jpg_max_side=max_size, jpg_quality=quality)
+        except Exception as e:
+            _fail(record, "prepare", e)
+        if metrics is not None:
+            metrics.record("prepare", filename, wall_s=time.perf_counter() - start, bytes_read=os.path.getsize(heic_path), error=record.get("error"))
+        return record
+
+    pending = [f for f in filenames if journal is None or not journal.is_done(f)]
+    yield from dispatch_iter(prepare, pending, max_workers=workers or os.cpu_count())
+
+# Marks near-duplicate shots with "duplicate_of", the image (key) of their representative
+# from this run or a previous one. Hashes are computed per chunk of images, from the
+# prepared arrays when the records carry them. A duplicate of a prepared image of this
+# run shares the representative's decoded image instead of keeping its own.
+def dedup_stage(records, index, max_distance=6, method='phash', chunk_size=64, key="jpg_path"):
+    from ..image_utils.image_dedup import find_near_duplicates
+    chunk = []
+    prepared_images = {}
+
+    def flush():
+        candidates = [r for r in chunk if "error" not in r]
+        images = [r["prepared"].resized(256) if "prepared" in r else r[key] for r in candidates]
+        try:
+            representatives = find_near_duplicates([r[key] for r in candidates], index=index, max_distance=max_distance, method=method, images=images)
+        except Exception as e:
+            logging.error(f"Skipping duplicate detection for {len(candidates)} images: {e}")
+            representatives = [r[key] for r in candidates]
+        for record, representative in zip(candidates, representatives):
+            if representative == record[key]:
+                if "prepared" in record:
+                    prepared_images[representative] = record["prepared"]
+                continue
+            record["duplicate_of"] = representative
+            # None when the representative is from an earlier run or already released
+            source = prepared_images[representative].retain() if representative in prepared_images else None
+            if source is not None and "prepared" in record:
+                record.pop("prepared").release()
+                record["prepared"] = source
+        index.save()
+
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            flush()
+            yield from chunk
+            chunk = []
+    if chunk:
+        flush()
+        yield from chunk
+
+# EXIF reads are small and I/O bound, so they run in threads while the conversion
+# workers are still decoding the next photos.
+def metadata_stage(records, workers=4, cache=None, metrics=None):
+    from ..image_utils.image_metadata import get_img_metadata
+
+    def process(record):
+        if "error" not in record:
+            start = time.perf_counter()
+            try:
+                record["metadata"] = get_img_metadata(record["heic_path"], cache=cache)
+            except Exception as e:
+                _fail(record, "metadata", e)
+            if metrics is not None:
+                metrics.record("metadata", record["image_id"], wall_s=time.perf_counter() - start, error=record.get("error"))
+        return record
+
+    yield from dispatch_iter(process, records, max_workers=workers)
+
+# Groups photos taken close together in space and time. Every record gets a
+# "cluster_id", the image_id of the earliest photo of its cluster so far; a later
+# photo can still merge two clusters, clusterer.cluster_of gives the final id. The
+# photos of earlier runs in the journal are added first so a resumed run keeps their
+# clusters.
+def cluster_stage(records, clusterer, journal=None):
+    if journal is not None:
+        for record in journal.records():
+            clusterer.add_metadata(record["image_id"], record.get("metadata"))
+    for record in records:
+        if "error" not in record:
+            record["cluster_id"] = clusterer.add_metadata(record["image_id"], record.get("metadata"))
+        yield record
+
+def _is_cluster_member(record):
+    return record.get("cluster_id", record["image_id"]) != record["image_id"]
+
+def _has_text(ocr_text, min_words=1):
+    return len(re.findall(r"[^\W\d_]{3,}", ocr_text or "")) >= min_words
+
+# Cluster members without readable text are not sent to the model, the suggested
+# words of their scene come from the first photo of the cluster.
+NO_TEXT_RESPONSE = "JSON_START:" + json.dumps({
+    "extracted_words": [],
+    "translated_extracted_words": [],
+    "suggested_words": [],
+    "translated_suggested_words": [],
+    "image_quality": "low",
+    "relevance_explanation": "Suggested words are shared with the first photo of the cluster.",
+    "quality_explanation": "OCR found no text.",
+})
+
+# OCR of prepared records runs in threads on the shared grayscale array. A duplicate
+# uses its representative's image, so OCR and the model see the same pixels as for
+# the representative and hit the caches. dedup_stage already shares the images of
+# this run; a representative of an earlier run is decoded from disk here.
+def _prepared_ocr_stage(records, preprocess=None, workers=None, cache=None, metrics=None):
+    from ..image_utils.image_preparation import PreparedImage
+    from ..ocr.text_extraction import extract_ocr_text_from_array
+    max_side = (preprocess or {}).get("max_side")
+
+    def process(record):
+        if "error" in record:
+            return record
+        try:
+            if "duplicate_of" in record and record["prepared"].source_path != record["duplicate_of"]:
+                record.pop("prepared").release()
+                record["prepared"] = PreparedImage.load(record["duplicate_of"])
+            prepared = record["prepared"]
+            record["ocr_text"], stats = extract_ocr_text_from_array(prepared.ocr_input(max_side), content_hash=prepared.content_hash, preprocess=preprocess, cache=cache, with_stats=True)
+        except Exception as e:
+            _fail(record, "ocr", e)
+            stats = {"error": record["error"]}
+        if metrics is not None:
+            metrics.record("ocr", record["image_id"], **stats)
+        return record
+
+    yield from dispatch_iter(process, records, max_workers=workers or os.cpu_count())
+
+def ocr_stage(records, preprocess=None, workers=None, cache=None, metrics=None, prepared=False):
+    if prepared:
+        yield from _prepared_ocr_stage(records, preprocess=preprocess, workers=workers, cache=cache, metrics=metrics)
+        return
+    from ..ocr.text_extraction import iter_ocr_text
+    buffered = deque()
+
+    def paths():
+        # failed records are passed through in order without being read
+        for record in records:
+            buffered.append(record)
+            if "error" not in record:
+                yield record.get("duplicate_of", record["jpg_path"])
+
+    for text, stats in iter_ocr_text(paths(), preprocess=preprocess, workers=workers, cache=cache, return_exceptions=True, with_stats=True):
+        while "error" in buffered[0]:
+            yield buffered.popleft()
+        record = buffered.popleft()
+        if isinstance(text, Exception):
+            _fail(record, "ocr", text)
+        else:
+            record["ocr_text"] = text
+        if metrics is not None:
+            metrics.record("ocr", record["image_id"], **stats)
+        yield record
+    while buffered:
+        yield buffered.popleft()
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# query_fn(ocr_text, jpg_path) -> (response text, raw model response), records with a
+# prepared image also pass it as query_fn(..., prepared=...). Duplicates of an image
+# from this run reuse its response, duplicates of an earlier run are queried with the
+# representative image so they hit the response cache.
+# With batch_size > 1, batch_query_fn(ocr_texts, jpg_paths) -> (response texts, raw
+# model response) sends up to batch_size images in one request. A batch whose answer
+# cannot be split per image (BatchParseError) falls back to query_fn per image.
+# Cluster members (cluster_stage) are queried with member_query_fn, a prompt that only
+# extracts words, and are skipped when their OCR text has no words.
+def llm_stage(records, query_fn, max_workers=4, model=None, metrics=None, key="jpg_path", batch_query_fn=None, batch_size=1, member_query_fn=None):
+    representatives = {}
+
+    def register(records):
+        for record in records:
+            if "error" not in record and "duplicate_of" not in record:
+                representatives[record[key]] = (threading.Event(), record)
+            yield record
+
+    def reuse_duplicate(record):
+        source = representatives.get(record.get("duplicate_of"))
+        if source is None:
+            return False
+        source[0].wait()
+        if "response" not in source[1]:
+            return False
+        record["response"] = source[1]["response"]
+        if metrics is not None:
+            metrics.record("llm", record["image_id"], model=model, wall_s=0.0, cached=True, duplicate=True)
+        return True
+
+    def release(record):
+        if record[key] in representatives and "duplicate_of" not in record:
+            representatives[record[key]][0].set()
+
+    def query(record):
+        fn = query_fn
+        if member_query_fn is not None and _is_cluster_member(record):
+            if not _has_text(record["ocr_text"]):
+                record["response"] = NO_TEXT_RESPONSE
+                if metrics is not None:
+                    metrics.record("llm", record["image_id"], model=model, wall_s=0.0, skipped=True)
+                return
+            fn = member_query_fn
+        start = time.perf_counter()
+        try:
+            kwargs = {"prepared": record["prepared"]} if "prepared" in record else {}
+            record["response"], model_response = fn(record["ocr_text"], record.get("duplicate_of", record["jpg_path"]), **kwargs)
+            if metrics is not None:
+                metrics.record_llm("llm", record["image_id"], model, model_response, time.perf_counter() - start)
+        except Exception as e:
+            _fail(record, "llm", e)
+            if metrics is not None:
+                metrics.record("llm", record["image_id"], model=model, wall_s=time.perf_counter() - start, error=record["error"])
+
+    def process(record):
+        if "error" in record or reuse_duplicate(record):
+            return record
+        try:
+            query(record)
+        finally:
+            release(record)
+        return record
+
+    def query_batch(batch):
+        start = time.perf_counter()
+        image_ids = ",".join(r["image_id"] for r in batch)
+        try:
+            kwargs = {"prepared": [r["prepared"] for r in batch]} if all("prepared" in r for r in batch) else {}
+            responses, model_response = batch_query_fn([r["ocr_text"] for r in batch], [r.get("duplicate_of", r["jpg_path"]) for r in batch], **kwargs)
+        except BatchParseError as e:
+            logging.warning(f"Falling back to one request per image for {image_ids}: {e}")
+            if metrics is not None:
+                metrics.record("llm_batch", image_ids, model=model, wall_s=time.perf_counter() - start, images=len(batch), fallback=True)
+            for record in batch:
+                query(record)
+            return
+        except Exception as e:
+            for record in batch:
+                _fail(record, "llm", e)
+            if metrics is not None:
+                metrics.record("llm_batch", image_ids, model=model, wall_s=time.perf_counter() - start, images=len(batch), error=batch[0]["error"])
+            return
+        wall_s = time.perf_counter() - start
+        if metrics is not None:
+            # tokens and cost are recorded once per request, on the batch event
+            metrics.record_llm("llm_batch", image_ids, model, model_response, wall_s)
+        for record, response in zip(batch, responses):
+            record["response"] = response
+            if metrics is not None:
+                metrics.record("llm", record["image_id"], model=model, wall_s=wall_s / len(batch), batched=True)
+
+    def process_batch(batch):
+        # duplicates of an image from this run wait for it and cluster members get their
+        # own prompt, everything else is queried together
+        queried = [r for r in batch if "error" not in r and representatives.get(r.get("duplicate_of")) is None
+                   and not (member_query_fn is not None and _is_cluster_member(r))]
+        try:
+            if len(queried) > 1:
+                query_batch(queried)
+            elif queried:
+                query(queried[0])
+        finally:
+            for record in queried:
+                release(record)
+        for record in batch:
+            if "error" not in record and "response" not in record:
+                process(record)
+        return batch
+
+    if batch_query_fn is None or batch_size <= 1:
+        yield from dispatch_iter(process, register(records), max_workers=max_workers)
+        return
+    for batch in dispatch_iter(process_batch, _batches(register(records), batch_size), max_workers=max_workers):
+        yield from batch
+
+# A response whose JSON cannot be extracted is sent to repair_fn(text, error) ->
+# (repaired text, raw model response), a short text-only request, before falling back
+# to the empty record of parse_json_response_llava. "parse_repair" records the outcome.
+def parse_stage(records, repair_fn=None, model=None, metrics=None):
+    from ..image_utils.build_tables import parse_json_response_llava
+    from ..llm.json_extraction import JSONExtractionError, extract_json
+    for record in records:
+        if "error" not in record:
+            try:
+                record["parsed"] = extract_json(record["response"])
+            except JSONExtractionError as e:
+                record["parsed"] = None
+                if repair_fn is not None:
+                    start = time.perf_counter()
+                    try:
+                        repaired, model_response = repair_fn(record["response"], str(e))
+                        record["parsed"] = extract_json(repaired)
+                        record["parse_repair"] = "repaired"
+                        if metrics is not None:
+                            metrics.record_llm("repair", record["image_id"], model, model_response, time.perf_counter() - start)
+                    except Exception as repair_error:
+                        record["parse_repair"] = "failed"
+                        logging.warning(f"Could not repair the response of {record['image_id']}: {repair_error}")
+                        if metrics is not None:
+                            metrics.record("repair", record["image_id"], model=model, wall_s=time.perf_counter() - start, error=f"{type(repair_error).__name__}: {repair_error}")
+                if record["parsed"] is None:
+                    record["parsed"] = parse_json_response_llava(record["response"])
+        yield record
+
+# With prepare_options the photos are decoded once by prepare_stage instead of being
+# converted to JPG files that every later stage reads and decodes again. filenames
+# limits the run to these photos of input_directory (a lease of the work queue).
+def run_pipeline(input_directory, journal, query_fn, convert_options=None, ocr_options=None, max_workers=4, dedup_index=None, dedup_options=None,
+                 model=None, metrics=None, prepare_options=None, batch_query_fn=None, batch_size=1, repair_fn=None, repair_model=None, metadata_options=None,
+                 clusterer=None, member_query_fn=None, filenames=None):
+    prepared = prepare_options is not None
+    # duplicates are identified by their HEIC file when it is what gets decoded
+    key = "heic_path" if prepared else "jpg_path"
+    if prepared:
+        records = prepare_stage(input_directory, journal=journal, metrics=metrics, filenames=filenames, **prepare_options)
+    else:
+        records = convert_stage(input_directory, journal=journal, metrics=metrics, filenames=filenames, **(convert_options or {}))
+    records = metadata_stage(records, metrics=metrics, **(metadata_options or {}))
+    if clusterer is not None:
+        records = cluster_stage(records, clusterer, journal=journal)
+    if dedup_index is not None:
+        # every record of a chunk holds its decoded image, keep the chunks small
+        dedup_options = dict({"chunk_size": 16} if prepared else {}, **(dedup_options or {}))
+        records = dedup_stage(records, dedup_index, key=key, **dedup_options)
+    records = ocr_stage(records, metrics=metrics, prepared=prepared, **(ocr_options or {}))
+    records = llm_stage(records, query_fn, max_workers=max_workers, model=model, metrics=metrics, key=key, batch_query_fn=batch_query_fn, batch_size=batch_size,
+                        member_query_fn=member_query_fn if clusterer is not None else None)
+    records = parse_stage(records, repair_fn=repair_fn, model=repair_model or model, metrics=metrics)
+
+    n_done, n_failed = 0, 0
+    repairs = {"repaired": 0, "failed": 0}
+    for record in records:
+        if "prepared" in record:
+            record.pop("prepared").release()
+        journal.append(record)
+        if "error" in record:
+            n_failed += 1
+        else:
+            n_done += 1
+            print(f"Finished image {record['image_id']}")
+        if record.get("parse_repair") in repairs:
+            repairs[record["parse_repair"]] += 1
+    print(f"Processed {n_done + n_failed} images: {n_done} succeeded, {n_failed} failed")
+    n_repairs = repairs["repaired"] + repairs["failed"]
+    if n_repairs:
+        print(f"Repaired {repairs['repaired']} of {n_repairs} unparseable responses ({n_repairs / max(n_done, 1):.1%} of responses needed a repair)")
+    return n_done, n_failed
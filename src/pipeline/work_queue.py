@@ -0,0 +1,170 @@
+import os
+import time
+import socket
+import logging
+import sqlite3
+import threading
+
+from .stages import run_pipeline
+
+QUEUE_NAME = "queue.sqlite"
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class WorkQueue:
+    # SQLite job queue with one job per photo, shared by worker processes on one or
+    # several hosts. A worker leases a few photos at a time; a lease that is not
+    # renewed within lease_seconds (the worker died) expires and the photos go to the
+    # next worker that asks. Photos failing max_attempts times are given up on.
+    # Workers on other hosts need the queue on a filesystem with working file locks.
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "image_id TEXT PRIMARY KEY, state TEXT NOT NULL, worker TEXT, lease_until REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until)")
+
+    def _transaction(self, statements):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never lease the same photo
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # Adds the HEIC files of input_directory that are not queued yet and puts failed
+    # photos back in the queue. Returns the number of new jobs.
+    def enqueue(self, input_directory):
+        filenames = sorted(f for f in os.listdir(input_directory) if os.path.splitext(f)[1].lower() == ".heic")
+        now = time.time()
+
+        def statements(conn):
+            before = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            conn.executemany("INSERT OR IGNORE INTO jobs (image_id, state, updated) VALUES (?, 'pending', ?)", [(f, now) for f in filenames])
+            conn.execute("UPDATE jobs SET state = 'pending', attempts = 0, error = NULL, updated = ? WHERE state = 'failed'", (now,))
+            return conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - before
+        return self._transaction(statements)
+
+    # Leases up to n pending photos, or photos whose lease expired, to worker.
+    def lease(self, worker, n=1):
+        now = time.time()
+
+        def statements(conn):
+            rows = conn.execute(
+                "SELECT image_id FROM jobs WHERE (state = 'pending' OR (state = 'leased' AND lease_until < ?)) "
+                "ORDER BY image_id LIMIT ?", (now, n)).fetchall()
+            image_ids = [row[0] for row in rows]
+            conn.executemany(
+                "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE image_id = ?",
+                [(worker, now + self.lease_seconds, now, image_id) for image_id in image_ids])
+            return image_ids
+        return self._transaction(statements)
+
+    def renew(self, worker, image_ids):
+        now = time.time()
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE jobs SET lease_until = ?, updated = ? WHERE image_id = ? AND worker = ? AND state = 'leased'",
+            [(now + self.lease_seconds, now, image_id, worker) for image_id in image_ids]))
+
+    def complete(self, worker, image_id):
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET state = 'done', lease_until = NULL, error = NULL, updated = ? WHERE image_id = ? AND worker = ?",
+            (time.time(), image_id, worker)))
+
+    # A failed photo goes back to the queue until it used up its attempts.
+    def fail(self, worker, image_id, error):
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, lease_until = NULL, error = ?, updated = ? "
+            "WHERE image_id = ? AND worker = ?",
+            (self.max_attempts, error, time.time(), image_id, worker)))
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class _LeaseKeeper:
+    # Renews the leases of the photos a worker is processing until they are finished.
+    def __init__(self, queue, worker):
+        self.queue = queue
+        self.worker = worker
+        self.image_ids = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                self.queue.renew(self.worker, list(self.image_ids))
+            except sqlite3.Error as e:
+                logging.warning(f"Could not renew the leases of {self.worker}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+# Pulls photos from the queue lease_size at a time and runs them through the pipeline
+# (run_pipeline's keyword arguments) until every photo is done or failed. Results go
+# to the worker's own journal; merge_journals folds the journals of all workers.
+# A worker that finds nothing to lease while other workers still hold leases waits,
+# so it can pick up the photos of a worker that died.
+def run_worker(queue, worker, input_directory, journal, query_fn, lease_size=8, poll_interval=10.0, **pipeline_options):
+    done, failed = set(), set()
+    with _LeaseKeeper(queue, worker) as keeper:
+        while True:
+            image_ids = queue.lease(worker, lease_size)
+            if not image_ids:
+                counts = queue.counts()
+                if counts['pending'] == 0 and counts['leased'] == 0:
+                    break
+                time.sleep(poll_interval)
+                continue
+            keeper.image_ids = image_ids
+            errors = {}
+            try:
+                run_pipeline(input_directory, journal, query_fn, filenames=image_ids, **pipeline_options)
+            except Exception as e:
+                # run the unfinished photos one at a time, so only the photo
+                # that breaks the pipeline fails
+                logging.error(f"Worker {worker} failed on {', '.join(image_ids)}, retrying them one by one: {e}")
+                for image_id in image_ids:
+                    if not journal.is_done(image_id):
+                        try:
+                            run_pipeline(input_directory, journal, query_fn, filenames=[image_id], **pipeline_options)
+                        except Exception as e:
+                            errors[image_id] = f"{type(e).__name__}: {e}"
+            for image_id in image_ids:
+                record = journal.get(image_id)
+                if journal.is_done(image_id):
+                    queue.complete(worker, image_id)
+                    done.add(image_id)
+                    failed.discard(image_id)
+                else:
+                    queue.fail(worker, image_id, record["error"] if record is not None else errors.get(image_id, "not processed"))
+                    failed.add(image_id)
+            keeper.image_ids = []
+    print(f"Worker {worker} finished: {len(done)} images succeeded, {len(failed)} failed")
+    return len(done), len(failed)
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+@pytest.fixture
+def make_heic():
+    # writes a small valid HEIC file
+    def make(path, color=(200, 30, 30), size=(64, 48)):
+        import pillow_heif
+        from PIL import Image
+        pillow_heif.register_heif_opener()
+        Image.new('RGB', size, color).save(path, format='HEIF', quality=80)
+        return path
+    return make
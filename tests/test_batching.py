@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from src.llm import BatchParseError
+from src.llm.batching import split_batch_response
+
+def batch(items):
+    return 'JSON_START: ' + json.dumps(items)
+
+def test_entries_are_split_by_image_index():
+    content = batch([{'image_index': 1, 'extracted_words': ['der Eingang']}, {'image_index': 0, 'extracted_words': ['der Ausgang']}])
+    responses = split_batch_response(content, 2)
+    assert [json.loads(r[len('JSON_START:'):]) for r in responses] == [{'extracted_words': ['der Ausgang']}, {'extracted_words': ['der Eingang']}]
+
+@pytest.mark.parametrize('items, message', [
+    ([{'image_index': 0}], 'missing images \\[1\\]'),
+    ([{'image_index': 0}, {'extracted_words': []}], 'without a valid image_index'),
+    ([{'image_index': 0}, {'image_index': 'second'}], 'without a valid image_index'),
+    ([{'image_index': 0}, {'image_index': 0}, {'image_index': 1}], 'image 0 twice'),
+    ([{'image_index': 0}, 'der Eingang'], 'non-object entry'),
+])
+def test_malformed_batches_are_rejected(items, message):
+    with pytest.raises(BatchParseError, match=message):
+        split_batch_response(batch(items), 2)
+
+def test_response_without_array_is_rejected():
+    with pytest.raises(BatchParseError, match='no JSON array'):
+        split_batch_response('JSON_START: {"image_index": 0}', 1)
+    with pytest.raises(BatchParseError, match='not valid JSON'):
+        split_batch_response('JSON_START: [{"image_index": 0,]', 1)
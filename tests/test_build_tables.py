@@ -0,0 +1,26 @@
+import pandas as pd
+
+from src.image_utils.build_tables import VOCAB_COLUMNS, VocabStore, build_vocab_table, vocab_keys
+
+def test_vocab_keys_of_empty_series():
+    keys = vocab_keys(pd.Series([], dtype=object))
+    assert keys.empty
+    assert list(vocab_keys(pd.Series(['Der Hund', 'geöffnet.']))) == ['hund|der', 'geöffnet|']
+
+def test_vocab_store_appends_empty_vocab(tmp_path):
+    store = VocabStore(str(tmp_path / 'vocab'))
+    assert store.append(pd.DataFrame(columns=VOCAB_COLUMNS), run_id='empty').empty
+    assert len(store) == 0
+
+    vocab_df = pd.DataFrame([['p1', 'der Hund', 'the dog', 'extracted'], ['p2', 'Der Hund', 'the dog', 'suggested']], columns=VOCAB_COLUMNS)
+    assert len(store.append(vocab_df, run_id='first')) == 1
+    assert 'der hund' in store
+    assert store.append(pd.DataFrame(columns=VOCAB_COLUMNS), run_id='empty again').empty
+    assert len(VocabStore(str(tmp_path / 'vocab'))) == 1
+
+def test_build_vocab_table_without_usable_photos():
+    photo_df = pd.DataFrame({'photo_id': ['p1'], 'image_quality': ['low'], 'extracted_words': [['der Hund']],
+                             'translated_extracted_words': [['the dog']], 'suggested_words': [[]], 'translated_suggested_words': [[]]})
+    vocab_df = build_vocab_table(photo_df, quality_cutoff='medium')
+    assert vocab_df.empty
+    assert vocab_keys(vocab_df['vocab_word']).empty
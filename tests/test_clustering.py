@@ -0,0 +1,31 @@
+from src.image_utils.image_clustering import PhotoClusterer
+from src.pipeline.stages import _has_text
+
+def test_single_word_sign_has_text():
+    assert _has_text("AUSGANG")
+    assert _has_text("  Apotheke \n 24h")
+    assert not _has_text("")
+    assert not _has_text("| 12 ~ --")
+
+BERLIN = (52.52, 13.405)
+
+def cluster_ids(photos):
+    clusterer = PhotoClusterer(max_distance_m=50.0, max_gap_s=900.0)
+    for key, minutes in photos:
+        clusterer.add(key, BERLIN[0], BERLIN[1], minutes * 60.0)
+    return {key: clusterer.cluster_of(key) for key, _ in photos}
+
+def test_clusters_do_not_depend_on_order():
+    photos = [('a', 0), ('b', 20), ('c', 10)]
+    expected = {'a': 'a', 'b': 'a', 'c': 'a'}
+    assert cluster_ids(photos) == expected
+    assert cluster_ids(photos[::-1]) == expected
+    assert cluster_ids([photos[1], photos[2], photos[0]]) == expected
+
+def test_photos_far_apart_stay_separate():
+    clusterer = PhotoClusterer(max_distance_m=50.0, max_gap_s=900.0)
+    assert clusterer.add('a', BERLIN[0], BERLIN[1], 0.0) == 'a'
+    assert clusterer.add('b', BERLIN[0] + 0.01, BERLIN[1], 60.0) == 'b'
+    assert clusterer.add('c', BERLIN[0], BERLIN[1], 3600.0) == 'c'
+    assert clusterer.add('d', None, None, 0.0) == 'd'
+    assert clusterer.add('e', BERLIN[0], BERLIN[1], 120.0) == 'a'
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from src.image_utils.image_conversion import iter_heic_to_jpg
+from src.pipeline.stages import convert_stage, ocr_stage
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_corrupt_heic_is_recorded_as_failed(tmp_path, make_heic, workers):
+    make_heic(str(tmp_path / 'a.heic'))
+    (tmp_path / 'x.HEIC').write_text('garbage')
+    make_heic(str(tmp_path / 'z.heic'))
+
+    records = list(convert_stage(str(tmp_path), workers=workers))
+
+    assert [r['image_id'] for r in records] == ['a.heic', 'x.HEIC', 'z.heic']
+    assert records[1]['failed_stage'] == 'convert'
+    assert 'error' in records[1]
+    for record in (records[0], records[2]):
+        assert 'error' not in record
+        assert os.path.exists(record['jpg_path'])
+
+def test_iter_heic_to_jpg_raises_without_return_exceptions(tmp_path):
+    (tmp_path / 'x.heic').write_text('garbage')
+    with pytest.raises(Exception):
+        list(iter_heic_to_jpg(str(tmp_path)))
+
+def test_failed_records_pass_through_ocr_in_order():
+    records = [{'image_id': 'a', 'error': 'boom', 'failed_stage': 'convert'},
+               {'image_id': 'b', 'error': 'boom', 'failed_stage': 'convert'}]
+    assert [r['image_id'] for r in ocr_stage(iter(records), workers=1)] == ['a', 'b']
@@ -0,0 +1,24 @@
+import os
+
+import pandas as pd
+
+from src.deck import build_anki_deck
+from src.image_utils.build_tables import VOCAB_COLUMNS
+
+def test_empty_vocabulary_writes_no_deck(tmp_path):
+    index_path = str(tmp_path / 'deck_index.json')
+    assert build_anki_deck(pd.DataFrame(columns=VOCAB_COLUMNS), str(tmp_path), index_path=index_path) == []
+    assert not os.path.exists(index_path)
+
+def test_notes_are_exported_once(tmp_path):
+    index_path = str(tmp_path / 'deck_index.json')
+    vocab_df = pd.DataFrame([['p1', 'der Hund', 'the dog', 'extracted'], ['p2', 'Der Hund.', 'the dog', 'suggested']], columns=VOCAB_COLUMNS)
+    written = build_anki_deck(vocab_df, str(tmp_path), index_path=index_path)
+    assert written == [os.path.join(str(tmp_path), 'german_vocabulary.apkg')]
+    assert os.path.exists(written[0])
+    assert build_anki_deck(vocab_df, str(tmp_path), index_path=index_path) == []
+
+def test_deck_sharded_by_month(tmp_path):
+    vocab_df = pd.DataFrame([['p1', 'der Hund', 'the dog', 'extracted'], ['p2', 'die Katze', 'the cat', 'extracted']], columns=VOCAB_COLUMNS)
+    written = build_anki_deck(vocab_df.assign(month=['2024-06', '2024-07']), str(tmp_path), shard_by='month')
+    assert [os.path.basename(p) for p in written] == ['german_vocabulary_2024-06.apkg', 'german_vocabulary_2024-07.apkg']
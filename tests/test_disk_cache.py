@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from src.cache import DiskCache
+from src.cache import disk_cache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(disk_cache.time, 'time', lambda: now[0])
+    return now
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.get('a') is None
+    cache.put('a', {'content': 'der Ausgang'})
+    assert cache.get('a') == {'content': 'der Ausgang'}
+    assert cache.get('a') == {'content': 'der Ausgang'}
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3}
+    cache.close()
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, key)
+        clock[0] += 1
+    # reading a makes b the least recently used entry
+    assert cache.get('a') == 'a'
+    cache.evict()
+    assert [cache.get(key) for key in ['a', 'b', 'c']] == ['a', None, 'c']
+
+def test_entries_older_than_max_age_are_dropped(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = DiskCache(path, max_age=60)
+    cache.put('old', 'old')
+    clock[0] += 45
+    cache.put('new', 'new')
+    clock[0] += 30
+    assert cache.get('old') is None
+    assert cache.get('new') == 'new'
+    cache.close()
+
+    # close evicted the expired entry, a cache without max_age no longer sees it
+    reopened = DiskCache(path)
+    assert reopened.get('old') is None
+    assert reopened.get('new') == 'new'
+    reopened.close()
+
+def test_disabled_cache_is_bypassed(tmp_path):
+    path = str(tmp_path / 'cache' / 'cache.sqlite')
+    cache = DiskCache(path, enabled=False)
+    cache.put('a', 'a')
+    assert cache.get('a') is None
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'hit_rate': 0.0}
+    cache.close()
+    assert not os.path.exists(path)
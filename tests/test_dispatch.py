@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from src.llm import RateLimiter, ResponseError, SharedBackoff, call_with_backoff, dispatch_iter
+
+@pytest.fixture
+def clock(monkeypatch):
+    # sleeping advances a fake monotonic clock instead of blocking the test
+    now = [1000.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(time, 'sleep', sleep)
+    return sleeps
+
+class RateLimited(Exception):
+    status_code = 429
+
+def test_rate_limiter_waits_for_the_window_to_slide(clock):
+    rate_limiter = RateLimiter(requests_per_minute=2)
+    rate_limiter.acquire()
+    rate_limiter.acquire()
+    assert clock == []
+    rate_limiter.acquire()
+    assert clock == [60.0]
+
+def test_rate_limiter_budgets_tokens(clock):
+    rate_limiter = RateLimiter(tokens_per_minute=1000)
+    rate_limiter.acquire(600)
+    rate_limiter.acquire(400)
+    assert clock == []
+    rate_limiter.acquire(1)
+    assert sum(clock) == 60.0
+    # a request larger than the budget still goes through once the window is empty
+    rate_limiter.acquire(5000)
+    assert sum(clock) == 120.0
+
+def test_backoff_doubles_and_decays(clock):
+    backoff = SharedBackoff(initial_wait=1, max_wait=4)
+    assert [backoff.penalize() for _ in range(4)] == [1, 2, 4, 4]
+    # every worker waits for the longest pause
+    backoff.wait()
+    assert clock == [4]
+    backoff.reset()
+    backoff.reset()
+    backoff.reset()
+    assert backoff.penalize() == 1
+
+def test_call_with_backoff_retries_rate_limits_only(clock):
+    calls = []
+
+    def flaky():
+        calls.append(len(calls))
+        if len(calls) < 3:
+            raise RateLimited()
+        return 'ok'
+    assert call_with_backoff(flaky, backoff=SharedBackoff(initial_wait=1)) == 'ok'
+    assert clock == [1, 2]
+
+    def broken():
+        raise ValueError('bad request')
+    with pytest.raises(ValueError):
+        call_with_backoff(broken)
+
+    def limited():
+        raise RateLimited()
+    with pytest.raises(ResponseError):
+        call_with_backoff(limited, max_retries=3)
+
+def test_dispatch_iter_keeps_input_order():
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def work(i):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        # later items finish first
+        time.sleep(0.01 * (8 - i))
+        with lock:
+            in_flight[0] -= 1
+        return i * i
+    assert list(dispatch_iter(work, range(8), max_workers=3)) == [i * i for i in range(8)]
+    assert in_flight[1] <= 3
+
+def test_dispatch_iter_raises_in_order():
+    def work(i):
+        if i == 2:
+            raise ValueError(i)
+        return i
+    results = dispatch_iter(work, range(5), max_workers=2)
+    assert [next(results), next(results)] == [0, 1]
+    with pytest.raises(ValueError):
+        next(results)
@@ -0,0 +1,48 @@
+import pytest
+
+from src.llm.json_extraction import JSONExtractor, JSONExtractionError, consume_stream, extract_json
+
+def stream(chunks, opening="{"):
+    closed = []
+    seen = []
+
+    def chunk_iter():
+        try:
+            for chunk in chunks:
+                seen.append(chunk)
+                yield chunk
+        finally:
+            closed.append(True)
+    extractor = JSONExtractor(opening=opening)
+    text, last, n_chunks = consume_stream(chunk_iter(), lambda chunk: chunk, extractor)
+    return extractor, n_chunks, closed
+
+def test_brace_before_marker_does_not_end_the_stream():
+    chunks = ['I found these words {see below}. ', 'JSON_START: {"extracted_words": ["der Hund"]', '}', ' trailing']
+    extractor, n_chunks, closed = stream(chunks)
+    assert n_chunks == 3
+    assert closed
+    assert extractor.result() == {"extracted_words": ["der Hund"]}
+
+def test_bracket_before_marker_does_not_end_the_stream():
+    chunks = ['Words [1 of 1]: ', 'JSON_START: [{"word": "der Hund"}', ']']
+    extractor, n_chunks, _ = stream(chunks, opening="[")
+    assert n_chunks == 3
+    assert extractor.result() == [{"word": "der Hund"}]
+
+def test_marker_split_over_chunks():
+    extractor, n_chunks, _ = stream(['{x} JSON_', 'START: {"a": 1}', ' more'])
+    assert n_chunks == 2
+    assert extractor.result() == {"a": 1}
+
+def test_without_marker_first_bracket_is_taken_at_end_of_stream():
+    extractor, n_chunks, _ = stream(['```json\n{"a": ', '[1, 2]}', '\n```'])
+    assert n_chunks == 3
+    assert extractor.result() == {"a": [1, 2]}
+    assert extract_json('Sure: {"a": 1} done') == {"a": 1}
+
+def test_unclosed_value_raises():
+    with pytest.raises(JSONExtractionError):
+        extract_json('JSON_START: {"a": 1')
+    with pytest.raises(JSONExtractionError):
+        extract_json('no json here')
@@ -0,0 +1,16 @@
+from src.metrics import MetricsRecorder
+
+def test_cached_responses_report_tokens_apart():
+    metrics = MetricsRecorder()
+    usage = {'prompt_tokens': 1000, 'completion_tokens': 100}
+    fresh = metrics.record_llm('llm', 'a.HEIC', 'gpt-4o', {'usage': usage}, 1.0)
+    cached = metrics.record_llm('llm', 'b.HEIC', 'gpt-4o', {'usage': usage, 'cached': True}, 0.01)
+    assert fresh['cost_usd'] > 0 and fresh['prompt_tokens'] == 1000
+    assert cached['cost_usd'] == 0.0
+    assert 'prompt_tokens' not in cached and 'completion_tokens' not in cached
+    assert cached['cached_prompt_tokens'] == 1000 and cached['cached_completion_tokens'] == 100
+
+    (row,) = metrics.summary()
+    assert row['prompt_tokens'] == 1000 and row['completion_tokens'] == 100
+    assert row['cached_tokens'] == 1100
+    assert row['cost_usd'] == round(fresh['cost_usd'], 4)
@@ -0,0 +1,38 @@
+import pytest
+
+from benchmarks.fake_backends import CANNED_RESPONSE, FakeBackendServer
+from src.llm.backends import OllamaPool
+from src.llm.llm_interaction import ocr_llava_chat
+
+# nothing listens on port 1, so connecting fails at once
+DEAD_HOST = 'http://127.0.0.1:1'
+
+@pytest.fixture
+def server():
+    with FakeBackendServer() as server:
+        yield server
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_unreachable_server_fails_over(server, tmp_path, stream):
+    image_path = tmp_path / 'a.jpg'
+    image_path.write_bytes(b'image')
+    pool = OllamaPool([DEAD_HOST, server.url])
+    content, _ = ocr_llava_chat('prompt', str(image_path), backend=pool, stream=stream)
+    assert content.strip() == CANNED_RESPONSE
+    assert server.stats['requests'] == 1
+    stats = pool.stats()
+    assert [s['requests'] for s in stats] == [1, 1]
+    assert [s['in_flight'] for s in stats] == [0, 0]
+
+    # the dead server is skipped while it cools down
+    ocr_llava_chat('prompt again', str(image_path), backend=pool, stream=stream)
+    assert [s['requests'] for s in pool.stats()] == [1, 2]
+
+def test_all_servers_unreachable_raises(tmp_path):
+    import httpx
+    image_path = tmp_path / 'a.jpg'
+    image_path.write_bytes(b'image')
+    pool = OllamaPool([DEAD_HOST, 'http://127.0.0.1:2'])
+    with pytest.raises((ConnectionError, httpx.TransportError)):
+        ocr_llava_chat('prompt', str(image_path), backend=pool, stream=True)
+    assert [s['in_flight'] for s in pool.stats()] == [0, 0]
@@ -0,0 +1,5 @@
+from src.llm.backends import OpenAIBackend, get_openai_backend
+
+def test_openai_client_leaves_429s_to_the_shared_backoff():
+    assert get_openai_backend(api_key='test', base_url='http://127.0.0.1:1/v1').client.max_retries == 0
+    assert OpenAIBackend(api_key='test', max_retries=3).client.max_retries == 3
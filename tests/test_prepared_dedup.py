@@ -0,0 +1,71 @@
+import numpy as np
+
+from src.image_utils.image_dedup import PerceptualHashIndex
+from src.image_utils.image_preparation import PreparedImage
+from src.pipeline.stages import dedup_stage, ocr_stage, prepare_stage
+
+class FixedOCRCache:
+    # every image already has its OCR text, so tesseract is not needed
+    def get(self, key):
+        return 'Ausgang'
+
+    def put(self, key, value):
+        pass
+
+def count_loads(monkeypatch):
+    loads = []
+    load = PreparedImage.load.__func__
+
+    def counting_load(cls, image_path):
+        loads.append(image_path)
+        return load(cls, image_path)
+    monkeypatch.setattr(PreparedImage, 'load', classmethod(counting_load))
+    return loads
+
+def run(directory, index):
+    records = prepare_stage(str(directory), workers=2, write_jpg=False)
+    records = dedup_stage(records, index, key="heic_path", chunk_size=16)
+    return list(ocr_stage(records, cache=FixedOCRCache(), prepared=True))
+
+def test_duplicate_shares_the_decoded_image_of_its_representative(tmp_path, make_heic, monkeypatch):
+    make_heic(str(tmp_path / 'a.heic'))
+    make_heic(str(tmp_path / 'b.heic'))
+    loads = count_loads(monkeypatch)
+    a, b = run(tmp_path, PerceptualHashIndex())
+    assert b["duplicate_of"] == a["heic_path"]
+    assert b["prepared"] is a["prepared"]
+    # one decode per photo and none for the duplicate's OCR
+    assert len(loads) == 2
+    assert b["ocr_text"] == 'Ausgang'
+
+    # the image is freed once both records release it
+    shared = b["prepared"]
+    a.pop("prepared").release()
+    assert shared.array is not None
+    b.pop("prepared").release()
+    assert shared.array is None
+
+def test_duplicate_of_an_earlier_run_is_loaded_from_disk(tmp_path, make_heic, monkeypatch):
+    earlier, current = tmp_path / 'earlier', tmp_path / 'current'
+    earlier.mkdir()
+    current.mkdir()
+    index = PerceptualHashIndex()
+    make_heic(str(earlier / 'a.heic'))
+    for record in run(earlier, index):
+        record.pop("prepared").release()
+
+    make_heic(str(current / 'b.heic'))
+    loads = count_loads(monkeypatch)
+    (b,) = run(current, index)
+    assert b["duplicate_of"] == str(earlier / 'a.heic')
+    assert loads == [str(current / 'b.heic'), str(earlier / 'a.heic')]
+    assert b["prepared"].source_path == b["duplicate_of"]
+
+def test_released_image_cannot_be_retained():
+    prepared = PreparedImage(np.zeros((4, 4, 3), dtype=np.uint8), 'a.heic')
+    assert prepared.retain() is prepared
+    prepared.release()
+    assert prepared.array is not None
+    prepared.release()
+    assert prepared.array is None
+    assert prepared.retain() is None
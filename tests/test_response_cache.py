@@ -0,0 +1,88 @@
+import time
+from types import SimpleNamespace
+
+from src.cache import DiskCache
+from src.llm import RateLimiter, SharedBackoff
+from src.main import make_llava_batch_query, make_llava_query, make_openai_query
+
+PROMPT = "Words at the {language_level} level: {ocr_output}"
+RESPONSE = 'JSON_START: {"extracted_words": ["der Ausgang"]}'
+BATCH_RESPONSE = 'JSON_START: [{"image_index": 0, "extracted_words": ["der Ausgang"]}, {"image_index": 1, "extracted_words": ["der Eingang"]}]'
+
+class FakeOllama:
+    def __init__(self):
+        self.requests = 0
+
+    def chat(self, model, messages, stream=False, options=None):
+        self.requests += 1
+        content = BATCH_RESPONSE if len(messages[0].get('images', [])) > 1 else RESPONSE
+        return {'model': model, 'done': True, 'message': {'role': 'assistant', 'content': content}}
+
+class FakeOpenAI:
+    def __init__(self):
+        self.requests = 0
+
+    def chat_completion(self, model, messages, **params):
+        self.requests += 1
+        message = SimpleNamespace(content=RESPONSE)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], model_dump=lambda: {'model': model, 'usage': None})
+
+def blocked():
+    # the only request slot is used up and every worker waits a minute
+    rate_limiter = RateLimiter(requests_per_minute=1)
+    rate_limiter.acquire()
+    backoff = SharedBackoff(initial_wait=60)
+    backoff.penalize()
+    return rate_limiter, backoff
+
+def photo(tmp_path, name='a.jpg'):
+    path = tmp_path / name
+    path.write_bytes(b'not decoded by the fake backends ' + name.encode())
+    return str(path)
+
+def test_cached_llava_responses_skip_backoff_and_rate_limit(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'))
+    backend = FakeOllama()
+    paths = [photo(tmp_path, 'a.jpg'), photo(tmp_path, 'b.jpg')]
+    make_llava_query(PROMPT, 'A1', cache=cache, backend=backend)('Ausgang', paths[0])
+    make_llava_batch_query(PROMPT, 'A1', cache=cache, backend=backend)(['Ausgang', 'Eingang'], paths)
+    assert backend.requests == 2 and cache.misses == 2
+
+    rate_limiter, backoff = blocked()
+    start = time.monotonic()
+    content, response = make_llava_query(PROMPT, 'A1', cache=cache, backend=backend, backoff=backoff, rate_limiter=rate_limiter)('Ausgang', paths[0])
+    responses, batch_response = make_llava_batch_query(PROMPT, 'A1', cache=cache, backend=backend, backoff=backoff, rate_limiter=rate_limiter)(['Ausgang', 'Eingang'], paths)
+    assert time.monotonic() - start < 5
+    assert content == RESPONSE and response['cached'] and batch_response['cached']
+    assert len(responses) == 2
+    assert backend.requests == 2
+    assert cache.stats()['hits'] == 2 and cache.misses == 2
+
+def test_cached_openai_response_skips_backoff_and_rate_limit(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'))
+    backend = FakeOpenAI()
+    path = photo(tmp_path)
+    encoded = 'aW1hZ2U='
+    make_openai_query(PROMPT, 'A1', cache=cache, backend=backend)('Ausgang', path, prepared=SimpleNamespace(openai_payload=lambda max_side: encoded))
+    assert backend.requests == 1 and cache.misses == 1
+
+    rate_limiter, backoff = blocked()
+    start = time.monotonic()
+    query = make_openai_query(PROMPT, 'A1', cache=cache, backend=backend, backoff=backoff, rate_limiter=rate_limiter)
+    content, response = query('Ausgang', path, prepared=SimpleNamespace(openai_payload=lambda max_side: encoded))
+    assert time.monotonic() - start < 5
+    assert content == RESPONSE and response['cached']
+    assert backend.requests == 1 and cache.hits == 1
+
+def test_repairs_are_cached(tmp_path):
+    from src.main import make_llava_repair, make_openai_repair
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'))
+    ollama, openai = FakeOllama(), FakeOpenAI()
+    for _ in range(2):
+        assert make_llava_repair(backend=ollama, cache=cache)('{"extracted_words": [', 'not closed')[0] == RESPONSE
+        assert make_openai_repair(backend=openai, cache=cache)('{"extracted_words": [', 'not closed')[0] == RESPONSE
+    assert ollama.requests == 1 and openai.requests == 1
+    # another error or another response text is a new request
+    make_llava_repair(backend=ollama, cache=cache)('{"extracted_words": [', 'other error')
+    make_llava_repair(backend=ollama, cache=cache)('{"extracted_words": ]', 'not closed')
+    assert ollama.requests == 3
@@ -0,0 +1,72 @@
+import json
+
+from src.pipeline import QUEUE_NAME, RunJournal, WorkQueue, run_worker
+from src.pipeline import work_queue
+
+RESPONSE = 'JSON_START:' + json.dumps({
+    'extracted_words': ['der Ausgang'], 'translated_extracted_words': ['the exit'],
+    'suggested_words': [], 'translated_suggested_words': [],
+    'image_quality': 'high', 'relevance_explanation': '', 'quality_explanation': '',
+})
+
+class FixedOCRCache:
+    # every image reads "Ausgang", so OCR never runs tesseract
+    def get(self, key):
+        return 'Ausgang'
+
+    def put(self, key, value):
+        pass
+
+def query_fn(ocr_text, img_path):
+    return RESPONSE, {}
+
+def make_photos(tmp_path, make_heic, n_valid=4):
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    for i in range(n_valid):
+        make_heic(str(photos / f'photo_{i}.heic'), color=(40 * i, 80, 120))
+    (photos / 'photo_x.HEIC').write_text('garbage')
+    return photos
+
+def test_corrupt_photo_fails_alone(tmp_path, make_heic):
+    photos = make_photos(tmp_path, make_heic)
+    queue = WorkQueue(str(tmp_path / QUEUE_NAME), max_attempts=2)
+    assert queue.enqueue(str(photos)) == 5
+    journal = RunJournal(str(tmp_path), filename='journal_w1.jsonl')
+
+    n_done, n_failed = run_worker(queue, 'w1', str(photos), journal, query_fn, lease_size=8, poll_interval=0.01,
+                                  convert_options={'use_manifest': False}, ocr_options={'workers': 1, 'cache': FixedOCRCache()})
+
+    assert (n_done, n_failed) == (4, 1)
+    assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 4, 'failed': 1}
+    assert journal.get('photo_x.HEIC')['failed_stage'] == 'convert'
+
+def test_pipeline_exception_fails_only_the_breaking_photo(tmp_path, make_heic, monkeypatch):
+    photos = make_photos(tmp_path, make_heic)
+    queue = WorkQueue(str(tmp_path / QUEUE_NAME), max_attempts=3)
+    queue.enqueue(str(photos))
+    journal = RunJournal(str(tmp_path), filename='journal_w1.jsonl')
+
+    def run_pipeline(input_directory, journal, query_fn, filenames=None, **options):
+        if 'photo_x.HEIC' in filenames:
+            raise RuntimeError('broken photo')
+        for filename in filenames:
+            journal.append({'image_id': filename})
+
+    monkeypatch.setattr(work_queue, 'run_pipeline', run_pipeline)
+    n_done, n_failed = run_worker(queue, 'w1', str(photos), journal, query_fn, lease_size=8, poll_interval=0.01)
+
+    # the corrupt photo is retried until it used up its attempts but counts once
+    assert (n_done, n_failed) == (4, 1)
+    assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 4, 'failed': 1}
+
+def test_expired_lease_goes_to_another_worker(tmp_path):
+    (tmp_path / 'a.heic').write_text('')
+    queue = WorkQueue(str(tmp_path / QUEUE_NAME), lease_seconds=0.0)
+    queue.enqueue(str(tmp_path))
+    assert queue.lease('w1', 1) == ['a.heic']
+    assert queue.lease('w2', 1) == ['a.heic']
+    queue.complete('w1', 'a.heic')
+    assert queue.counts()['done'] == 0
+    queue.complete('w2', 'a.heic')
+    assert queue.counts()['done'] == 1
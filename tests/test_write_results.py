@@ -0,0 +1,28 @@
+import json
+import os
+
+from src.main import write_results
+from src.pipeline import RunJournal
+
+PARSED = {'extracted_words': ['der Ausgang'], 'translated_extracted_words': ['the exit'], 'suggested_words': [],
+          'translated_suggested_words': [], 'image_quality': 'high', 'relevance_explanation': 'A sign.',
+          'quality_explanation': 'The text is clear.'}
+METADATA = {'image_datetime': '2024-06-01T09:00:00', 'latitude_ref': 'N', 'latitude': 52.52, 'longitude_ref': 'E',
+            'longitude': 13.405, 'altitude_ref': 0, 'altitude': 34.0, 'timestamp': '09:00:00', 'date': '2024-06-01',
+            'gps_datetime': '2024-06-01T09:00:00+00:00', 'speed_ref': None, 'speed': None}
+
+def test_resumed_run_without_failures_removes_errors_csv(tmp_path):
+    result_directory = str(tmp_path)
+    errors_path = os.path.join(result_directory, 'errors.csv')
+    journal = RunJournal(result_directory)
+    journal.append({'image_id': 'a.HEIC', 'jpg_path': None, 'failed_stage': 'llm', 'error': 'ConnectError: unreachable'})
+    write_results(journal, result_directory)
+    assert os.path.exists(errors_path)
+
+    # the resumed run retries the image and succeeds
+    journal.append({'image_id': 'a.HEIC', 'jpg_path': os.path.join(result_directory, 'a.jpg'), 'ocr_text': 'AUSGANG',
+                    'response': 'JSON_START:' + json.dumps(PARSED), 'parsed': PARSED, 'metadata': METADATA})
+    write_results(journal, result_directory)
+    journal.close()
+    assert not os.path.exists(errors_path)
+    assert os.path.exists(os.path.join(result_directory, 'vocab_table.csv'))